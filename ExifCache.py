@@ -0,0 +1,310 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image, PngImagePlugin
+
+APPLICATION_NAME = 'exif-viewer'
+# text chunk that marks the thumbnails already shown upright according to the EXIF orientation of the image
+ORIENTED_KEY = 'Thumb::X-Oriented'
+TEMPORARY_SUFFIX = '.tmp'
+# temporary files older than this are left by interrupted writes and are deleted
+STALE_TEMPORARY_AGE = 3600  # seconds
+
+
+def user_cache_dir():
+    """
+    Function that return the directory where the application keeps its caches, following the platform conventions
+    :return: path of the cache directory of the application
+    """
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, APPLICATION_NAME)
+
+
+def approximate_size(value):
+    """
+    Function that estimate the memory occupied by a value, visiting recursively its containers
+    :param value: value to measure
+    :return: approximate size in bytes
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(v) for v in value)
+    elif hasattr(value, '__slots__'):
+        size += sum(approximate_size(getattr(value, name, None)) for name in value.__slots__)
+    return size
+
+
+class LRUCache:
+    """
+    This class contains a least recently used cache bounded both by number of entries and by total size.
+    All the methods are thread safe.
+
+    Attributes:
+    max_entries     maximum number of entries kept in the cache
+    max_bytes       maximum total size in bytes of the entries kept in the cache
+    sizeof          function used to measure the size of a value when it is not given explicitly
+    total_bytes     current total size in bytes of the entries
+    hits            number of lookups that found the key
+    misses          number of lookups that did not find the key
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, sizeof=approximate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, default=None, count_miss=True):
+        """
+        Method that return the value associated to a key, marking it as the most recently used
+        :param key: key to search
+        :param default: value returned if the key is not present
+        :param count_miss: False if a miss must not be counted, because the caller looks up the key again
+        :return: value associated to the key, default if the key is not present
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """
+        Method that insert a value into the cache, evicting the least recently used entries if a bound is exceeded.
+        A value larger than the whole cache is not stored.
+        :param key: key of the value
+        :param value: value to insert
+        :param size: size in bytes of the value, if None it is measured with sizeof
+        :return:
+        """
+        if size is None:
+            size = self.sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def remove(self, key):
+        """
+        Method that remove a key from the cache if it is present
+        :param key: key to remove
+        :return:
+        """
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """
+        Method that remove all entries from the cache
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """
+        Method that return the counters of the cache
+        :return: dict with number of entries, total size, hits and misses
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.total_bytes, 'hits': self.hits,
+                    'misses': self.misses}
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+
+class ThumbnailCache:
+    """
+    This class contains a persistent cache of thumbnails, organized like the freedesktop thumbnail specification:
+    each thumbnail is a PNG file named after the MD5 of the URI of the image, carrying in its text chunks the URI,
+    the modification time and the size of the image it was made from.
+    The total size of the cache is bounded, the least recently used thumbnails are deleted first.
+    All the methods are thread safe.
+
+    Attributes:
+    directory   directory that contains the thumbnails
+    max_bytes   maximum total size in bytes of the thumbnails kept on disk
+    hits        number of lookups that found a valid thumbnail
+    misses      number of lookups that did not find a valid thumbnail
+    """
+
+    def __init__(self, directory=None, max_bytes=128 * 1024 * 1024):
+        if directory is None:
+            directory = os.path.join(user_cache_dir(), 'thumbnails')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def open_default():
+        """
+        Method that open the cache in the cache directory of the user
+        :return: an object of class ThumbnailCache, None if the directory can not be created
+        """
+        try:
+            return ThumbnailCache()
+        except OSError as e:
+            print("Thumbnail cache not available: " + str(e))
+            return None
+
+    def get(self, image_name, size):
+        """
+        Method that return the cached thumbnail of an image if it was made from the current version of the file.
+        Corrupted or stale thumbnails are deleted.
+        :param image_name: path of the image
+        :param size: tuple (width, height) of the box that contains the thumbnail
+        :return: the thumbnail, None if the cache has no valid thumbnail for the image
+        """
+        uri, path = self._locate(image_name, size)
+        try:
+            stat_result = os.stat(image_name)
+            thumbnail = Image.open(path)
+            thumbnail.load()
+        except FileNotFoundError:
+            self._count(False)
+            return None
+        except (OSError, SyntaxError):
+            self._delete(path)
+            self._count(False)
+            return None
+        text = getattr(thumbnail, 'text', {})
+        if text.get('Thumb::URI') != uri or text.get('Thumb::MTime') != str(int(stat_result.st_mtime)) or \
+                text.get('Thumb::Size') != str(stat_result.st_size) or text.get(ORIENTED_KEY) != '1':
+            self._delete(path)
+            self._count(False)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if self._entries is not None and path in self._entries:
+                self._entries.move_to_end(path)
+            self.hits += 1
+        return thumbnail
+
+    def put(self, image_name, size, thumbnail):
+        """
+        Method that store the thumbnail of an image, deleting the least recently used thumbnails if the size bound
+        is exceeded. The file is written under a temporary name and then renamed, so that it is never seen partial.
+        :param image_name: path of the image
+        :param size: tuple (width, height) of the box that contains the thumbnail
+        :param thumbnail: the thumbnail to store
+        :return:
+        """
+        uri, path = self._locate(image_name, size)
+        temporary_path = path + '.' + uuid.uuid4().hex + TEMPORARY_SUFFIX
+        try:
+            stat_result = os.stat(image_name)
+            info = PngImagePlugin.PngInfo()
+            info.add_text('Thumb::URI', uri)
+            info.add_text('Thumb::MTime', str(int(stat_result.st_mtime)))
+            info.add_text('Thumb::Size', str(stat_result.st_size))
+            info.add_text(ORIENTED_KEY, '1')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            thumbnail.save(temporary_path, 'PNG', pnginfo=info)
+            os.replace(temporary_path, path)
+            file_size = os.path.getsize(path)
+        except OSError:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._load_entries()
+            self._total_bytes += file_size - self._entries.pop(path, 0)
+            self._entries[path] = file_size
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_path, evicted_size = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                try:
+                    os.remove(evicted_path)
+                except OSError:
+                    pass
+
+    def _locate(self, image_name, size):
+        uri = Path(os.path.abspath(image_name)).as_uri()
+        name = hashlib.md5(uri.encode('utf-8')).hexdigest() + '.png'
+        return uri, os.path.join(self.directory, '%dx%d' % tuple(size), name)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _load_entries(self):
+        # temporary files are not thumbnails: the recent ones may still be being written, the old ones were left by
+        # interrupted writes and are deleted
+        if self._entries is not None:
+            return
+        files = []
+        now = time.time()
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat_result = os.stat(path)
+                    if name.endswith(TEMPORARY_SUFFIX):
+                        if now - stat_result.st_mtime > STALE_TEMPORARY_AGE:
+                            os.remove(path)
+                        continue
+                except OSError:
+                    continue
+                files.append((stat_result.st_mtime, path, stat_result.st_size))
+        files.sort()
+        self._entries = OrderedDict((path, file_size) for _, path, file_size in files)
+        self._total_bytes = sum(self._entries.values())
+
+    def _delete(self, path):
+        with self._lock:
+            if self._entries is not None and path in self._entries:
+                self._total_bytes -= self._entries.pop(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
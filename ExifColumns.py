@@ -0,0 +1,495 @@
+import array
+import calendar
+import os
+import sys
+
+import numpy as np
+
+from PIL.TiffImagePlugin import IFDRational
+
+from ExifCache import approximate_size
+from ExifModel import ImageMetadata
+
+INITIAL_CAPACITY = 1024
+# info of the images not stored, being the base name of their path, or stored in two columns
+NAME_INFO = 'Name file'
+SIZE_INFO = 'Image size'
+# typed columns, with the section of the metadata and the kind of the tag they store
+COLUMNS = {'ISOSpeedRatings': ('exif', 'number'), 'FNumber': ('exif', 'number'),
+           'ExposureTime': ('exif', 'number'), 'FocalLength': ('exif', 'number'),
+           'DateTimeOriginal': ('exif', 'date'), 'DateTime': ('exif', 'date'),
+           'Make': ('exif', 'category'), 'Model': ('exif', 'category'), 'LensModel': ('exif', 'category'),
+           'Extension': ('info', 'category'), 'Creation date': ('info', 'time'),
+           'Modification date': ('info', 'time'), 'Width': ('info', 'size'), 'Height': ('info', 'size')}
+# type of the columns of each kind and value of the rows that do not have the tag
+COLUMN_KINDS = {'number': (np.float64, np.nan), 'date': ('datetime64[s]', np.datetime64('NaT')),
+                'time': ('datetime64[s]', np.datetime64('NaT')), 'category': (np.int32, -1), 'size': (np.int32, -1)}
+MONTHS = {month: number for number, month in enumerate(calendar.month_abbr) if month}
+# values of these types, strings and bytes up to MAX_SHARED_LENGTH and tuples of them are shared by all the records
+# that have them
+SHARED_TYPES = (int, float, IFDRational)
+MAX_SHARED_LENGTH = 64
+MAX_SHARED_TUPLE = 8
+# approximate memory used by an entry of the dict of the shared values, besides the value
+SHARED_ENTRY_SIZE = 200
+
+
+def parse_exif_date(value):
+    """
+    Function that convert a date in the EXIF format 'YYYY:MM:DD HH:MM:SS' into a numpy datetime64
+    :param value: value of the tag
+    :return: the date with a resolution of seconds, None if the value is not a valid date
+    """
+    if isinstance(value, bytes):
+        value = value.decode('latin-1')
+    value = str(value).strip(' \x00')
+    if len(value) != 19 or value[4] != ':' or value[7] != ':' or value[10] != ' ':
+        return None
+    try:
+        return np.datetime64(value[:10].replace(':', '-') + 'T' + value[11:], 's')
+    except ValueError:
+        return None
+
+
+def shared_key(value):
+    """
+    Function that return the key under which a value is shared between the records. The key contains the types of
+    the value, so that equal values of different types, such as 1 and 1.0, are not mistaken for each other.
+    :param value: the value
+    :return: the key, None if the value is not shared
+    """
+    if isinstance(value, (str, bytes)):
+        return (type(value), value) if len(value) <= MAX_SHARED_LENGTH else None
+    if isinstance(value, SHARED_TYPES):
+        return type(value), value
+    if isinstance(value, tuple) and len(value) <= MAX_SHARED_TUPLE:
+        types = tuple(type(item) for item in value)
+        if all(issubclass(item_type, SHARED_TYPES) or item_type in (str, bytes) for item_type in types):
+            if all(len(item) <= MAX_SHARED_LENGTH for item in value if isinstance(item, (str, bytes))):
+                return tuple, types, value
+    return None
+
+
+def parse_ctime(value):
+    """
+    Function that convert a local time in the format of time.ctime, such as 'Sun Mar 14 10:05:00 2021', into a numpy
+    datetime64
+    :param value: the time
+    :return: the time with a resolution of seconds, None if the value is not valid
+    """
+    parts = value.split() if isinstance(value, str) else ()
+    if len(parts) != 5 or parts[1] not in MONTHS:
+        return None
+    try:
+        return np.datetime64('%s-%02d-%02dT%s' % (parts[4], MONTHS[parts[1]], int(parts[2]), parts[3]), 's')
+    except ValueError:
+        return None
+
+
+class TagTable:
+    """
+    This class contains a table of interned values: each distinct value is stored once and is referred to by a small
+    integer code, the position at which it was first added
+
+    Attributes:
+    values      list of the values, by code
+    codes       dict that associates to each value its code
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def code(self, value):
+        """
+        Method that return the code of a value, adding the value to the table if it is not present
+        :param value: the value
+        :return: the code
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def clear(self):
+        """
+        Method that remove all the values from the table
+        :return:
+        """
+        self.values.clear()
+        self.codes.clear()
+
+
+class MetadataRecord:
+    """
+    This class contains the metadata of an image that are not stored in the typed columns
+
+    Attributes:
+    tags        array of the codes of the tags in the table of the tag names
+    values      tuple of the values of the tags, in the same order
+    """
+    __slots__ = ('tags', 'values')
+
+    def __init__(self, tags, values):
+        self.tags = tags
+        self.values = values
+
+
+class ColumnStore:
+    """
+    This class contains the metadata of a whole collection of images in columnar form, so that they cost a small
+    fraction of one dict of Python objects per image. Every image is a row: the common numeric tags are stored in
+    numpy columns of float64, the EXIF dates and the dates of the file in columns of datetime64, make, model, lens and
+    format as int32 codes of per column tables of interned strings and the size of the image in int32 columns; the
+    name of the file is not stored, being the base name of the path. The rest of the tags are kept in one
+    MetadataRecord per image, whose tag names are codes of a single table and whose short values are shared between
+    the records.
+    Sorting the images by capture time and grouping them by camera are then numpy operations on the columns.
+    A removed row is replaced by the last one, so the rows stay contiguous; the order of the rows is not the order of
+    the images in the model.
+    The memory used is accounted as rows are added and removed, so it is reported without visiting the store.
+
+    Attributes:
+    rows            dict that associates to the name of each image its row
+    names           numpy array of the names of the images, by row
+    columns         dict that associates to the name of each column its numpy array, with spare rows at the end
+    categories      dict that associates to the name of each category column its TagTable of strings
+    tags            TagTable of the tuples (section, tag name) of the tags stored in the records, where section is
+                    'info', 'exif' or 'geo'
+    records         list of the MetadataRecord of the images, by row
+    record_bytes    memory used by the records and by the values shared between them
+    version         number incremented at every change of the store, so that what is derived from the columns
+                    knows when it must be computed again
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.rows = {}
+        self.names = np.empty(capacity, dtype=object)
+        self.columns = {}
+        for name, (_, kind) in COLUMNS.items():
+            dtype, missing = COLUMN_KINDS[kind]
+            self.columns[name] = np.full(capacity, missing, dtype=dtype)
+        self.categories = {name: TagTable() for name, (_, kind) in COLUMNS.items() if kind == 'category'}
+        self.tags = TagTable()
+        self.records = []
+        self.record_bytes = 0
+        self.version = 0
+        self._shared = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, image_name):
+        return image_name in self.rows
+
+    def add(self, image_name, metadata):
+        """
+        Method that store the metadata of an image, replacing the ones stored before for the same image.
+        Values of the column tags that can not be converted to the type of the column are kept in the record.
+        :param image_name: name of the image
+        :param metadata: an object of class ImageMetadata
+        :return:
+        """
+        self.remove(image_name)
+        self.version += 1
+        row = len(self.rows)
+        if row == len(self.names):
+            self.__grow()
+        self.rows[image_name] = row
+        self.names[row] = image_name
+        tags = array.array('I')
+        values = []
+        for section, section_values in (('info', metadata.info), ('exif', metadata.exif), ('geo', metadata.geo)):
+            for tag, value in (section_values or {}).items():
+                if section == 'info' and tag == NAME_INFO and value == os.path.basename(image_name):
+                    continue
+                if not self.__store(row, section, tag, value):
+                    tags.append(self.tags.code((section, tag)))
+                    values.append(self.__share(value))
+        record = MetadataRecord(tags, tuple(values))
+        self.records.append(record)
+        self.record_bytes += self.__record_size(record)
+
+    def remove(self, image_name):
+        """
+        Method that remove an image from the store, if it is stored, moving the last row in its place
+        :param image_name: name of the image
+        :return:
+        """
+        row = self.rows.pop(image_name, None)
+        if row is None:
+            return
+        self.version += 1
+        self.record_bytes -= self.__record_size(self.records[row])
+        self.__release(self.records[row])
+        last = len(self.rows)
+        if row != last:
+            last_name = self.names[last]
+            self.rows[last_name] = row
+            self.names[row] = last_name
+            self.records[row] = self.records[last]
+            for column in self.columns.values():
+                column[row] = column[last]
+        self.records.pop()
+        self.names[last] = None
+        for name, column in self.columns.items():
+            column[last] = COLUMN_KINDS[COLUMNS[name][1]][1]
+
+    def clear(self):
+        """
+        Method that remove all the images from the store
+        :return:
+        """
+        self.rows.clear()
+        self.names[:] = None
+        for name, column in self.columns.items():
+            column[:] = COLUMN_KINDS[COLUMNS[name][1]][1]
+        for table in self.categories.values():
+            table.clear()
+        self.tags.clear()
+        self.records.clear()
+        self.record_bytes = 0
+        self.version += 1
+        self._shared.clear()
+
+    def category(self, name, image_name):
+        """
+        Method that return the value of a category column for an image
+        :param name: name of the column
+        :param image_name: name of the image
+        :return: the string, None if the image is not stored or does not have the tag
+        """
+        row = self.rows.get(image_name)
+        if row is None:
+            return None
+        code = self.columns[name][row]
+        return self.categories[name][code] if code >= 0 else None
+
+    def column(self, name):
+        """
+        Method that return the values of a column for all the images
+        :param name: name of the column
+        :return: numpy array with a value for each row, a view on the column
+        """
+        return self.columns[name][:len(self.rows)]
+
+    def capture_times(self):
+        """
+        Method that return the time each image was taken: DateTimeOriginal, or DateTime for the images without it
+        :return: numpy array of datetime64, NaT for the images without either date
+        """
+        original = self.column('DateTimeOriginal')
+        return np.where(np.isnat(original), self.column('DateTime'), original)
+
+    def sort_by_capture_time(self, descending=False):
+        """
+        Method that sort the images by the time they were taken; images taken at the same time keep the order of
+        their rows, and images without a date come last
+        :param descending: True to put the most recent images first
+        :return: list of names of the images
+        """
+        times = self.capture_times()
+        order = np.argsort(times, kind='stable')
+        if descending:
+            dated = len(times) - np.count_nonzero(np.isnat(times))
+            order[:dated] = order[:dated][::-1]
+        return self.image_names()[order].tolist()
+
+    def image_names(self):
+        """
+        Method that return the names of all the images
+        :return: numpy array of the names, by row
+        """
+        return self.names[:len(self.rows)]
+
+    def count_by(self, *names, images=None):
+        """
+        Method that count the images for each combination of values of category columns
+        :param names: names of the category columns
+        :param images: names of the images to count, all the stored images if None
+        :return: dict that associates to each tuple of values, None for the images without the tag, its count
+        """
+        groups, _, counts = self.__groups(names, self.__image_rows(images))
+        return {self.__group_values(names, group): int(count) for group, count in zip(groups, counts)}
+
+    def group_by(self, *names, images=None):
+        """
+        Method that group the images by the combination of their values of category columns
+        :param names: names of the category columns
+        :param images: names of the images to group, all the stored images if None
+        :return: dict that associates to each tuple of values, None for the images without the tag, the list of names
+                 of its images
+        """
+        rows = self.__image_rows(images)
+        groups, inverse, counts = self.__groups(names, rows)
+        names_of_rows = self.image_names()[rows]
+        members = np.split(names_of_rows[np.argsort(inverse, kind='stable')], np.cumsum(counts)[:-1])
+        return {self.__group_values(names, group): group_images.tolist()
+                for group, group_images in zip(groups, members)}
+
+    def group_by_camera(self, images=None):
+        """
+        Method that group the images by the camera that took them
+        :param images: names of the images to group, all the stored images if None
+        :return: dict that associates to each tuple (make, model) the list of names of its images
+        """
+        return self.group_by('Make', 'Model', images=images)
+
+    def memory_usage(self):
+        """
+        Method that return the memory used by the store, without visiting the rows
+        :return: dict that associates to 'columns', 'tables', 'records' and 'total' their size in bytes
+        """
+        columns = self.names.nbytes + sum(column.nbytes for column in self.columns.values())
+        # the names of the images are shared with the model, only the dict of the rows is counted
+        tables = sys.getsizeof(self.rows) + approximate_size(self.tags.values) + sys.getsizeof(self.tags.codes)
+        tables += sum(approximate_size(table.values) + sys.getsizeof(table.codes) for table in self.categories.values())
+        records = self.record_bytes + sys.getsizeof(self.records)
+        return {'columns': columns, 'tables': tables, 'records': records, 'total': columns + tables + records}
+
+    def memory_report(self):
+        """
+        Method that describe the memory used by the store
+        :return: string with the total and its parts
+        """
+        usage = self.memory_usage()
+        text = "Metadati di %d immagini in memoria: %.1f MB" % (len(self), usage['total'] / 2 ** 20)
+        if self.rows:
+            text += " (%d byte per immagine)" % (usage['total'] // len(self))
+        return text + "\ncolonne %.1f MB, tabelle %.1f MB, altri tag %.1f MB" % (
+            usage['columns'] / 2 ** 20, usage['tables'] / 2 ** 20, usage['records'] / 2 ** 20)
+
+    def __grow(self):
+        """
+        Method that double the capacity of the columns
+        :return:
+        """
+        capacity = 2 * len(self.names)
+        names = np.empty(capacity, dtype=object)
+        names[:len(self.names)] = self.names
+        self.names = names
+        for name, column in self.columns.items():
+            grown = np.full(capacity, COLUMN_KINDS[COLUMNS[name][1]][1], dtype=column.dtype)
+            grown[:len(column)] = column
+            self.columns[name] = grown
+
+    def __store(self, row, section, tag, value):
+        """
+        Method that store a value in its typed column, if the tag has one
+        :param row: row of the image
+        :param section: 'info', 'exif' or 'geo'
+        :param tag: name of the tag
+        :param value: value of the tag
+        :return: True if the value was stored in a column, False if it must be kept in the record
+        """
+        if section == 'info' and tag == SIZE_INFO:
+            if not isinstance(value, tuple) or len(value) != 2:
+                return False
+            self.columns['Width'][row], self.columns['Height'][row] = value
+            return True
+        column_section, kind = COLUMNS.get(tag, (None, None))
+        if section != column_section:
+            return False
+        if kind == 'number':
+            if isinstance(value, (tuple, list)):
+                value = value[0] if len(value) == 1 else None
+            try:
+                value = float(value)
+            except (TypeError, ValueError, ZeroDivisionError):
+                return False
+        elif kind in ('date', 'time'):
+            value = parse_exif_date(value) if kind == 'date' else parse_ctime(value)
+            if value is None:
+                return False
+        else:
+            if isinstance(value, bytes):
+                value = value.decode('latin-1')
+            if not isinstance(value, str):
+                return False
+            value = self.categories[tag].code(value.strip(' \x00'))
+        self.columns[tag][row] = value
+        return True
+
+    def __share(self, value):
+        """
+        Method that return the copy of a value shared by all the records that have an equal value
+        :param value: the value
+        :return: the shared value, or the value itself if it can not be shared
+        """
+        key = shared_key(value)
+        if key is None:
+            return value
+        entry = self._shared.get(key)
+        if entry is None:
+            entry = self._shared[key] = [value, 0]
+            self.record_bytes += approximate_size(value) + SHARED_ENTRY_SIZE
+        entry[1] += 1
+        return entry[0]
+
+    def __release(self, record):
+        """
+        Method that release the shared values of a record, forgetting those no longer used by any record
+        :param record: an object of class MetadataRecord
+        :return:
+        """
+        for value in record.values:
+            key = shared_key(value)
+            if key is not None:
+                entry = self._shared[key]
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._shared[key]
+                    self.record_bytes -= approximate_size(value) + SHARED_ENTRY_SIZE
+
+    @staticmethod
+    def __record_size(record):
+        """
+        Method that estimate the memory used by a record, not counting the shared values
+        :param record: an object of class MetadataRecord
+        :return: size in bytes
+        """
+        size = sys.getsizeof(record) + sys.getsizeof(record.tags) + sys.getsizeof(record.values)
+        return size + sum(approximate_size(value) for value in record.values if shared_key(value) is None)
+
+    def __image_rows(self, images):
+        """
+        Method that return the rows of some images
+        :param images: names of the images, those not stored are ignored, None for all the stored images
+        :return: numpy array of the rows
+        """
+        if images is None:
+            return np.arange(len(self.rows))
+        rows = self.rows
+        return np.array([rows[image_name] for image_name in images if image_name in rows], dtype=np.intp)
+
+    def __groups(self, names, rows):
+        """
+        Method that find the distinct combinations of values of category columns. The codes of each image, shifted by
+        one so that the missing value is 0, are flattened into a single integer, so that the combinations are found
+        by sorting one column.
+        :param names: names of the category columns
+        :param rows: numpy array of the rows of the images
+        :return: tuple with the list of the distinct combinations of codes, the numpy array with the position of the
+                 combination of each image and the numpy array of the number of images of each combination
+        """
+        shape = tuple(len(self.categories[name]) + 1 for name in names)
+        keys = np.ravel_multi_index(tuple(self.column(name)[rows] + 1 for name in names), shape)
+        groups, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        groups = np.stack(np.unravel_index(groups, shape), axis=1) - 1
+        return groups.tolist(), inverse.ravel(), counts
+
+    def __group_values(self, names, group):
+        """
+        Method that convert a combination of codes of category columns to their values
+        :param names: names of the category columns
+        :param group: list of the codes
+        :return: tuple of values, None for the missing ones
+        """
+        return tuple(self.categories[name][code] if code >= 0 else None for name, code in zip(names, group))
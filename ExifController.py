@@ -1,13 +1,33 @@
+from ExifScheduler import SelectionScheduler
+
+
 class ExifController:
     """
     This class contains the controller
 
     Attributes:
-    model   reference to an object of class ExifModel
+    model       reference to an object of class ExifModel
+    loader      optional reference to an object of class ImageLoader, used to extract the metadata in background
+    scheduler   reference to an object of class SelectionScheduler, that submits to the loader the work of the
+                selected image, if a loader is available
     """
 
-    def __init__(self, model):
+    def __init__(self, model, loader=None):
         self.model = model
+        self.loader = loader
+        self.scheduler = None
+        if loader is not None:
+            self.scheduler = SelectionScheduler(loader)
+            loader.metadata_ready.connect(self.metadata_loaded)
+
+    def register(self, event, callback):
+        """
+        Method that attach a function to call when an event of the model is notified
+        :param event: name of the event
+        :param callback: function that must be called with the arguments of the event
+        :return:
+        """
+        self.model.register(event, callback)
 
     def insert_image(self, image_name):
         """
@@ -17,10 +37,19 @@ class ExifController:
         """
         if not self.model.check_image(image_name):
             self.model.add_image(image_name)
-            self.model.select_image(image_name)
+            self.__select(image_name)
             return True
         return False
 
+    def insert_images(self, image_names):
+        """
+        Method that insert a batch of images to the model, skipping the ones already present. The selection does
+        not change and no metadata is extracted.
+        :param image_names: iterable of names of the images to insert into the model
+        :return: list of the names of the images inserted
+        """
+        return self.model.add_images(image_names)
+
     def select_image(self, index):
         """
         Method that select an image contained into the model by his index
@@ -31,7 +60,64 @@ class ExifController:
             image_selected = self.model.get_image_by_idx(index)
         else:
             image_selected = None
-        self.model.select_image(image_selected)
+        self.__select(image_selected)
+
+    def __select(self, image_name):
+        """
+        Method that select an image into the model, loading its metadata in background if a loader is available
+        :param image_name: name of the image to select
+        :return:
+        """
+        if self.scheduler is not None:
+            self.scheduler.begin(image_name)
+        if self.scheduler is None or image_name is None:
+            self.model.select_image(image_name)
+            return
+        self.model.select_image(image_name, extract=False)
+        metadata = self.model.get_cached_metadata(image_name, count_miss=False)
+        if metadata is not None:
+            self.model.set_current_metadata(image_name, metadata)
+        else:
+            self.scheduler.request('metadata', image_name)
+
+    def metadata_loaded(self, image_name, metadata):
+        """
+        Method that set into the model the metadata loaded in background, if they belong to the latest selection.
+        It is invoked every time the loader completes the metadata of an image.
+        :param image_name: name of the image
+        :param metadata: an object of class ImageMetadata
+        :return:
+        """
+        if self.scheduler.accepts('metadata', image_name):
+            self.model.set_current_metadata(image_name, metadata)
+
+    def request_display(self, image_name, size):
+        """
+        Method that request the decode of the selected image to show it, through the scheduler so that it is
+        cancelled if the selection changes before it is completed
+        :param image_name: name of the image
+        :param size: tuple (width, height) of the box that the image must fit
+        :return:
+        """
+        self.scheduler.request('display', image_name, size)
+
+    def display_accepted(self, image_name, size):
+        """
+        Method that check if a decoded image belongs to the latest selection
+        :param image_name: name of the image
+        :param size: tuple (width, height) of the box the image was decoded for
+        :return: True if the image must be shown, False if it is stale
+        """
+        return self.scheduler.accepts('display', image_name, size)
+
+    def prefetch_image(self, image_name):
+        """
+        Method that load in background the metadata of an image that is likely to be selected soon
+        :param image_name: name of the image
+        :return:
+        """
+        if self.loader is not None and not self.model.is_metadata_cached(image_name):
+            self.loader.prefetch_metadata(image_name)
 
     def remove_image(self, index):
         """
@@ -41,7 +127,7 @@ class ExifController:
         """
         image_selected = self.model.get_image_by_idx(index)
         if image_selected == self.model.get_current_image():
-            self.model.select_image(None)
+            self.__select(None)
         self.model.remove_image(image_selected)
 
     def empty_list(self):
@@ -50,7 +136,55 @@ class ExifController:
         :return:
         """
         self.model.empty_list()
-        self.model.select_image(None)
+        self.__select(None)
+
+    def pixmap_loaded(self, image_name):
+        """
+        Method that notify that the selected image is shown
+        :param image_name: name of the image
+        :return:
+        """
+        if image_name == self.model.get_current_image():
+            self.model.notify('pixmap_ready', image_name)
+
+    def rotate_image(self, degrees):
+        """
+        Method that rotate the image currently selected in the model
+        :param degrees: degrees of the rotation, positive clockwise
+        :return:
+        """
+        self.model.rotate_current(degrees)
+
+    def get_current_rotation(self):
+        """
+        Method that return the rotation of the image currently selected in the model
+        :return: rotation in degrees, positive clockwise
+        """
+        return self.model.get_current_rotation()
+
+    def get_loader(self):
+        """
+        Method that return the loader used to decode images and extract metadata in background
+        :return: reference to an object of class ImageLoader
+        """
+        return self.loader
+
+    def get_image_index(self, image_name):
+        """
+        Method that return the index of an image contained in the model
+        :param image_name: name of the image
+        :return: index of the image
+        """
+        return self.model.get_index(image_name)
+
+    def get_cached_metadata(self, image_name, count_miss=True):
+        """
+        Method that return the metadata of an image only if they are already cached in the model
+        :param image_name: name of the image
+        :param count_miss: False if a miss must not be counted, because the metadata are loaded next
+        :return: an object of class ImageMetadata, None if the metadata are not cached
+        """
+        return self.model.get_cached_metadata(image_name, count_miss)
 
     def get_current_image(self):
         """
@@ -0,0 +1,313 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS = 6371.0088  # kilometers, mean radius
+# side in degrees of the cells of the grid of the GeoIndex
+CELL_DEGREES = 0.25
+# queries that cover more cells than these are answered by scanning all the images
+MAX_QUERY_CELLS = 4096
+INITIAL_CAPACITY = 1024
+# tags of the coordinates, with their reference tag and the reference of the negative hemisphere
+COORDINATE_TAGS = (('GPSLatitude', 'GPSLatitudeRef', 'S'), ('GPSLongitude', 'GPSLongitudeRef', 'W'))
+
+
+def reference(value):
+    """
+    Function that normalize the value of a GPS reference tag, such as GPSLatitudeRef
+    :param value: value of the tag
+    :return: the reference as an uppercase letter, None if the value is empty
+    """
+    if isinstance(value, bytes):
+        value = value.decode('latin-1')
+    value = str(value).strip(' \x00').upper() if value is not None else ''
+    return value[:1] or None
+
+
+def decode_coordinates(geos):
+    """
+    Function that decode the latitude and longitude of many images at once. The degrees, minutes and seconds of
+    every image are gathered in arrays and combined by numpy; the coordinates of the southern and western hemispheres,
+    as told by GPSLatitudeRef and GPSLongitudeRef, are negative. Coordinates without their reference keep their sign.
+    :param geos: list of dicts of geolocalization tags, as ImageMetadata.geo, or None for the images without them
+    :return: tuple with the numpy arrays of latitudes and longitudes in degrees, NaN for the images without valid
+             coordinates
+    """
+    parts = np.zeros((len(geos), 2, 3))
+    present = np.zeros((len(geos), 2), dtype=bool)
+    signs = np.zeros((len(geos), 2))
+    for row, geo in enumerate(geos):
+        if not geo:
+            continue
+        for column, (tag, ref_tag, negative) in enumerate(COORDINATE_TAGS):
+            value = geo.get(tag)
+            if not isinstance(value, (tuple, list)):
+                value = (value,)
+            if not value:
+                continue
+            try:
+                parts[row, column, :len(value)] = [float(part) for part in value[:3]]
+            except (TypeError, ValueError, ZeroDivisionError):
+                continue
+            present[row, column] = True
+            ref = reference(geo.get(ref_tag))
+            if ref is not None:
+                signs[row, column] = -1 if ref == negative else 1
+    degrees = parts[..., 0] + parts[..., 1] / 60 + parts[..., 2] / 3600
+    degrees = np.where(signs != 0, np.abs(degrees) * signs, degrees)
+    degrees[~present.all(axis=1)] = np.nan
+    latitudes, longitudes = degrees[:, 0], degrees[:, 1]
+    with np.errstate(invalid='ignore'):
+        valid = (np.abs(latitudes) <= 90) & (np.abs(longitudes) <= 180)
+    latitudes[~valid] = np.nan
+    longitudes[~valid] = np.nan
+    return latitudes, longitudes
+
+
+def gps_coordinates(geo):
+    """
+    Function that decode the latitude and longitude of a single image
+    :param geo: dict of geolocalization tags, None if the image does not have them
+    :return: tuple (latitude, longitude) in degrees, None if the image does not have valid coordinates
+    """
+    latitudes, longitudes = decode_coordinates([geo])
+    if np.isnan(latitudes[0]):
+        return None
+    return float(latitudes[0]), float(longitudes[0])
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """
+    Function that compute the great circle distances from a point to many points
+    :param latitude: latitude of the point in degrees
+    :param longitude: longitude of the point in degrees
+    :param latitudes: numpy array of latitudes of the points in degrees
+    :param longitudes: numpy array of longitudes of the points in degrees
+    :return: numpy array of the distances in kilometers
+    """
+    latitude, longitude = math.radians(latitude), math.radians(longitude)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((latitudes - latitude) / 2) ** 2 + \
+        math.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class GeoIndex:
+    """
+    This class contains the coordinates of the images in numpy arrays, with a grid index for the queries by distance
+    and by bounding box. The grid divides the globe in cells of CELL_DEGREES; the images are kept sorted by cell,
+    so that the images of a cell are a slice found by binary search, and only the images of the cells a query
+    covers are measured.
+    The coordinates of the added images are decoded together, with decode_coordinates, at the next query, and the
+    grid is sorted again only if the images have changed since the previous query. A removed row is replaced by the
+    last one.
+    All the computations are local, no service is contacted.
+
+    Attributes:
+    rows        dict that associates to the name of each image with coordinates its row
+    names       numpy array of the names of the images, by row
+    latitudes   numpy array of the latitudes of the images in degrees, with spare rows at the end
+    longitudes  numpy array of the longitudes of the images in degrees, with spare rows at the end
+    pending     dict that associates to the name of each image added and not decoded yet its geolocalization tags
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.names = np.empty(INITIAL_CAPACITY, dtype=object)
+        self.latitudes = np.empty(INITIAL_CAPACITY)
+        self.longitudes = np.empty(INITIAL_CAPACITY)
+        self.pending = {}
+        self._grid_rows = int(math.ceil(180 / CELL_DEGREES))
+        self._grid_columns = int(round(360 / CELL_DEGREES))
+        self._cells = None
+        self._order = None
+
+    def add(self, image_name, geo):
+        """
+        Method that add an image, replacing the coordinates added before for the same image
+        :param image_name: name of the image
+        :param geo: dict of geolocalization tags of the image, None if it does not have them
+        :return:
+        """
+        self.remove(image_name)
+        if geo:
+            self.pending[image_name] = geo
+
+    def remove(self, image_name):
+        """
+        Method that remove an image, if it was added
+        :param image_name: name of the image
+        :return:
+        """
+        if self.pending.pop(image_name, None) is not None:
+            return
+        row = self.rows.pop(image_name, None)
+        if row is None:
+            return
+        last = len(self.rows)
+        if row != last:
+            self.names[row] = self.names[last]
+            self.latitudes[row] = self.latitudes[last]
+            self.longitudes[row] = self.longitudes[last]
+            self.rows[self.names[row]] = row
+        self.names[last] = None
+        self._cells = None
+
+    def clear(self):
+        """
+        Method that remove all the images
+        :return:
+        """
+        self.rows.clear()
+        self.names[:] = None
+        self.pending.clear()
+        self._cells = None
+
+    def coordinates(self, image_name):
+        """
+        Method that return the coordinates of an image
+        :param image_name: name of the image
+        :return: tuple (latitude, longitude) in degrees, None if the image does not have valid coordinates
+        """
+        self.__update()
+        row = self.rows.get(image_name)
+        if row is None:
+            return None
+        return float(self.latitudes[row]), float(self.longitudes[row])
+
+    def located(self):
+        """
+        Method that return the number of images with valid coordinates
+        :return: number of images
+        """
+        self.__update()
+        return len(self.rows)
+
+    def within_radius(self, latitude, longitude, radius):
+        """
+        Method that find the images within a distance from a point
+        :param latitude: latitude of the point in degrees
+        :param longitude: longitude of the point in degrees
+        :param radius: distance in kilometers
+        :return: list of tuples (name, distance in kilometers), from the nearest image
+        """
+        self.__update()
+        angle = math.degrees(radius / EARTH_RADIUS)
+        south, north = latitude - angle, latitude + angle
+        if south <= -90 or north >= 90 or angle >= 90:
+            # the circle contains a pole: it spans all the longitudes
+            span = 180
+        else:
+            ratio = math.sin(math.radians(angle)) / math.cos(math.radians(latitude))
+            span = math.degrees(math.asin(ratio)) if ratio < 1 else 180
+        candidates = self.__candidates(south, longitude - span, north, longitude + span)
+        distances = haversine(latitude, longitude, self.latitudes[candidates], self.longitudes[candidates])
+        inside = distances <= radius
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return list(zip(self.names[candidates[order]].tolist(), distances[order].tolist()))
+
+    def within_box(self, south, west, north, east):
+        """
+        Method that find the images within a bounding box. A box whose west side is east of its east side crosses
+        the antimeridian.
+        :param south: latitude of the south side in degrees
+        :param west: longitude of the west side in degrees
+        :param north: latitude of the north side in degrees
+        :param east: longitude of the east side in degrees
+        :return: list of names of the images
+        """
+        self.__update()
+        if east < west:
+            east += 360
+        candidates = self.__candidates(south, west, north, east)
+        latitudes, longitudes = self.latitudes[candidates], self.longitudes[candidates]
+        # longitudes are moved to the turn that starts at the west side
+        longitudes = (longitudes - west) % 360 + west
+        inside = (latitudes >= south) & (latitudes <= north) & (longitudes <= east)
+        return self.names[candidates[inside]].tolist()
+
+    def near_image(self, image_name, radius):
+        """
+        Method that find the other images within a distance from an image
+        :param image_name: name of the image
+        :param radius: distance in kilometers
+        :return: list of tuples (name, distance in kilometers), from the nearest image, empty if the image does not
+                 have valid coordinates
+        """
+        coordinates = self.coordinates(image_name)
+        if coordinates is None:
+            return []
+        return [(name, distance) for name, distance in self.within_radius(*coordinates, radius) if name != image_name]
+
+    def __candidates(self, south, west, north, east):
+        """
+        Method that return the rows of the images in the cells covered by an area, or all the rows if the area covers
+        too many cells
+        :param south: latitude of the south side in degrees
+        :param west: longitude of the west side in degrees, may be less than -180
+        :param north: latitude of the north side in degrees
+        :param east: longitude of the east side in degrees, may be more than 180, not less than west
+        :return: numpy array of rows
+        """
+        first_row, last_row = self.__grid_row(max(south, -90)), self.__grid_row(min(north, 90))
+        first_column = math.floor((west + 180) / CELL_DEGREES)
+        last_column = min(math.floor((east + 180) / CELL_DEGREES), first_column + self._grid_columns - 1)
+        rows = last_row - first_row + 1
+        columns = last_column - first_column + 1
+        if rows <= 0 or rows * columns > MAX_QUERY_CELLS:
+            return np.arange(len(self.rows)) if rows > 0 else np.arange(0)
+        cells = (np.arange(first_row, last_row + 1)[:, None] * self._grid_columns +
+                 np.arange(first_column, last_column + 1)[None, :] % self._grid_columns).ravel()
+        starts = np.searchsorted(self._cells, cells, side='left')
+        ends = np.searchsorted(self._cells, cells, side='right')
+        slices = [self._order[start:end] for start, end in zip(starts.tolist(), ends.tolist()) if end > start]
+        return np.concatenate(slices) if slices else np.arange(0)
+
+    def __grid_row(self, latitude):
+        """
+        Method that return the row of the grid of a latitude
+        :param latitude: latitude in degrees, between -90 and 90
+        :return: the row
+        """
+        return min(int((latitude + 90) // CELL_DEGREES), self._grid_rows - 1)
+
+    def __update(self):
+        """
+        Method that decode the coordinates of the pending images and sort again the grid, if the images have changed
+        :return:
+        """
+        if self.pending:
+            latitudes, longitudes = decode_coordinates(list(self.pending.values()))
+            valid = ~np.isnan(latitudes)
+            names = np.array(list(self.pending), dtype=object)[valid]
+            self.pending.clear()
+            start, end = len(self.rows), len(self.rows) + len(names)
+            if end > len(self.names):
+                self.__grow(end)
+            self.names[start:end] = names
+            self.latitudes[start:end] = latitudes[valid]
+            self.longitudes[start:end] = longitudes[valid]
+            self.rows.update(zip(names.tolist(), range(start, end)))
+            self._cells = None
+        if self._cells is None:
+            count = len(self.rows)
+            grid_rows = np.minimum(((self.latitudes[:count] + 90) // CELL_DEGREES).astype(np.int64),
+                                   self._grid_rows - 1)
+            grid_columns = ((self.longitudes[:count] + 180) // CELL_DEGREES).astype(np.int64) % self._grid_columns
+            cells = grid_rows * self._grid_columns + grid_columns
+            self._order = np.argsort(cells, kind='stable')
+            self._cells = cells[self._order]
+
+    def __grow(self, size):
+        """
+        Method that enlarge the arrays so that they have at least a number of rows
+        :param size: the number of rows
+        :return:
+        """
+        capacity = max(size, 2 * len(self.names))
+        names = np.empty(capacity, dtype=object)
+        names[:len(self.names)] = self.names
+        self.names = names
+        self.latitudes = np.resize(self.latitudes, capacity)
+        self.longitudes = np.resize(self.longitudes, capacity)
@@ -0,0 +1,213 @@
+import io
+import os
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from PIL import Image
+
+from ExifParser import IFD1_TAG, ExifData, ExifParseError
+
+THUMBNAIL_SIZE = (72, 72)
+DISPLAY_SIZE = (512, 512)
+ORIENTATION_TAG = 0x0112
+JPEG_INTERCHANGE_FORMAT_TAG = 0x0201
+JPEG_INTERCHANGE_FORMAT_LENGTH_TAG = 0x0202
+ASPECT_RATIO_TOLERANCE = 0.03
+# transposition that shows upright an image stored with each value of the EXIF Orientation tag
+ORIENTATION_TRANSPOSES = {2: Image.FLIP_LEFT_RIGHT, 3: Image.ROTATE_180, 4: Image.FLIP_TOP_BOTTOM,
+                          5: Image.TRANSPOSE, 6: Image.ROTATE_270, 7: Image.TRANSVERSE, 8: Image.ROTATE_90}
+SWAPPED_ORIENTATIONS = frozenset((5, 6, 7, 8))
+
+
+def exif_orientation(image):
+    """
+    Function that read the EXIF Orientation tag of an image from the EXIF block found by Pillow, without decoding
+    the pixels
+    :param image: image returned by Image.open
+    :return: the orientation, from 1 to 8, 1 if the image has no valid tag
+    """
+    exif_data = image.info.get('exif')
+    if not exif_data:
+        return 1
+    try:
+        orientation = ExifData(exif_data).get(ORIENTATION_TAG, 1)
+    except ExifParseError:
+        return 1
+    return orientation if orientation in ORIENTATION_TRANSPOSES else 1
+
+
+def orient_image(image, orientation):
+    """
+    Function that show upright an image stored with an EXIF orientation. Flips and rotations by multiples of 90
+    degrees are exact transpositions of the pixels, so nothing is resampled.
+    :param image: the loaded image
+    :param orientation: value of the EXIF Orientation tag
+    :return: the upright image
+    """
+    transpose = ORIENTATION_TRANSPOSES.get(orientation)
+    return image.transpose(transpose) if transpose is not None else image
+
+
+def open_reduced(image_name, size):
+    """
+    Function that open an image asking the decoder to produce the smallest resolution from which the image fitted
+    in the requested box can be obtained
+    :param image_name: path of the image
+    :param size: tuple (width, height) of the box that the image must fit
+    :return: the loaded image, with RGB or RGBA mode
+    """
+    return reduce_image(Image.open(image_name), size)
+
+
+def reduce_image(image, size):
+    """
+    Function that load an image opened and not yet decoded at the smallest resolution from which the image fitted
+    in the requested box can be obtained. JPEG images are scaled in the DCT domain by the decoder, the other
+    formats are reduced by integer factors right after the decode.
+    The EXIF orientation is applied to the reduced image, so the result is upright and fits the box.
+    :param image: image returned by Image.open
+    :param size: tuple (width, height) of the box that the image must fit
+    :return: the loaded image, with RGB or RGBA mode
+    """
+    orientation = exif_orientation(image)
+    if orientation in SWAPPED_ORIENTATIONS:
+        size = (size[1], size[0])
+    scale = min(size[0] / image.width, size[1] / image.height, 1)
+    fitted_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    image.draft('RGB', fitted_size)
+    image.load()
+    factor = min(image.width // fitted_size[0], image.height // fitted_size[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return orient_image(image, orientation)
+
+
+def decode_image(image_name, size=None):
+    """
+    Function that decode an image to show it in the image box, upright according to its EXIF orientation
+    :param image_name: path of the image
+    :param size: tuple (width, height) of the box that the image must fit, None to decode at full resolution
+    :return: the decoded image, with RGB or RGBA mode
+    """
+    if size is not None:
+        return open_reduced(image_name, size)
+    image = Image.open(image_name)
+    image.load()
+    orientation = exif_orientation(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return orient_image(image, orientation)
+
+
+def read_exif_thumbnail(exif_data):
+    """
+    Function that extract the JPEG preview stored in the IFD1 of an EXIF block
+    :param exif_data: content of the APP1 segment, as found in image.info['exif']
+    :return: tuple with the bytes of the preview and the orientations declared by IFD0 and IFD1, None if the
+    block does not contain a preview
+    """
+    try:
+        exif = ExifData(exif_data)
+        ifd1 = exif.get_ifd(IFD1_TAG)
+        start = ifd1.get(JPEG_INTERCHANGE_FORMAT_TAG)
+        length = ifd1.get(JPEG_INTERCHANGE_FORMAT_LENGTH_TAG)
+        orientation = exif.get(ORIENTATION_TAG, 1)
+        thumbnail_orientation = ifd1.get(ORIENTATION_TAG, orientation)
+    except ExifParseError:
+        return None
+    if not isinstance(start, int) or not isinstance(length, int) or not start or not length \
+            or exif.start + start + length > len(exif_data):
+        return None
+    return exif_data[exif.start + start:exif.start + start + length], orientation, thumbnail_orientation
+
+
+def embedded_thumbnail(image, size):
+    """
+    Function that return the preview embedded in the EXIF of an image if it can replace a decoded thumbnail, that
+    is when it has the orientation and the aspect ratio of the image and it is large enough for the requested size
+    :param image: image returned by Image.open
+    :param size: tuple (width, height) of the box that contains the thumbnail
+    :return: the loaded preview, upright according to the EXIF orientation, None if it is not present or not usable
+    """
+    exif_data = image.info.get('exif')
+    if image.format != 'JPEG' or not exif_data:
+        return None
+    embedded = read_exif_thumbnail(exif_data)
+    if embedded is None:
+        return None
+    data, orientation, thumbnail_orientation = embedded
+    if orientation != thumbnail_orientation:
+        return None
+    try:
+        thumbnail = Image.open(io.BytesIO(data))
+        thumbnail.load()
+    except (OSError, SyntaxError):
+        return None
+    image_ratio = image.width / image.height
+    if abs(thumbnail.width / thumbnail.height - image_ratio) > ASPECT_RATIO_TOLERANCE * image_ratio:
+        return None
+    if orientation in SWAPPED_ORIENTATIONS:
+        size = (size[1], size[0])
+    if thumbnail.width < min(size[0], image.width) and thumbnail.height < min(size[1], image.height):
+        return None
+    return orient_image(thumbnail.convert('RGB'), orientation)
+
+
+def make_thumbnail(image_name, size=THUMBNAIL_SIZE):
+    """
+    Function that create the thumbnail of an image without decoding it at full resolution. The preview embedded in
+    the EXIF is used when available, otherwise the image is decoded at reduced resolution. Either way the
+    thumbnail is upright according to the EXIF orientation.
+    :param image_name: path of the image
+    :param size: tuple (width, height) of the box that contains the thumbnail
+    :return: the thumbnail, with RGB or RGBA mode
+    """
+    image = Image.open(image_name)
+    thumbnail = embedded_thumbnail(image, size)
+    if thumbnail is None:
+        thumbnail = reduce_image(image, size)
+    else:
+        image.close()
+    thumbnail.thumbnail(size, Image.LANCZOS)
+    return thumbnail
+
+
+def load_thumbnail(image_name, cache=None, size=THUMBNAIL_SIZE):
+    """
+    Function that return the thumbnail of an image, reading it from the cache when possible and storing it there
+    after it is created
+    :param image_name: path of the image
+    :param cache: optional reference to an object of class ThumbnailCache
+    :param size: tuple (width, height) of the box that contains the thumbnail
+    :return: the thumbnail, with RGB or RGBA mode
+    """
+    thumbnail = cache.get(image_name, size) if cache is not None else None
+    if thumbnail is None:
+        thumbnail = make_thumbnail(image_name, size)
+        if cache is not None:
+            cache.put(image_name, size, thumbnail)
+    return thumbnail
+
+
+def decode_to_shared_memory(function, *args):
+    """
+    Function run in a worker process that decode an image and copy its pixels into a new shared memory block,
+    so that the parent process can use them without receiving them through a pipe.
+    The block is handed over to the parent, which must unlink it.
+    :param function: function that returns the decoded image, such as make_thumbnail or decode_image
+    :param args: arguments of the function
+    :return: tuple with name of the shared memory block, mode and size of the image
+    """
+    image = function(*args)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    data = image.tobytes()
+    shared_memory = SharedMemory(create=True, size=max(len(data), 1))
+    shared_memory.buf[:len(data)] = data
+    if os.name == 'posix':
+        # the parent registers the block again when it attaches it and unregisters it when it unlinks it
+        resource_tracker.unregister(shared_memory._name, 'shared_memory')
+    shared_memory.close()
+    return shared_memory.name, image.mode, image.size
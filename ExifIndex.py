@@ -0,0 +1,151 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+
+from PIL.TiffImagePlugin import IFDRational
+
+from ExifCache import user_cache_dir
+from ExifModel import ImageMetadata
+
+
+def encode_value(value):
+    """
+    Function that convert a metadata value into a JSON serializable object, tagging the types that JSON can not
+    represent so that decode_value can restore them exactly
+    :param value: value to convert
+    :return: JSON serializable object
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, IFDRational):
+        return {'r': [value.numerator, value.denominator]}
+    if isinstance(value, (bytes, bytearray)):
+        return {'b': base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, tuple):
+        return {'t': [encode_value(v) for v in value]}
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    if isinstance(value, dict):
+        return {'d': [[encode_value(k), encode_value(v)] for k, v in value.items()]}
+    return str(value)
+
+
+def decode_value(value):
+    """
+    Function that restore a metadata value converted by encode_value
+    :param value: JSON object to convert
+    :return: original value
+    """
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if isinstance(value, dict):
+        if 'r' in value:
+            return IFDRational(*value['r'])
+        if 'b' in value:
+            return base64.b64decode(value['b'])
+        if 't' in value:
+            return tuple(decode_value(v) for v in value['t'])
+        return {decode_value(k): decode_value(v) for k, v in value['d']}
+    return value
+
+
+class MetadataIndex:
+    """
+    This class contains a persistent index of the metadata extracted from the images, stored in a SQLite database.
+    A row is valid only while inode, size and modification time of the file are unchanged.
+    Writes are buffered and committed in batches. All the methods are thread safe.
+
+    Attributes:
+    path            path of the database file
+    batch_size      number of pending writes that triggers a commit
+    """
+
+    def __init__(self, path=None, batch_size=256):
+        if path is None:
+            path = os.path.join(user_cache_dir(), 'metadata.sqlite3')
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                                 'path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, mtime INTEGER, data TEXT)')
+        self._connection.commit()
+
+    @staticmethod
+    def open_default():
+        """
+        Method that open the index in the cache directory of the user
+        :return: an object of class MetadataIndex, None if the database can not be opened
+        """
+        try:
+            return MetadataIndex()
+        except (OSError, sqlite3.Error) as e:
+            print("Metadata index not available: " + str(e))
+            return None
+
+    def get(self, image_name, stat_result):
+        """
+        Method that return the metadata stored for an image if the file has not changed since they were stored
+        :param image_name: path of the image
+        :param stat_result: result of os.stat on the image
+        :return: an object of class ImageMetadata, None if the index has no valid row for the image
+        """
+        identity = (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+        with self._lock:
+            pending = self._pending.get(image_name)
+            if pending is not None:
+                row = pending
+            else:
+                row = self._connection.execute('SELECT inode, size, mtime, data FROM metadata WHERE path = ?',
+                                               (image_name,)).fetchone()
+        if row is None or tuple(row[:3]) != identity:
+            return None
+        data = json.loads(row[3])
+        return ImageMetadata(decode_value(data['info']), decode_value(data['exif']), decode_value(data['geo']))
+
+    def put(self, image_name, stat_result, metadata):
+        """
+        Method that store the metadata of an image. The write is committed with the next batch.
+        :param image_name: path of the image
+        :param stat_result: result of os.stat on the image
+        :param metadata: an object of class ImageMetadata
+        :return:
+        """
+        data = json.dumps({'info': encode_value(metadata.info), 'exif': encode_value(metadata.exif),
+                           'geo': encode_value(metadata.geo)})
+        with self._lock:
+            self._pending[image_name] = (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns, data)
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        """
+        Method that commit all the pending writes in a single transaction
+        :return:
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """
+        Method that commit the pending writes and close the database
+        :return:
+        """
+        with self._lock:
+            self._flush()
+            self._connection.close()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO metadata (inode, size, mtime, data, path) '
+                                         'VALUES (?, ?, ?, ?, ?)',
+                                         [row + (path,) for path, row in self._pending.items()])
+        self._pending.clear()
@@ -0,0 +1,221 @@
+import collections
+import os
+import queue
+import threading
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from ExifLoader import PRIORITY_BACKGROUND
+from ExifScanner import batches, is_supported_image, scan_images
+
+MAX_PENDING_BATCHES = 4
+MAX_IN_FLIGHT = 8
+PROGRESS_INTERVAL = 100  # milliseconds
+
+
+class IngestPipeline(QObject):
+    """
+    This class contains the pipeline that ingests the files dropped on the window in four stages:
+    validate, on a background thread, keeps the JPEG and PNG images and expands the folders;
+    register, on the GUI thread, inserts the valid images in the model in batches;
+    thumbnail and metadata, on the pool of the loader with background priority, store thumbnails and metadata of
+    the registered images in the caches, so that scrolling to them and selecting them is fast.
+    Every stage is bounded: validation stops when MAX_PENDING_BATCHES batches wait to be registered, and at most
+    MAX_IN_FLIGHT jobs of each of the other stages are submitted at a time, so the stages overlap without flooding
+    the GUI thread or the loader.
+
+    Attributes:
+    controller      reference to an object of class ExifController
+    loader          reference to an object of class ImageLoader
+    generation      number incremented by every cancel, to drop the work of the cancelled drops
+    validated       number of valid images found
+    registered      number of images inserted in the model
+    thumbnails      number of images whose thumbnail stage is over
+    metadata        number of images whose metadata stage is over
+    failed          number of thumbnail or metadata stages that failed
+    waiting         dict that associates to the thumbnail and metadata stages the images waiting to enter them
+    in_flight       dict that associates to the thumbnail and metadata stages the images they are working on
+    progress_timer  timer that notifies the progress while the pipeline is active
+    """
+    registered_batch = pyqtSignal(list)
+    progress_changed = pyqtSignal()
+    finished = pyqtSignal()
+    _validated_batch = pyqtSignal(int, list)
+
+    def __init__(self, controller, loader, parent=None):
+        super().__init__(parent)
+        self.controller = controller
+        self.loader = loader
+        self.generation = 0
+        self.validated = self.registered = self.thumbnails = self.metadata = self.failed = 0
+        self.waiting = {'thumbnail': collections.deque(), 'metadata': collections.deque()}
+        self.in_flight = {'thumbnail': set(), 'metadata': set()}
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setInterval(PROGRESS_INTERVAL)
+        self.progress_timer.timeout.connect(self.progress_changed)
+        self._requests = queue.Queue()
+        self._pending_batches = threading.Semaphore(MAX_PENDING_BATCHES)
+        self._validating = 0
+        self._thread = threading.Thread(target=self.__validate, name='ingest-validate', daemon=True)
+        self._thread.start()
+        self._validated_batch.connect(self.register)
+        self.loader.prepared.connect(self.stage_done)
+        self.controller.register('list_cleared', self.cancel)
+
+    def add(self, paths):
+        """
+        Method that queue dropped files and folders for validation. The counters restart if the pipeline was idle.
+        :param paths: list of paths of files and folders
+        :return:
+        """
+        if not paths:
+            return
+        if not self.is_active():
+            self.validated = self.registered = self.thumbnails = self.metadata = self.failed = 0
+        self._validating += 1
+        self._requests.put((self.generation, list(paths)))
+        self.progress_timer.start()
+        self.progress_changed.emit()
+
+    def cancel(self):
+        """
+        Method that stop the ingestion: the files not validated yet are discarded and the thumbnail and metadata
+        jobs are cancelled. The images already registered stay in the model.
+        :return:
+        """
+        self.generation += 1
+        self._validating = 0
+        try:
+            while True:
+                self._requests.get_nowait()
+        except queue.Empty:
+            pass
+        for stage in self.waiting:
+            self.waiting[stage].clear()
+            self.in_flight[stage].clear()
+        self.loader.cancel_all('prepare')
+        self.__check_finished()
+
+    def is_active(self):
+        """
+        Method that check if the pipeline has work in progress
+        :return: True if some stage is working, False otherwise
+        """
+        return bool(self._validating or any(self.waiting.values()) or any(self.in_flight.values()))
+
+    def register(self, generation, images):
+        """
+        Method that insert in the model a batch of validated images and queue them for the next stages.
+        It is invoked every time the validation delivers a batch.
+        :param generation: generation of the drop the batch belongs to
+        :param images: list of names of the images
+        :return:
+        """
+        self._pending_batches.release()
+        if generation != self.generation:
+            return
+        if not images:
+            self._validating -= 1
+            self.__check_finished()
+            return
+        self.validated += len(images)
+        added = self.controller.insert_images(images)
+        self.registered += len(added)
+        if added:
+            self.registered_batch.emit(added)
+            if self.loader.thumbnail_cache is not None:
+                self.waiting['thumbnail'].extend(added)
+            else:
+                self.thumbnails += len(added)
+                self.waiting['metadata'].extend(added)
+        self.__pump()
+
+    def stage_done(self, image_name, stage, error):
+        """
+        Method that move an image to the next stage once the current one is over.
+        It is invoked every time the loader completes a preparation job.
+        :param image_name: name of the image
+        :param stage: 'thumbnail' or 'metadata'
+        :param error: error message, None if the stage succeeded
+        :return:
+        """
+        if image_name not in self.in_flight[stage]:
+            return
+        self.in_flight[stage].discard(image_name)
+        if error is not None:
+            self.failed += 1
+        if stage == 'thumbnail':
+            self.thumbnails += 1
+            self.waiting['metadata'].append(image_name)
+        else:
+            self.metadata += 1
+        self.__pump()
+
+    def __pump(self):
+        """
+        Method that submit the waiting jobs of each stage until MAX_IN_FLIGHT are in progress
+        :return:
+        """
+        for stage in ('metadata', 'thumbnail'):
+            waiting, in_flight = self.waiting[stage], self.in_flight[stage]
+            while waiting and len(in_flight) < MAX_IN_FLIGHT:
+                image_name = waiting.popleft()
+                if image_name in in_flight:
+                    continue
+                in_flight.add(image_name)
+                self.loader.request_preparation(image_name, stage, PRIORITY_BACKGROUND)
+        self.__check_finished()
+
+    def __check_finished(self):
+        """
+        Method that notify the end of the ingestion once all the stages are idle
+        :return:
+        """
+        if not self.is_active() and self.progress_timer.isActive():
+            self.progress_timer.stop()
+            self.progress_changed.emit()
+            self.finished.emit()
+
+    def __validate(self):
+        """
+        Method run by the validation thread, which delivers the valid images of each drop in batches followed by
+        an empty batch that marks the end of the drop
+        :return:
+        """
+        while True:
+            generation, paths = self._requests.get()
+            for batch in batches(self.__valid_images(generation, paths)):
+                if not self.__deliver(generation, batch):
+                    break
+            else:
+                self.__deliver(generation, [])
+
+    def __valid_images(self, generation, paths):
+        """
+        Generator that yield the valid images among dropped files and folders until the drop is cancelled
+        :param generation: generation of the drop
+        :param paths: list of paths of files and folders
+        :return: generator of paths of images
+        """
+        cancelled = lambda: generation != self.generation
+        for path in paths:
+            if cancelled():
+                return
+            if os.path.isdir(path):
+                yield from scan_images(path, cancelled=cancelled)
+            elif is_supported_image(path):
+                yield path
+
+    def __deliver(self, generation, batch):
+        """
+        Method that send a batch to the GUI thread, waiting while too many batches are not registered yet
+        :param generation: generation of the drop
+        :param batch: list of paths of images
+        :return: False if the drop has been cancelled, True otherwise
+        """
+        self._pending_batches.acquire()
+        if generation != self.generation:
+            self._pending_batches.release()
+            return False
+        self._validated_batch.emit(generation, batch)
+        return True
@@ -0,0 +1,316 @@
+from PyQt5.QtCore import QAbstractItemModel, QAbstractListModel, QModelIndex, Qt
+
+FETCH_BATCH = 256
+TEXT_LIMIT = 200
+BLOB_PREVIEW = 16
+BLOB_ROW = 16
+TEXT_ROW = 100
+
+
+def is_blob(value):
+    """
+    Function that check if a value is too large to be shown on a single row
+    :param value: value to check
+    :return: True if the value is bytes or a long string, False otherwise
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value) > BLOB_PREVIEW
+    return isinstance(value, str) and len(value) > TEXT_LIMIT
+
+
+def format_value(value):
+    """
+    Function that format a value for a single row, truncating it if it is too large
+    :param value: value to format
+    :return: the formatted text
+    """
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) <= BLOB_PREVIEW:
+            return str(bytes(value))
+        return "%s ... (%d bytes)" % (bytes(value[:BLOB_PREVIEW]).hex(' '), len(value))
+    text = str(value)
+    if len(text) > TEXT_LIMIT:
+        return "%s ... (%d characters)" % (text[:TEXT_LIMIT], len(text))
+    return text
+
+
+class MetadataNode:
+    """
+    This class contains a node of the metadata tree. The children of a node are created only when the view asks
+    for them, in batches of FETCH_BATCH rows.
+
+    Attributes:
+    parent      parent node, None for the root
+    row         position of the node among the children of its parent
+    text        text shown by the node, None if it must be formatted from value
+    value       value the node refers to
+    kind        'key' for a key of a dict, whose child shows its value, 'container' for a dict or a list, or a key
+                whose value is a dict or a list,
+                'blob' for bytes or a long string split in rows, 'leaf' for a node without children
+    children    list of the children created so far
+    """
+    __slots__ = ('parent', 'row', 'text', 'value', 'kind', 'children', '_sources')
+
+    def __init__(self, parent, row, text, value, kind):
+        self.parent = parent
+        self.row = row
+        self.text = text
+        self.value = value
+        self.kind = kind
+        self.children = []
+        self._sources = None
+
+    def display_text(self):
+        """
+        Method that return the text shown by the node, formatting it the first time it is asked
+        :return: the text of the node
+        """
+        if self.text is None:
+            self.text = format_value(self.value)
+        return self.text
+
+    def child_count(self):
+        """
+        Method that return the number of children of the node, including the ones not created yet
+        :return: number of children
+        """
+        if self.kind == 'leaf':
+            return 0
+        if self.kind == 'key':
+            return 1
+        if self.kind == 'blob':
+            step = BLOB_ROW if isinstance(self.value, (bytes, bytearray)) else TEXT_ROW
+            return (len(self.value) + step - 1) // step
+        return len(self.value)
+
+    def fetch(self, count):
+        """
+        Method that create the next children of the node
+        :param count: maximum number of children to create
+        :return:
+        """
+        start = len(self.children)
+        end = min(start + count, self.child_count())
+        if self.kind == 'key':
+            self.children.append(value_node(self, 0, self.value))
+        elif self.kind == 'blob':
+            binary = isinstance(self.value, (bytes, bytearray))
+            step = BLOB_ROW if binary else TEXT_ROW
+            for row in range(start, end):
+                chunk = self.value[row * step:(row + 1) * step]
+                text = "%08x  %s" % (row * step, bytes(chunk).hex(' ')) if binary else chunk
+                self.children.append(MetadataNode(self, row, text, None, 'leaf'))
+        elif isinstance(self.value, dict):
+            if self._sources is None:
+                self._sources = list(self.value.items())
+            for row in range(start, end):
+                key, value = self._sources[row]
+                kind = 'container' if isinstance(value, (dict, list)) else 'key'
+                self.children.append(MetadataNode(self, row, str(key), value, kind))
+        else:
+            for row in range(start, end):
+                self.children.append(value_node(self, row, self.value[row]))
+
+
+def value_node(parent, row, value):
+    """
+    Function that create the node that shows a value
+    :param parent: parent node
+    :param row: position of the node among the children of its parent
+    :param value: value to show
+    :return: an object of class MetadataNode
+    """
+    if isinstance(value, dict):
+        return MetadataNode(parent, row, '[dict]', value, 'container')
+    if isinstance(value, list):
+        return MetadataNode(parent, row, '[list]', value, 'container')
+    if is_blob(value):
+        return MetadataNode(parent, row, None, value, 'blob')
+    return MetadataNode(parent, row, None, value, 'leaf')
+
+
+class MetadataTreeModel(QAbstractItemModel):
+    """
+    This class contains the item model of a dict of metadata shown in a tree: each key has a child that shows its
+    value, lists and dicts are expanded in nested rows and large binary or text values are truncated, with their
+    full content split in rows that are created only when the node is expanded.
+    Values are formatted only when a row is displayed.
+
+    Attributes:
+    root    root node of the tree
+    header  text of the header of the only column
+    """
+
+    def __init__(self, header="Data", parent=None):
+        super().__init__(parent)
+        self.header = header
+        self.root = MetadataNode(None, 0, '', {}, 'container')
+
+    def set_data(self, data):
+        """
+        Method that replace the metadata shown by the model
+        :param data: dict of metadata
+        :return:
+        """
+        self.beginResetModel()
+        self.root = MetadataNode(None, 0, '', data if data is not None else {}, 'container')
+        self.endResetModel()
+
+    def node(self, index):
+        """
+        Method that return the node of an index
+        :param index: index of the model
+        :return: an object of class MetadataNode
+        """
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self.node(parent)
+        if column != 0 or row < 0 or row >= len(node.children):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self.root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.node(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        return self.node(parent).child_count() > 0
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return len(node.children) < node.child_count()
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        start = len(node.children)
+        count = min(FETCH_BATCH, node.child_count() - start)
+        if count <= 0:
+            return
+        self.beginInsertRows(parent, start, start + count - 1)
+        node.fetch(count)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        return index.internalPointer().display_text()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and section == 0:
+            return self.header
+        return None
+
+
+class ImageListModel(QAbstractListModel):
+    """
+    This class contains the item model of the list of the images. It stores only the names of the images: the
+    thumbnails live in a bounded cache filled by the view for the rows it shows, and the rows whose thumbnail is
+    not cached show a placeholder.
+
+    Attributes:
+    images          list of the names of the images, in the order of the model
+    thumbnails      cache that associates to the name of an image the pixmap of its thumbnail
+    placeholder     pixmap shown by the rows whose thumbnail is not cached
+    """
+
+    def __init__(self, thumbnails, placeholder, parent=None):
+        super().__init__(parent)
+        self.images = []
+        self.thumbnails = thumbnails
+        self.placeholder = placeholder
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.images)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self.images):
+            return None
+        if role == Qt.DecorationRole:
+            return self.thumbnails.get(self.images[index.row()], self.placeholder)
+        if role == Qt.ToolTipRole:
+            return self.images[index.row()]
+        return None
+
+    def image(self, row):
+        """
+        Method that return the name of the image at a row
+        :param row: row of the image
+        :return: name of the image
+        """
+        return self.images[row]
+
+    def insert_image(self, row, image):
+        """
+        Method that insert an image at a row
+        :param row: row of the image
+        :param image: name of the image
+        :return:
+        """
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.images.insert(row, image)
+        self.endInsertRows()
+
+    def insert_images(self, row, images):
+        """
+        Method that insert a batch of consecutive images starting at a row
+        :param row: row of the first image
+        :param images: list of names of the images
+        :return:
+        """
+        self.beginInsertRows(QModelIndex(), row, row + len(images) - 1)
+        self.images[row:row] = images
+        self.endInsertRows()
+
+    def remove_image(self, row):
+        """
+        Method that remove the image at a row, together with its thumbnail
+        :param row: row of the image
+        :return:
+        """
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.thumbnails.remove(self.images.pop(row))
+        self.endRemoveRows()
+
+    def clear(self):
+        """
+        Method that remove all the images
+        :return:
+        """
+        self.beginResetModel()
+        self.images = []
+        self.thumbnails.clear()
+        self.endResetModel()
+
+    def set_images(self, images):
+        """
+        Method that replace all the images, keeping the cached thumbnails
+        :param images: list of names of the images
+        :return:
+        """
+        self.beginResetModel()
+        self.images = images
+        self.endResetModel()
+
+    def set_thumbnail(self, row, thumbnail):
+        """
+        Method that store the thumbnail of the image at a row and refresh the row
+        :param row: row of the image
+        :param thumbnail: pixmap of the thumbnail
+        :return:
+        """
+        self.thumbnails.put(self.images[row], thumbnail)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
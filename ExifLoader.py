@@ -0,0 +1,512 @@
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from PIL import Image
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from ExifImaging import THUMBNAIL_SIZE, decode_image, decode_to_shared_memory, load_thumbnail, make_thumbnail
+from ExifScanner import batches, scan_images
+
+PRIORITY_BACKGROUND = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_VISIBLE = 2
+PRIORITY_CURRENT = 3
+
+
+def qimage_from_pil(image):
+    """
+    Function that convert an image loaded with Pillow into a QImage that owns its pixels
+    :param image: image with RGB or RGBA mode
+    :return: the converted QImage
+    """
+    if image.mode == 'RGBA':
+        qimage_format, channels = QImage.Format_RGBA8888, 4
+    else:
+        image = image.convert('RGB')
+        qimage_format, channels = QImage.Format_RGB888, 3
+    data = image.tobytes('raw', image.mode)
+    return QImage(data, image.width, image.height, image.width * channels, qimage_format).copy()
+
+
+class ThreadDecodeBackend:
+    """
+    This class contains the decode backend that decodes the images in the worker thread that runs the job
+    """
+    name = 'thread'
+
+    def thread_count(self):
+        """
+        Method that return the number of worker threads that keep the backend busy
+        :return: number of threads, None for the default of the thread pool
+        """
+        return None
+
+    def thumbnail(self, image_name, cache):
+        """
+        Method that return the thumbnail of an image
+        :param image_name: path of the image
+        :param cache: optional reference to an object of class ThumbnailCache
+        :return: tuple with the QImage and the shared memory block that backs it, None if it owns its pixels
+        """
+        return qimage_from_pil(load_thumbnail(image_name, cache)), None
+
+    def display(self, image_name, size):
+        """
+        Method that return the image to show in the image box
+        :param image_name: path of the image
+        :param size: tuple (width, height) of the box that the image must fit
+        :return: tuple with the QImage and the shared memory block that backs it, None if it owns its pixels
+        """
+        return qimage_from_pil(decode_image(image_name, size)), None
+
+    def shutdown(self):
+        """
+        Method that release the resources of the backend
+        :return:
+        """
+        pass
+
+
+class ProcessDecodeBackend(ThreadDecodeBackend):
+    """
+    This class contains the decode backend that decodes the images on a pool of worker processes, so that decoding
+    is not limited by the GIL. The pixels come back in shared memory blocks that the QImage wraps without copying;
+    the block must be released with release_shared once the QImage is no longer used.
+
+    Attributes:
+    processes   number of worker processes
+    executor    pool of worker processes
+    """
+    name = 'process'
+
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count() or 1
+        # worker processes are spawned rather than forked, forking a process that runs Qt threads is unsafe
+        self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                            mp_context=multiprocessing.get_context('spawn'))
+
+    def thread_count(self):
+        return self.processes
+
+    def thumbnail(self, image_name, cache):
+        thumbnail = cache.get(image_name, THUMBNAIL_SIZE) if cache is not None else None
+        if thumbnail is not None:
+            return qimage_from_pil(thumbnail), None
+        image, shared_memory = self.__decode(make_thumbnail, image_name, THUMBNAIL_SIZE)
+        if cache is not None:
+            cache.put(image_name, THUMBNAIL_SIZE, self.__pil_view(image, shared_memory))
+        return image, shared_memory
+
+    def display(self, image_name, size):
+        return self.__decode(decode_image, image_name, size)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __decode(self, function, *args):
+        """
+        Method that decode an image in a worker process and wrap the shared memory block with its pixels
+        :param function: function that returns the decoded image
+        :param args: arguments of the function
+        :return: tuple with the QImage and the shared memory block that backs it
+        """
+        name, mode, size = self.executor.submit(decode_to_shared_memory, function, *args).result()
+        shared_memory = SharedMemory(name=name)
+        channels = len(mode)
+        qimage_format = QImage.Format_RGBA8888 if mode == 'RGBA' else QImage.Format_RGB888
+        return QImage(shared_memory.buf, size[0], size[1], size[0] * channels, qimage_format), shared_memory
+
+    @staticmethod
+    def __pil_view(image, shared_memory):
+        """
+        Method that return a Pillow image that shares the pixels of a QImage wrapping a shared memory block
+        :param image: QImage that wraps the block
+        :param shared_memory: the shared memory block
+        :return: the Pillow image
+        """
+        mode = 'RGBA' if image.format() == QImage.Format_RGBA8888 else 'RGB'
+        size = (image.width(), image.height())
+        return Image.frombuffer(mode, size, shared_memory.buf, 'raw', mode, 0, 1)
+
+
+def release_shared(shared_memory):
+    """
+    Function that release a shared memory block created by a worker process
+    :param shared_memory: the shared memory block
+    :return:
+    """
+    try:
+        shared_memory.close()
+    except BufferError:
+        pass
+    shared_memory.unlink()
+
+
+class LoadJob:
+    """
+    This class contains a single unit of work submitted to the loader
+
+    Attributes:
+    key         tuple that identifies the job, made of its kind, of the image it refers to and of the other
+                arguments of the request, which are emitted with the result
+    function    function that computes in a worker thread the result of the job and the shared memory block that
+                backs it, if any
+    signal      signal emitted with the image name and the result of the job
+    priority    priority of the job, jobs with higher priority are run first
+    cancelled   True if the job must not be run nor delivered anymore
+    """
+
+    def __init__(self, key, function, signal, priority):
+        self.key = key
+        self.function = function
+        self.signal = signal
+        self.priority = priority
+        self.cancelled = False
+
+
+class LoadWorker(QRunnable):
+    """
+    This class contains the runnable started on the thread pool for each submitted job.
+    When it runs it takes the job with the highest priority among the queued ones, which is not necessarily the
+    job whose submission started it.
+
+    Attributes:
+    loader      reference to an object of class ImageLoader
+    """
+
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+
+    def run(self):
+        job = self.loader.take_job()
+        if job is None:
+            return
+        start = time.perf_counter()
+        try:
+            result, shared_memory = job.function()
+        except Exception as e:
+            self.loader.finish_job(job)
+            if not job.cancelled:
+                self.loader.load_failed.emit(job.key[0], job.key[1], str(e))
+            return
+        self.loader.finish_job(job, time.perf_counter() - start)
+        if not job.cancelled:
+            job.signal.emit(*job.key[1:], result)
+            if shared_memory is not None:
+                # queued after the result, so it is released once the slots have used the image
+                self.loader.shared_delivered.emit(shared_memory)
+        elif shared_memory is not None:
+            del result
+            release_shared(shared_memory)
+
+
+class ImageLoader(QObject):
+    """
+    This class contains the loader that decodes thumbnails and images and extracts metadata on a pool of worker
+    threads. Results are delivered through signals, which Qt queues to the thread that owns the loader, so slots
+    always run on the GUI thread. Jobs are run by priority and can be cancelled until they are delivered.
+
+    The images delivered by thumbnail_ready and display_ready may be backed by shared memory that is released
+    after the slots return, so slots must convert them to QPixmap or copy them instead of keeping them.
+
+    Attributes:
+    model               reference to an object of class ExifModel
+    thumbnail_cache     optional reference to an object of class ThumbnailCache
+    backend             object that decodes the images, ThreadDecodeBackend or ProcessDecodeBackend
+    pool                thread pool that runs the jobs
+    timings             dict that associates to each kind of job the number of completed jobs and their total time
+    """
+    thumbnail_ready = pyqtSignal(str, QImage)
+    display_ready = pyqtSignal(str, tuple, QImage)
+    tile_ready = pyqtSignal(str, int, int, int, QImage)
+    metadata_ready = pyqtSignal(str, object)
+    prepared = pyqtSignal(str, str, object)
+    load_failed = pyqtSignal(str, str, str)
+    shared_delivered = pyqtSignal(object)
+
+    def __init__(self, model, thumbnail_cache=None, backend=None, max_threads=None):
+        super().__init__()
+        self.model = model
+        self.thumbnail_cache = thumbnail_cache
+        self.backend = backend if backend is not None else ThreadDecodeBackend()
+        self.pool = QThreadPool(self)
+        if max_threads is None:
+            max_threads = self.backend.thread_count()
+        if max_threads is not None:
+            self.pool.setMaxThreadCount(max_threads)
+        self.timings = {}
+        self._jobs = {}
+        self._queue = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.load_failed.connect(self.report_failure)
+        self.shared_delivered.connect(release_shared)
+
+    @staticmethod
+    def create_backend(name):
+        """
+        Method that create a decode backend by its name
+        :param name: 'thread' to decode in the worker threads, 'process' to decode in worker processes
+        :return: the decode backend
+        """
+        if name == 'process':
+            return ProcessDecodeBackend()
+        if name == 'thread':
+            return ThreadDecodeBackend()
+        raise ValueError("Unknown decode backend: " + name)
+
+    def request_thumbnail(self, image_name, priority=PRIORITY_BACKGROUND):
+        """
+        Method that request the thumbnail of an image, delivered by thumbnail_ready
+        :param image_name: path of the image
+        :param priority: priority of the request
+        :return:
+        """
+        self.submit(('thumbnail', image_name), lambda: self.backend.thumbnail(image_name, self.thumbnail_cache),
+                    self.thumbnail_ready, priority)
+
+    def request_display(self, image_name, size, priority=PRIORITY_CURRENT):
+        """
+        Method that request the image to show in the image box, decoded at a resolution suited to a box,
+        delivered by display_ready
+        :param image_name: path of the image
+        :param size: tuple (width, height) of the box that the image must fit
+        :param priority: priority of the request
+        :return:
+        """
+        self.submit(('display', image_name, size), lambda: self.backend.display(image_name, size),
+                    self.display_ready, priority)
+
+    def request_tile(self, tiled_image, level, column, row, priority=PRIORITY_CURRENT):
+        """
+        Method that request a tile of an image shown by the zoom view, delivered by tile_ready.
+        Tiles are cut in the worker threads whatever the decode backend, since the level they are cut from is
+        kept by the tiled image.
+        :param tiled_image: reference to an object of class TiledImage
+        :param level: level of the tile
+        :param column: column of the tile
+        :param row: row of the tile
+        :param priority: priority of the request
+        :return:
+        """
+        self.submit(('tile', tiled_image.image_name, level, column, row),
+                    lambda: (qimage_from_pil(tiled_image.decode_tile(level, column, row)), None),
+                    self.tile_ready, priority)
+
+    def request_metadata(self, image_name, priority=PRIORITY_CURRENT):
+        """
+        Method that request the metadata of an image, delivered by metadata_ready
+        :param image_name: path of the image
+        :param priority: priority of the request
+        :return:
+        """
+        self.submit(('metadata', image_name), lambda: (self.model.load_metadata(image_name), None),
+                    self.metadata_ready, priority)
+
+    def prefetch_metadata(self, image_name):
+        """
+        Method that request with prefetch priority the metadata of an image that is likely to be selected soon
+        :param image_name: path of the image
+        :return:
+        """
+        self.request_metadata(image_name, PRIORITY_PREFETCH)
+
+    def request_index(self, image_name):
+        """
+        Method that request with background priority the metadata of an image for the search index, delivered by
+        metadata_ready. The job has its own kind, so it is not cancelled together with the metadata requested for
+        the selection.
+        :param image_name: path of the image
+        :return:
+        """
+        self.submit(('index', image_name), lambda: (self.model.load_metadata(image_name), None),
+                    self.metadata_ready, PRIORITY_BACKGROUND)
+
+    def request_preparation(self, image_name, stage, priority=PRIORITY_BACKGROUND):
+        """
+        Method that request to store in the caches the thumbnail or the metadata of an image, so that showing it
+        later is fast. Completion is delivered by prepared with the image name, the stage and the error message,
+        None if the stage succeeded.
+        :param image_name: path of the image
+        :param stage: 'thumbnail' or 'metadata'
+        :param priority: priority of the request
+        :return:
+        """
+        def prepare():
+            try:
+                if stage == 'thumbnail':
+                    load_thumbnail(image_name, self.thumbnail_cache)
+                else:
+                    self.model.load_metadata(image_name)
+            except Exception as e:
+                return str(e), None
+            return None, None
+
+        self.submit(('prepare', image_name, stage), prepare, self.prepared, priority)
+
+    def submit(self, key, function, signal, priority):
+        """
+        Method that queue a job. If a job with the same key is already queued only its priority can be raised.
+        :param key: tuple made of the kind of the job, of the image it refers to and of the other arguments
+        :param function: function that computes the result of the job
+        :param signal: signal emitted with the image name, the other arguments and the result of the job
+        :param priority: priority of the job
+        :return:
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                if priority <= job.priority:
+                    return
+                job.cancelled = True
+            job = LoadJob(key, function, signal, priority)
+            self._jobs[key] = job
+            heapq.heappush(self._queue, (-priority, next(self._counter), job))
+        self.pool.start(LoadWorker(self))
+
+    def take_job(self):
+        """
+        Method invoked by the workers to take the queued job with the highest priority
+        :return: an object of class LoadJob, None if the popped job was cancelled
+        """
+        with self._lock:
+            if not self._queue:
+                return None
+            _, _, job = heapq.heappop(self._queue)
+            return None if job.cancelled else job
+
+    def finish_job(self, job, elapsed=None):
+        """
+        Method invoked by the workers when a job is completed
+        :param job: the completed job
+        :param elapsed: seconds spent computing the result, None if the job failed
+        :return:
+        """
+        with self._lock:
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+            if elapsed is not None:
+                count, total = self.timings.get(job.key[0], (0, 0.0))
+                self.timings[job.key[0]] = (count + 1, total + elapsed)
+
+    def stats(self):
+        """
+        Method that return the throughput of the loader for each kind of job, to compare the decode backends
+        :return: dict that associates to each kind of job the number of completed jobs and their mean time in ms
+        """
+        with self._lock:
+            return {kind: {'jobs': count, 'mean_ms': 1000.0 * total / count}
+                    for kind, (count, total) in self.timings.items()}
+
+    def is_pending(self, kind, image_name, *arguments):
+        """
+        Method that check if a job is queued or running
+        :param kind: kind of the job
+        :param image_name: path of the image
+        :param arguments: other arguments of the request, such as the size of a display request
+        :return: True if the job is pending, False otherwise
+        """
+        with self._lock:
+            return (kind, image_name) + arguments in self._jobs
+
+    def cancel(self, kind, image_name, *arguments):
+        """
+        Method that cancel a job. A queued job is never run, a running job is not delivered.
+        :param kind: kind of the job ('thumbnail', 'display', 'tile', 'metadata' or 'index')
+        :param image_name: path of the image
+        :param arguments: other arguments of the request, such as the size of a display request
+        :return:
+        """
+        with self._lock:
+            job = self._jobs.pop((kind, image_name) + arguments, None)
+            if job is not None:
+                job.cancelled = True
+
+    def cancel_all(self, kind=None):
+        """
+        Method that cancel all the jobs, or all the jobs of a kind
+        :param kind: kind of the jobs to cancel, None to cancel every job
+        :return:
+        """
+        with self._lock:
+            for key in [key for key in self._jobs if kind is None or key[0] == kind]:
+                self._jobs.pop(key).cancelled = True
+
+    def shutdown(self):
+        """
+        Method that cancel all the jobs and wait for the running ones to end
+        :return:
+        """
+        self.cancel_all()
+        self.pool.waitForDone()
+        self.backend.shutdown()
+
+    def report_failure(self, kind, image_name, message):
+        """
+        Method that report a job that failed
+        :param kind: kind of the job
+        :param image_name: path of the image
+        :param message: error message
+        :return:
+        """
+        print("Error loading " + kind + " of " + image_name + ": " + message)
+
+
+class FolderImporter(QObject):
+    """
+    This class contains the import of the images of a folder. The folder is walked on a background thread and
+    the images found are delivered in batches through signals, which Qt queues to the GUI thread.
+
+    Attributes:
+    directory       path of the folder
+    recursive       if False the subfolders are not imported
+    found           number of images delivered so far
+    """
+    batch_found = pyqtSignal(list)
+    finished = pyqtSignal(int)
+
+    def __init__(self, directory, recursive=True, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.recursive = recursive
+        self.found = 0
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Method that start the walk of the folder in background
+        :return:
+        """
+        self._thread = threading.Thread(target=self.__run, name='folder-import', daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """
+        Method that stop the walk, the batches not delivered yet are discarded
+        :return:
+        """
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        """
+        Method that check if the import has been cancelled
+        :return: True if the import has been cancelled, False otherwise
+        """
+        return self._cancelled.is_set()
+
+    def __run(self):
+        for batch in batches(scan_images(self.directory, self.recursive, self.is_cancelled)):
+            if self.is_cancelled():
+                break
+            self.found += len(batch)
+            self.batch_found.emit(batch)
+        self.finished.emit(self.found)
@@ -1,26 +1,288 @@
 import os
+import struct
 import time
 from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
 
+from ExifCache import LRUCache
+from ExifParser import EXIF_IFD_TAG, GPS_IFD_TAG, ExifParseError, JpegFile
+
+ORIENTATION_TAG = 0x0112
+
+
+class ImageMetadata:
+    """
+    This class contains the metadata extracted from a single image file
+
+    Attributes:
+    info    dict of info of the image (name, extension, size, dates)
+    exif    dict of exif of the image, decoded by tag name
+    geo     dict of geolocalization tags of the image, None if not present
+    """
+    __slots__ = ('info', 'exif', 'geo')
+
+    def __init__(self, info=None, exif=None, geo=None):
+        self.info = info if info is not None else {}
+        self.exif = exif if exif is not None else {}
+        self.geo = geo
+
+
+def extract_metadata(image_name, stat_result=None):
+    """
+    Function that extract info, exif and geolocalization info of an image opening the file only once.
+    Only the container headers and the metadata blocks are read, the pixel data is never decoded.
+    JPEG files are read by the EXIF parser without building a Pillow image, the other files and the ones the parser
+    can not read exactly as Pillow does are read by Pillow.
+    :param image_name: path of the image
+    :param stat_result: result of os.stat on the image, if the caller has already taken it
+    :return: an object of class ImageMetadata
+    """
+    if stat_result is None:
+        stat_result = os.stat(image_name)
+    metadata = parse_metadata(image_name, stat_result)
+    if metadata is not None:
+        return metadata
+    metadata = ImageMetadata()
+    with Image.open(image_name) as image:
+        fill_info(metadata, image_name, image.format, image.size, stat_result)
+        try:
+            if image.format == 'PNG':
+                metadata.exif = {TAGS.get(tag, tag): value for tag, value in image.info.items()}
+            else:
+                fill_exif(metadata, image.getexif())
+        except UnicodeDecodeError:
+            print("Error of extraction for this image")
+    return metadata
+
+
+def parse_metadata(image_name, stat_result):
+    """
+    Function that extract the metadata of a JPEG image with the EXIF parser, reading only the markers that precede
+    the image data from a memory map of the file
+    :param image_name: path of the image
+    :param stat_result: result of os.stat on the image
+    :return: an object of class ImageMetadata, None if the image must be read by Pillow
+    """
+    try:
+        with JpegFile(image_name) as jpeg_file:
+            if jpeg_file.size is None or jpeg_file.is_mpo:
+                return None
+            exif_data = jpeg_file.exif
+            if jpeg_file.has_xmp and (exif_data is None or ORIENTATION_TAG not in exif_data):
+                # Pillow takes the orientation from the XMP when the EXIF does not have it
+                return None
+            metadata = ImageMetadata()
+            fill_info(metadata, image_name, 'JPEG', jpeg_file.size, stat_result)
+            if exif_data is not None:
+                fill_exif(metadata, exif_data)
+            return metadata
+    except (OSError, ValueError, struct.error, ExifParseError):
+        return None
+
+
+def fill_info(metadata, image_name, image_format, size, stat_result):
+    """
+    Function that set the info of an image
+    :param metadata: an object of class ImageMetadata
+    :param image_name: path of the image
+    :param image_format: format of the image, as named by Pillow
+    :param size: tuple (width, height) of the image
+    :param stat_result: result of os.stat on the image
+    :return:
+    """
+    metadata.info['Name file'] = os.path.basename(image_name)
+    metadata.info['Extension'] = image_format
+    metadata.info['Image size'] = size
+    metadata.info['Creation date'] = time.ctime(stat_result.st_ctime)
+    metadata.info['Modification date'] = time.ctime(stat_result.st_mtime)
+
+
+def fill_exif(metadata, exif_data):
+    """
+    Function that set exif and geolocalization info of an image, merging the tags of IFD0 and of the Exif IFD
+    :param metadata: an object of class ImageMetadata
+    :param exif_data: object returned by Image.getexif, or an object of class ExifData
+    :return:
+    """
+    for tag, value in exif_data.items():
+        if tag == GPS_IFD_TAG:
+            gps_data = exif_data.get_ifd(GPS_IFD_TAG)
+            metadata.geo = {GPSTAGS.get(t, t): v for t, v in gps_data.items()} or None
+        elif tag == EXIF_IFD_TAG:
+            for sub_tag, sub_value in exif_data.get_ifd(EXIF_IFD_TAG).items():
+                metadata.exif[TAGS.get(sub_tag, sub_tag)] = sub_value
+        else:
+            metadata.exif[TAGS.get(tag, tag)] = value
+
+
+class ImageRegistry:
+    """
+    This class contains the ordered set of the images of the model. A list keeps the order and a dict associates
+    each image to its position, so membership tests and index lookups do not scan the list.
+    Positions after a removal are stale until they are needed: they are recomputed, once, only for the images
+    that follow the first removed one, at the next index lookup that concerns them.
+    Appends, membership tests and lookups of fresh positions are O(1). A removal is O(n), but only because the list
+    is shifted in C: a recorded position can be too high by at most the number of removals since the last refresh,
+    so the image is searched only in that window. The first index lookup after removals refreshes the stale tail
+    in Python, which is O(n) once for any number of removals.
+
+    Attributes:
+    images      list of the images, in order of insertion
+    positions   dict that associates to each image its position in images, valid below stale_from
+    stale_from  position from which the values of positions may be stale
+    removed     number of images removed since the positions were last refreshed
+    """
+    __slots__ = ('images', 'positions', 'stale_from', 'removed')
+
+    def __init__(self):
+        self.images = []
+        self.positions = {}
+        self.stale_from = 0
+        self.removed = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, image_name):
+        return image_name in self.positions
+
+    def __iter__(self):
+        return iter(self.images)
+
+    def __getitem__(self, index):
+        return self.images[index]
+
+    def append(self, image_name):
+        """
+        Method that add an image at the end of the registry if it is not present
+        :param image_name: name of the image
+        :return: True if the image was added, False if it was already present
+        """
+        if image_name in self.positions:
+            return False
+        if self.stale_from == len(self.images):
+            self.stale_from += 1
+        self.positions[image_name] = len(self.images)
+        self.images.append(image_name)
+        return True
+
+    def extend(self, image_names):
+        """
+        Method that add at the end of the registry the images that are not present, in their order
+        :param image_names: iterable of names of images
+        :return: list of the names of the images added
+        """
+        added = []
+        for image_name in image_names:
+            if self.append(image_name):
+                added.append(image_name)
+        return added
+
+    def index(self, image_name):
+        """
+        Method that return the position of an image, refreshing the stale positions if needed
+        :param image_name: name of the image
+        :return: position of the image
+        :raise ValueError: if the image is not present
+        """
+        try:
+            position = self.positions[image_name]
+        except KeyError:
+            raise ValueError(image_name + " is not in the registry") from None
+        if position < self.stale_from:
+            return position
+        for position in range(self.stale_from, len(self.images)):
+            self.positions[self.images[position]] = position
+        self.stale_from = len(self.images)
+        self.removed = 0
+        return self.positions[image_name]
+
+    def remove(self, image_name):
+        """
+        Method that remove an image from the registry
+        :param image_name: name of the image
+        :return: position the image had
+        :raise ValueError: if the image is not present
+        """
+        try:
+            position = self.positions[image_name]
+        except KeyError:
+            raise ValueError(image_name + " is not in the registry") from None
+        if position >= self.stale_from:
+            # every removal since the last refresh moved the image back by at most one position
+            position = self.images.index(image_name, max(self.stale_from, position - self.removed), position + 1)
+        del self.images[position]
+        del self.positions[image_name]
+        self.stale_from = min(self.stale_from, position)
+        self.removed += 1
+        return position
+
+    def clear(self):
+        """
+        Method that remove all the images from the registry
+        :return:
+        """
+        self.images.clear()
+        self.positions.clear()
+        self.stale_from = 0
+        self.removed = 0
+
+
 class ExifModel:
     """
     This class contains the model
 
     Attributes:
     current_image   currently image selected
-    images_list     list of images
-    current_info    dict of info of the current image
-    current_exif    dict of exif of the current image
+    images_list     registry of the images, an object of class ImageRegistry
+    current_info    dict of info of the current image, None while they are being loaded
+    current_exif    dict of exif of the current image, None while they are being loaded
     current_geo     latitude and longitude of the current image
+    metadata_cache  cache of the metadata already extracted, keyed by path and stat identity of the file
+    index           optional reference to an object of class MetadataIndex, persistent across sessions
+    rotations       dict that associates to each rotated image its rotation in degrees
+    listeners       dict that associates to each event the functions to call when it is notified
+
+    Events:
+    image_added         notified with index and name of an image inserted into the list
+    images_added        notified with index of the first one and list of names of images inserted together
+    image_removed       notified with index and name of an image removed from the list
+    list_cleared        notified when all images are removed from the list
+    selection_changed   notified with the name of the image selected, None if the selection is empty
+    metadata_ready      notified with the name of the image currently selected when its metadata are available
+    pixmap_ready        notified with the name of the image currently selected when it is shown
+    rotation_changed    notified with name and rotation of the image currently selected when it is rotated
     """
 
-    def __init__(self):
+    def __init__(self, index=None, cache_entries=4096, cache_bytes=64 * 1024 * 1024):
         self.current_image = None
         self.current_info = {}
         self.current_exif = {}
         self.current_geo = None
-        self.images_list = []
+        self.images_list = ImageRegistry()
+        self.metadata_cache = LRUCache(max_entries=cache_entries, max_bytes=cache_bytes)
+        self.index = index
+        self.rotations = {}
+        self.listeners = {}
+
+    def register(self, event, callback):
+        """
+        Method that attach a function to call when an event of the model is notified
+        :param event: name of the event
+        :param callback: function that must be called with the arguments of the event
+        :return:
+        """
+        self.listeners.setdefault(event, []).append(callback)
+
+    def notify(self, event, *args):
+        """
+        Method that call all the functions attached to an event
+        :param event: name of the event
+        :param args: arguments of the event
+        :return:
+        """
+        for callback in self.listeners.get(event, []):
+            callback(*args)
 
     def add_image(self, image_name):
         """
@@ -28,7 +290,21 @@ class ExifModel:
         :param image_name: name of the image to insert into the model
         :return:
         """
-        self.images_list.append(image_name)
+        if self.images_list.append(image_name):
+            self.notify('image_added', len(self.images_list) - 1, image_name)
+
+    def add_images(self, image_names):
+        """
+        Method that insert a batch of images to the list, skipping the ones already present, with a single
+        notification
+        :param image_names: iterable of names of the images to insert into the model
+        :return: list of the names of the images inserted
+        """
+        first = len(self.images_list)
+        added = self.images_list.extend(image_names)
+        if added:
+            self.notify('images_added', first, added)
+        return added
 
     def remove_image(self, image_name):
         """
@@ -36,7 +312,9 @@ class ExifModel:
         :param index: name of the image to remove
         :return:
         """
-        self.images_list.remove(image_name)
+        index = self.images_list.remove(image_name)
+        self.rotations.pop(image_name, None)
+        self.notify('image_removed', index, image_name)
 
     def empty_list(self):
         """
@@ -44,16 +322,49 @@ class ExifModel:
         :return:
         """
         self.images_list.clear()
+        self.rotations.clear()
+        self.notify('list_cleared')
 
-    def select_image(self, image_name):
+    def select_image(self, image_name, extract=True):
         """
         Method that select an image contained into the list by his name if it is present
         :param image_name: name of the image to select
+        :param extract: if False the metadata are not extracted and must be given later with set_current_metadata
         :return:
         """
         if self.check_image(image_name) or image_name == None:
+            changed = image_name != self.current_image
             self.current_image = image_name
-            self.extract_current_data()
+            if changed:
+                # the metadata of the previous image must not be shown with the new one while its own are loaded
+                self.current_info = None
+                self.current_exif = None
+                self.current_geo = None
+                self.notify('selection_changed', image_name)
+            if extract or image_name is None:
+                self.extract_current_data()
+
+    def rotate_current(self, degrees):
+        """
+        Method that rotate the image currently selected
+        :param degrees: degrees of the rotation, positive clockwise
+        :return:
+        """
+        if self.current_image is None:
+            return
+        rotation = (self.rotations.get(self.current_image, 0) + degrees) % 360
+        if rotation:
+            self.rotations[self.current_image] = rotation
+        else:
+            self.rotations.pop(self.current_image, None)
+        self.notify('rotation_changed', self.current_image, rotation)
+
+    def get_current_rotation(self):
+        """
+        Method that return the rotation of the image currently selected
+        :return: rotation in degrees, positive clockwise
+        """
+        return self.rotations.get(self.current_image, 0)
 
     def check_image(self, image_name):
         """
@@ -61,9 +372,7 @@ class ExifModel:
         :param image_name: name of the image to search
         :return: True if the image is present in the list, False otherwise
         """
-        if image_name in self.images_list:
-            return True
-        return False
+        return image_name in self.images_list
 
     def get_image_by_idx(self, index):
         """
@@ -73,61 +382,105 @@ class ExifModel:
         """
         return self.images_list[index]
 
+    def get_index(self, image_name):
+        """
+        Method that return the index of an image contained in the list
+        :param image_name: name of the image
+        :return: index of the image
+        """
+        return self.images_list.index(image_name)
+
     def get_all_images(self):
         """
         Method that return all images contained in the list
-        :return: all images contained in the list
+        :return: list of all images contained in the list, that must not be modified
         """
-        return self.images_list
+        return self.images_list.images
 
     def extract_current_data(self):
         """
-        Method that extract info end exif of the image currently selected
+        Method that extract info, exif and geolocalization info of the image currently selected
         :return:
         """
-        self.__extract_current_info()
-        self.__extract_current_exif()
+        metadata = self.load_metadata(self.current_image) if self.current_image is not None else ImageMetadata()
+        self.set_current_metadata(self.current_image, metadata)
 
-    def __extract_current_info(self):
+    def set_current_metadata(self, image_name, metadata):
         """
-        Method that extract info of the image currently selected
+        Method that set the metadata of the image currently selected, ignoring them if the selection has changed
+        :param image_name: name of the image the metadata belong to
+        :param metadata: an object of class ImageMetadata
         :return:
         """
-        self.current_info = {}
-        if self.current_image != None:
-            image = Image.open(self.current_image)
-            self.current_info['Name file'] = os.path.basename(image.filename)
-            self.current_info['Extension'] = image.format
-            self.current_info['Image size'] = image.size
-            self.current_info['Creation date'] = time.ctime(os.path.getctime(image.filename))
-            self.current_info['Modification date'] = time.ctime(os.path.getmtime(image.filename))
+        if image_name != self.current_image:
+            return
+        self.current_info = metadata.info
+        self.current_exif = metadata.exif
+        self.current_geo = metadata.geo
+        self.notify('metadata_ready', image_name)
 
-    def __extract_current_exif(self):
+    def load_metadata(self, image_name):
         """
-        Method that extract exif of the image currently selected
-        :return:
+        Method that return the metadata of an image, extracting them from the file only if they are neither cached
+        nor stored in the persistent index.
+        The cache key contains size and modification time of the file, so an edited file is extracted again.
+        :param image_name: path of the image
+        :return: an object of class ImageMetadata
+        """
+        stat_result = os.stat(image_name)
+        key = (image_name, stat_result.st_size, stat_result.st_mtime_ns)
+        metadata = self.metadata_cache.get(key)
+        if metadata is None:
+            if self.index is not None:
+                metadata = self.index.get(image_name, stat_result)
+            if metadata is None:
+                metadata = extract_metadata(image_name, stat_result)
+                if self.index is not None:
+                    self.index.put(image_name, stat_result, metadata)
+            self.metadata_cache.put(key, metadata)
+        return metadata
+
+    def get_cached_metadata(self, image_name, count_miss=True):
+        """
+        Method that return the metadata of an image only if they are already cached, without reading the file
+        :param image_name: path of the image
+        :param count_miss: False if a miss must not be counted, because load_metadata is invoked next and counts it
+        :return: an object of class ImageMetadata, None if the metadata are not cached
+        """
+        key = self.__cache_key(image_name)
+        return self.metadata_cache.get(key, count_miss=count_miss) if key is not None else None
+
+    def is_metadata_cached(self, image_name):
+        """
+        Method that check if the metadata of an image are cached, without counting the lookup in the statistics of
+        the cache
+        :param image_name: path of the image
+        :return: True if the metadata are cached
+        """
+        key = self.__cache_key(image_name)
+        return key is not None and key in self.metadata_cache
+
+    @staticmethod
+    def __cache_key(image_name):
+        """
+        Method that return the key of the metadata of an image in the cache
+        :param image_name: path of the image
+        :return: tuple (path, size, modification time), None if the file can not be read
         """
-        self.current_exif = {}
-        self.current_geo = None
         try:
-            if self.current_image != None:
-                image = Image.open(self.current_image)
-                if image.format == 'PNG':
-                    exif_data = image.info
-                else:
-                    exif_data = image.getexif()
-                for tag, value in exif_data.items():
-                    decoded = TAGS.get(tag, tag)
-                    if decoded == "GPSInfo":
-                        gps_data = {}
-                        for v in value:
-                            sub_decoded = GPSTAGS.get(v, v)
-                            gps_data[sub_decoded] = value[v]
-                        self.current_geo = gps_data
-                    else:
-                        self.current_exif[decoded] = value
-        except UnicodeDecodeError:
-            print("Error of extraction for this image")
+            stat_result = os.stat(image_name)
+        except OSError:
+            return None
+        return image_name, stat_result.st_size, stat_result.st_mtime_ns
+
+    def close(self):
+        """
+        Method that release the resources of the model, committing the pending writes of the index
+        :return:
+        """
+        if self.index is not None:
+            self.index.close()
+            self.index = None
 
     def get_current_info(self):
         """
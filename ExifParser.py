@@ -0,0 +1,271 @@
+import mmap
+import struct
+from collections.abc import Mapping
+
+from PIL import TiffTags
+from PIL.TiffImagePlugin import IFDRational
+
+EXIF_HEADER = b'Exif\x00\x00'
+XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+MPF_HEADER = b'MPF\x00'
+EXIF_IFD_TAG = 0x8769
+GPS_IFD_TAG = 0x8825
+IFD1_TAG = -1
+BYTE_TYPE = 1
+ASCII_TYPE = 2
+UNDEFINED_TYPE = 7
+RATIONAL_TYPES = (5, 10)
+# size in bytes and struct format of the TIFF field types, the same ones Pillow reads
+TYPE_FORMATS = {1: (1, 'B'), 2: (1, 'B'), 3: (2, 'H'), 4: (4, 'L'), 5: (8, 'L'), 6: (1, 'b'), 7: (1, 'B'),
+                8: (2, 'h'), 9: (4, 'l'), 10: (8, 'l'), 11: (4, 'f'), 12: (8, 'd'), 13: (4, 'L'), 16: (8, 'Q')}
+START_OF_FRAME_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class ExifParseError(Exception):
+    """
+    This class contains the error raised when an EXIF block is malformed, so that the caller can fall back to Pillow
+    """
+
+
+class IFD(Mapping):
+    """
+    This class contains an Image File Directory of a TIFF block. Building it reads only the table of its entries:
+    the value of a tag is decoded when it is accessed and then kept. Values are converted the way Pillow converts
+    them in Image.getexif, so the two can be used interchangeably.
+
+    Attributes:
+    buffer      buffer that contains the TIFF block, such as a memory map of the file
+    start       position of the TIFF header in the buffer, to which all the offsets are relative
+    end         position of the end of the TIFF block in the buffer
+    endian      '<' for little endian blocks, '>' for big endian blocks
+    group       tag of the IFD as used by PIL.TiffTags to look up the tag types, None for IFD0 and IFD1
+    entries     dict that associates each tag, in order of the table, to its field type, count and value position
+    next_offset offset of the next IFD, 0 if this is the last one
+    """
+
+    def __init__(self, buffer, start, end, endian, offset, group=None):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.endian = endian
+        self.group = group
+        self.entries = {}
+        self._values = {}
+        position = start + offset
+        try:
+            count, = struct.unpack_from(endian + 'H', buffer, position)
+            if position + 2 + count * 12 + 4 > end:
+                raise ExifParseError("IFD table out of the EXIF block")
+            for i in range(count):
+                entry = position + 2 + i * 12
+                tag, field_type, value_count = struct.unpack_from(endian + 'HHL', buffer, entry)
+                if field_type not in TYPE_FORMATS or not value_count:
+                    continue
+                size = TYPE_FORMATS[field_type][0] * value_count
+                if size > 4:
+                    value_offset, = struct.unpack_from(endian + 'L', buffer, entry + 8)
+                    value_position = start + value_offset
+                    if value_position + size > end:
+                        raise ExifParseError("value of tag %d out of the EXIF block" % tag)
+                else:
+                    value_position = entry + 8
+                self.entries[tag] = (field_type, value_count, value_position)
+            self.next_offset, = struct.unpack_from(endian + 'L', buffer, position + 2 + count * 12)
+        except struct.error as e:
+            raise ExifParseError(str(e)) from None
+
+    def __getitem__(self, tag):
+        try:
+            return self._values[tag]
+        except KeyError:
+            pass
+        field_type, count, position = self.entries[tag]
+        value = self._values[tag] = self.__decode(tag, field_type, count, position)
+        return value
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, tag):
+        return tag in self.entries
+
+    def __decode(self, tag, field_type, count, position):
+        """
+        Method that decode the value of a tag
+        :param tag: the tag
+        :param field_type: TIFF field type of the value
+        :param count: number of elements of the value
+        :param position: position of the value in the buffer
+        :return: the value, with the types Pillow uses
+        """
+        size, value_format = TYPE_FORMATS[field_type]
+        if field_type in (BYTE_TYPE, UNDEFINED_TYPE):
+            return bytes(self.buffer[position:position + count])
+        if field_type == ASCII_TYPE:
+            data = bytes(self.buffer[position:position + count])
+            if data.endswith(b'\x00'):
+                data = data[:-1]
+            values = (data.decode('latin-1', 'replace'),)
+        elif field_type in RATIONAL_TYPES:
+            numbers = struct.unpack_from('%s%d%s' % (self.endian, 2 * count, value_format), self.buffer, position)
+            values = tuple(IFDRational(n, d) for n, d in zip(numbers[::2], numbers[1::2]))
+        else:
+            values = struct.unpack_from('%s%d%s' % (self.endian, count, value_format), self.buffer, position)
+        info = TiffTags.lookup(tag, self.group)
+        values = tuple(info.cvt_enum(v) if isinstance(v, str) else v for v in values)
+        if len(values) == 1 or info.length == 1:
+            return values[0]
+        return values
+
+
+class ExifData:
+    """
+    This class contains the EXIF of an image, read from a TIFF block. The IFDs are read only when they are first
+    accessed, and get_ifd and items behave as the ones of the object returned by Image.getexif.
+
+    Attributes:
+    buffer      buffer that contains the TIFF block, such as a memory map of the file or the content of the APP1
+                segment found in image.info['exif']
+    start       position of the TIFF header in the buffer
+    end         position of the end of the TIFF block in the buffer
+    endian      '<' for little endian blocks, '>' for big endian blocks
+    """
+
+    def __init__(self, buffer, start=0, end=None):
+        self.buffer = buffer
+        self.end = len(buffer) if end is None else end
+        while bytes(buffer[start:start + 6]) == EXIF_HEADER:
+            start += 6
+        self.start = start
+        try:
+            self.endian = {b'II': '<', b'MM': '>'}[bytes(buffer[start:start + 2])]
+            magic, self._ifd0_offset = struct.unpack_from(self.endian + 'HL', buffer, start + 2)
+        except (KeyError, struct.error):
+            raise ExifParseError("not a TIFF header") from None
+        if magic != 42:
+            raise ExifParseError("unsupported TIFF version %d" % magic)
+        self._ifds = {}
+
+    @property
+    def ifd0(self):
+        """
+        Method that return the IFD0 of the block
+        :return: an object of class IFD
+        """
+        if None not in self._ifds:
+            self._ifds[None] = IFD(self.buffer, self.start, self.end, self.endian, self._ifd0_offset)
+        return self._ifds[None]
+
+    def get_ifd(self, tag):
+        """
+        Method that return a sub IFD of the block
+        :param tag: EXIF_IFD_TAG, GPS_IFD_TAG or IFD1_TAG
+        :return: an object of class IFD, an empty dict if the block does not contain the IFD
+        """
+        if tag not in self._ifds:
+            if tag == IFD1_TAG:
+                offset, group = self.ifd0.next_offset, None
+            else:
+                offset, group = self.ifd0.get(tag), tag
+            if not isinstance(offset, int) or not offset:
+                return {}
+            self._ifds[tag] = IFD(self.buffer, self.start, self.end, self.endian, offset, group)
+        return self._ifds[tag]
+
+    def items(self):
+        """
+        Method that return the tags of IFD0 with their values
+        :return: iterable of tuples (tag, value)
+        """
+        return self.ifd0.items()
+
+    def get(self, tag, default=None):
+        """
+        Method that return the value of a tag of IFD0
+        :param tag: the tag
+        :param default: value returned if the tag is not present
+        :return: the value of the tag
+        """
+        return self.ifd0.get(tag, default)
+
+    def __contains__(self, tag):
+        return tag in self.ifd0
+
+
+class JpegFile:
+    """
+    This class contains a JPEG file mapped in memory. Opening it scans only the markers that precede the image
+    data, to find the size of the image and the EXIF segment; no pixel is decoded and no other byte is read.
+    It must be closed, or used as a context manager, once its EXIF is no longer needed.
+
+    Attributes:
+    size        tuple (width, height) of the image, None if the file has no frame header
+    exif        object of class ExifData, None if the file has no EXIF segment
+    has_xmp     True if the file has an XMP segment
+    is_mpo      True if the file has a Multi Picture Format segment, which Pillow opens as MPO
+    """
+
+    def __init__(self, image_name):
+        with open(image_name, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = None
+        self.exif = None
+        self.has_xmp = False
+        self.is_mpo = False
+        try:
+            self.__scan()
+        except Exception:
+            self.close()
+            raise
+
+    def __scan(self):
+        data = self._map
+        if data[:3] != b'\xff\xd8\xff':
+            raise ExifParseError("not a JPEG file")
+        position = 2
+        exif_segment = None
+        while position + 4 <= len(data):
+            if data[position] != 0xFF:
+                raise ExifParseError("invalid marker at %d" % position)
+            marker = data[position + 1]
+            if marker == 0xFF:
+                position += 1
+                continue
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                position += 2
+                continue
+            if marker in (0xD9, 0xDA):
+                break
+            length, = struct.unpack_from('>H', data, position + 2)
+            segment_start, segment_end = position + 4, position + 2 + length
+            if marker == 0xE1:
+                if data[segment_start:segment_start + 6] == EXIF_HEADER:
+                    if exif_segment is None:
+                        exif_segment = (segment_start, min(segment_end, len(data)))
+                elif data[segment_start:segment_start + len(XMP_HEADER)] == XMP_HEADER:
+                    self.has_xmp = True
+            elif marker == 0xE2 and data[segment_start:segment_start + 4] == MPF_HEADER:
+                self.is_mpo = True
+            elif marker in START_OF_FRAME_MARKERS:
+                height, width = struct.unpack_from('>HH', data, segment_start + 1)
+                self.size = (width, height)
+            position = segment_end
+        if exif_segment is not None:
+            self.exif = ExifData(data, *exif_segment)
+
+    def close(self):
+        """
+        Method that release the memory map of the file
+        :return:
+        """
+        self.exif = None
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
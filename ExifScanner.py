@@ -0,0 +1,76 @@
+import os
+import time
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+MAGIC_LENGTH = len(PNG_MAGIC)
+
+
+def is_supported_image(image_name):
+    """
+    Function that check if a file is a JPEG or PNG image by reading its first bytes, whatever its extension is
+    :param image_name: path of the file
+    :return: True if the file starts with the signature of a supported format, False otherwise
+    """
+    try:
+        with open(image_name, 'rb') as file:
+            header = file.read(MAGIC_LENGTH)
+    except OSError:
+        return False
+    return header.startswith(JPEG_MAGIC) or header == PNG_MAGIC
+
+
+def scan_images(directory, recursive=True, cancelled=None):
+    """
+    Generator that walk a directory and yield the paths of the supported images as soon as they are found.
+    Directories are read one at a time with os.scandir, so the walk never holds the whole tree in memory.
+    Entries of each directory are visited in order of name, and symbolic links to directories are not followed.
+    :param directory: path of the directory
+    :param recursive: if False the subdirectories are not visited
+    :param cancelled: optional function without arguments that returns True when the walk must stop
+    :return: generator of paths of images
+    """
+    pending = [directory]
+    while pending:
+        if cancelled is not None and cancelled():
+            return
+        try:
+            with os.scandir(pending.pop()) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for entry in entries:
+            if cancelled is not None and cancelled():
+                return
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.is_file() and is_supported_image(entry.path):
+                    yield entry.path
+            except OSError:
+                continue
+        if recursive:
+            pending.extend(reversed(subdirectories))
+
+
+def batches(paths, batch_size=512, interval=0.1):
+    """
+    Generator that group paths in lists, yielding a list when it reaches batch_size paths or when a path is found
+    more than interval seconds after the previous list, so that the first results are delivered quickly even on
+    slow walks
+    :param paths: iterable of paths
+    :param batch_size: maximum number of paths in a list
+    :param interval: number of seconds after which the next path found yields the list
+    :return: generator of lists of paths
+    """
+    batch = []
+    deadline = time.monotonic() + interval
+    for path in paths:
+        batch.append(path)
+        if len(batch) >= batch_size or time.monotonic() >= deadline:
+            yield batch
+            batch = []
+            deadline = time.monotonic() + interval
+    if batch:
+        yield batch
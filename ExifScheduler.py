@@ -0,0 +1,61 @@
+class SelectionScheduler:
+    """
+    This class contains the scheduler of the work needed to show the selected image.
+    Every selection opens a new generation: the requests of the previous generations that do not concern the new
+    selection are cancelled, and the results are delivered only if they belong to the latest selection, so that
+    quick sequences of selections never wait for the work of the images that are no longer selected.
+
+    Attributes:
+    loader          reference to an object of class ImageLoader, that runs the requests
+    generation      number of the latest selection
+    current_image   image of the latest selection
+    requests        dict that associates to each pending request the generation that made it
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.generation = 0
+        self.current_image = None
+        self.requests = {}
+
+    def begin(self, image_name):
+        """
+        Method that start a new generation for a selection, cancelling the stale requests
+        :param image_name: name of the selected image, None if the selection is empty
+        :return: number of the new generation
+        """
+        self.generation += 1
+        self.current_image = image_name
+        for request in [request for request in self.requests if request[1] != image_name]:
+            del self.requests[request]
+            self.loader.cancel(*request)
+        for request in self.requests:
+            self.requests[request] = self.generation
+        return self.generation
+
+    def request(self, kind, image_name, *arguments):
+        """
+        Method that submit to the loader a request for the selected image, tagged with the current generation.
+        Requests for images that are not selected anymore are dropped.
+        :param kind: kind of the request ('display' or 'metadata')
+        :param image_name: name of the image
+        :param arguments: other arguments of the request, such as the size of a display request
+        :return: True if the request was submitted, False if it was dropped
+        """
+        if image_name != self.current_image:
+            return False
+        self.requests[(kind, image_name) + arguments] = self.generation
+        getattr(self.loader, 'request_' + kind)(image_name, *arguments)
+        return True
+
+    def accepts(self, kind, image_name, *arguments):
+        """
+        Method that check if a result delivered by the loader belongs to the latest selection, forgetting the
+        request it answers
+        :param kind: kind of the request
+        :param image_name: name of the image
+        :param arguments: other arguments of the request
+        :return: True if the result must be used, False if it is stale
+        """
+        self.requests.pop((kind, image_name) + arguments, None)
+        return image_name == self.current_image
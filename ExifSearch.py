@@ -0,0 +1,601 @@
+import calendar
+import collections
+import re
+
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from ExifColumns import ColumnStore
+from ExifGeo import GeoIndex
+
+MAX_IN_FLIGHT = 8
+REFRESH_INTERVAL = 300  # milliseconds
+# fields of the queries associated to the tags whose values are indexed as categories
+CATEGORICAL_FIELDS = {'make': 'Make', 'model': 'Model', 'lens': 'LensModel'}
+# fields of the queries associated to the tags whose values are indexed in order
+ORDERED_FIELDS = {'iso': 'ISOSpeedRatings', 'f': 'FNumber', 'date': 'DateTimeOriginal'}
+DATE_FIELD = 'date'
+# fields of the queries answered by the geographic index, with the number of values they take
+GEO_FIELDS = {'near': 3, 'box': 4}
+# field of the queries that orders the images by the time they were taken, with the values it takes and whether they
+# put the most recent images first
+SORT_FIELD = 'sort'
+SORT_ORDERS = {'date': False, '-date': True}
+# field of the queries that groups the images, with the values it takes and the category columns of each group
+GROUP_FIELD = 'group'
+GROUP_COLUMNS = {'camera': ('Make', 'Model')}
+# the value is optional only so that a field followed by nothing is reported, instead of being taken for a word.
+# Quoted parts may be followed by other characters, as the radius in 'near:"/foto/a b.jpg",10'
+TERM_PATTERN = re.compile(r'(?:(\w+)\s*(<=|>=|<|>|=|:)\s*)?((?:"[^"]*"|[^\s"])+)?')
+
+
+class QueryError(Exception):
+    """
+    This class contains the error raised when the text of a query can not be parsed
+    """
+
+
+def categorical_value(value):
+    """
+    Function that normalize the value of a categorical tag, so that values differing only by case or by surrounding
+    blanks are the same category
+    :param value: value of the tag
+    :return: the normalized string, None if the value is empty
+    """
+    if isinstance(value, bytes):
+        value = value.decode('latin-1')
+    value = str(value).strip(' \x00').casefold()
+    return value or None
+
+
+def date_period(prefix):
+    """
+    Function that convert the prefix of the EXIF dates covered by a date of a query into the period it covers
+    :param prefix: the prefix returned by parse_date, such as '2021:03'
+    :return: tuple with the first second of the period and the first second after it, as numpy datetime64
+    """
+    period = np.datetime64(prefix.replace(':', '-'))
+    return period.astype('datetime64[s]'), (period + 1).astype('datetime64[s]')
+
+
+def group_key(values):
+    """
+    Function that return the key that orders the groups of images by their values, regardless of case, with the
+    missing values last
+    :param values: tuple of the values of the group, None for the missing ones
+    :return: the key
+    """
+    return tuple((value is None, (value or '').casefold()) for value in values)
+
+
+def parse_date(text):
+    """
+    Function that convert a date of a query, as 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD', into the prefix shared by the
+    EXIF dates it covers
+    :param text: the date of the query
+    :return: the prefix, such as '2021:03'
+    """
+    match = re.fullmatch(r'(\d{4})(?:[-:/.](\d{1,2})(?:[-:/.](\d{1,2}))?)?', text)
+    if match is None:
+        raise QueryError("data non valida: " + text)
+    year, month, day = (int(part) if part is not None else None for part in match.groups())
+    if (month is not None and not 1 <= month <= 12) or \
+            (day is not None and not 1 <= day <= calendar.monthrange(year, month)[1]):
+        raise QueryError("data non valida: " + text)
+    return ':'.join(part.zfill(2) for part in match.groups() if part is not None)
+
+
+def parse_geo(field, operator, text):
+    """
+    Function that parse the value of a geographic field of a query
+    :param field: 'near' or 'box'
+    :param operator: operator of the condition
+    :param text: the value, numbers separated by commas, or for near the name of an image and the radius
+    :return: tuple of floats: latitude, longitude and radius for near, south, west, north and east for box, or
+             tuple with the name of the image and the radius for near
+    """
+    if operator not in (':', '='):
+        raise QueryError("il campo %s accetta solo ':' e '='" % field)
+    try:
+        values = tuple(float(value) for value in text.split(','))
+    except ValueError:
+        image_name, _, radius = text.rpartition(',')
+        if field != 'near' or not image_name:
+            raise QueryError("coordinate non valide: " + text) from None
+        try:
+            radius = float(radius)
+        except ValueError:
+            raise QueryError("raggio non valido: " + text) from None
+        if not radius > 0:
+            raise QueryError("raggio non valido: " + text)
+        return image_name, radius
+    if len(values) != GEO_FIELDS[field]:
+        raise QueryError("il campo %s richiede %d numeri separati da virgole" % (field, GEO_FIELDS[field]))
+    latitudes, longitudes = (values[:1], values[1:2]) if field == 'near' else (values[::2], values[1::2])
+    if not all(abs(latitude) <= 90 for latitude in latitudes) or \
+            not all(abs(longitude) <= 180 for longitude in longitudes):
+        raise QueryError("coordinate non valide: " + text)
+    if field == 'near' and not values[2] > 0:
+        raise QueryError("raggio non valido: " + text)
+    if field == 'box' and values[0] > values[2]:
+        raise QueryError("il lato sud deve precedere il lato nord: " + text)
+    return values
+
+
+def parse_query(text):
+    """
+    Function that parse the text of a query into a list of conditions, all of which must hold.
+    A condition is a word, searched in make, model and lens, or a field followed by an operator and a value:
+    make, model and lens accept ':' (contains) and '=' (equals), iso, f and date accept ':' and '=' (equals, or
+    within a range written as 'low..high') and the comparisons '<', '<=', '>' and '>='. Dates are written as
+    'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' and cover the whole period, as in 'make:canon iso>3200 date:2021-03'.
+    The geographic fields accept ':' and '=': near takes latitude, longitude and radius in kilometers, as in
+    'near:43.77,11.25,10', or the name of an image and the radius, as in 'near:"/foto/a.jpg",10', to find the other
+    images near that one, box takes south, west, north and east, as in 'box:43,11,44,12'.
+    The field sort does not select images but orders them by the time they were taken: 'sort:date' puts the oldest
+    first and 'sort:-date' the most recent. The field group puts together the images of the same camera, as in
+    'group:camera'.
+    :param text: text of the query
+    :return: list of tuples (field, operator, value), field is None for the words, the value of sort is True for
+             the most recent first and the value of group is a key of GROUP_COLUMNS
+    """
+    conditions = []
+    for field, operator, value in TERM_PATTERN.findall(text):
+        if field and not value:
+            raise QueryError("valore mancante per il campo " + field)
+        value = value.replace('"', '')
+        field = field.casefold()
+        if not field:
+            if value.strip():
+                conditions.append((None, ':', categorical_value(value)))
+        elif field in CATEGORICAL_FIELDS:
+            if operator not in (':', '='):
+                raise QueryError("il campo %s accetta solo ':' e '='" % field)
+            conditions.append((field, operator, categorical_value(value) or ''))
+        elif field in ORDERED_FIELDS:
+            bounds = value.split('..') if operator in (':', '=') else [value]
+            if len(bounds) > 2 or not all(bounds):
+                raise QueryError("intervallo non valido: " + value)
+            if field == DATE_FIELD:
+                bounds = [parse_date(bound) for bound in bounds]
+            else:
+                try:
+                    bounds = [float(bound) for bound in bounds]
+                except ValueError:
+                    raise QueryError("numero non valido: " + value) from None
+            conditions.append((field, '..' if len(bounds) == 2 else operator, tuple(bounds)))
+        elif field in GEO_FIELDS:
+            conditions.append((field, '=', parse_geo(field, operator, value)))
+        elif field == SORT_FIELD:
+            if operator not in (':', '=') or value.casefold() not in SORT_ORDERS:
+                raise QueryError("ordinamento non valido, usare sort:date o sort:-date")
+            conditions.append((field, '=', SORT_ORDERS[value.casefold()]))
+        elif field == GROUP_FIELD:
+            if operator not in (':', '=') or value.casefold() not in GROUP_COLUMNS:
+                raise QueryError("raggruppamento non valido, usare group:camera")
+            conditions.append((field, '=', value.casefold()))
+        else:
+            raise QueryError("campo sconosciuto: " + field)
+    return conditions
+
+
+class SearchIndex:
+    """
+    This class contains the search index of the metadata of the images, built on the column store that holds them.
+    Each categorical tag has an inverted index that associates to each of its values the set of names of the images
+    that have it, updated as images are added and removed. Each ordered tag is answered from its column of the
+    store: after the store changes, the first query on the tag sorts the rows of the column by their values, so that
+    a comparison or a range is answered by binary search on the column through that order and its rows are a slice
+    of an array. The values are never copied out of the store: the categories are read from it to update the
+    inverted indexes, and only the order of the rows is kept for the ordered tags.
+
+    Attributes:
+    columns     reference to an object of class ColumnStore, with the metadata of the indexed images
+    postings    dict that associates to each categorical tag the dict from its values to sets of names of images
+    sorted      dict that associates to each ordered tag a tuple with the version of the store the order was built
+                from, the numpy array of the rows sorted by the value of the tag, those without it last, and the number
+                of rows that have it
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.postings = {tag: {} for tag in CATEGORICAL_FIELDS.values()}
+        self.sorted = {}
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __contains__(self, image_name):
+        return image_name in self.columns
+
+    def add(self, image_name, metadata):
+        """
+        Method that store the metadata of an image in the column store and index them, replacing the ones indexed
+        before for the same image
+        :param image_name: name of the image
+        :param metadata: an object of class ImageMetadata
+        :return:
+        """
+        self.remove(image_name)
+        self.columns.add(image_name, metadata)
+        for tag, postings in self.postings.items():
+            value = self.__category(tag, image_name)
+            if value is not None:
+                postings.setdefault(value, set()).add(image_name)
+
+    def remove(self, image_name):
+        """
+        Method that remove an image from the index and from the column store, if it is indexed
+        :param image_name: name of the image
+        :return:
+        """
+        if image_name not in self.columns:
+            return
+        for tag, postings in self.postings.items():
+            value = self.__category(tag, image_name)
+            if value is not None:
+                names = postings[value]
+                names.discard(image_name)
+                if not names:
+                    del postings[value]
+        self.columns.remove(image_name)
+
+    def clear(self):
+        """
+        Method that remove all the images from the index and from the column store
+        :return:
+        """
+        self.columns.clear()
+        for postings in self.postings.values():
+            postings.clear()
+        self.sorted.clear()
+
+    def search(self, conditions):
+        """
+        Method that find the indexed images that satisfy all the conditions of a query. The conditions on ordered
+        tags are combined on the rows of the store, so that only their intersection becomes a set of names.
+        :param conditions: list of conditions returned by parse_query
+        :return: set of names of the images
+        """
+        matches = [self.__match(condition) for condition in conditions if condition[0] not in ORDERED_FIELDS]
+        selected = None
+        for condition in conditions:
+            if condition[0] in ORDERED_FIELDS:
+                rows = self.__rows(condition)
+                if selected is None:
+                    selected = rows
+                else:
+                    mask = np.zeros(len(self.columns), dtype=bool)
+                    mask[rows] = True
+                    selected = selected[mask[selected]]
+        if selected is not None:
+            matches.append(set(self.columns.image_names()[selected]))
+        if not matches:
+            return set(self.columns.image_names())
+        matches.sort(key=len)
+        return matches[0].intersection(*matches[1:])
+
+    def __category(self, tag, image_name):
+        """
+        Method that return the normalized value of a categorical tag of an image, read from the column store
+        :param tag: name of the tag
+        :param image_name: name of the image
+        :return: the value, None if the image does not have the tag
+        """
+        value = self.columns.category(tag, image_name)
+        return categorical_value(value) if value is not None else None
+
+    def __match(self, condition):
+        """
+        Method that find the images that satisfy a condition on a categorical tag, or on all of them
+        :param condition: tuple (field, operator, value)
+        :return: set of names of the images
+        """
+        field, operator, value = condition
+        tags = CATEGORICAL_FIELDS.values() if field is None else [CATEGORICAL_FIELDS[field]]
+        result = set()
+        for tag in tags:
+            for category, names in self.postings[tag].items():
+                if (value in category) if operator == ':' else (value == category):
+                    result |= names
+        return result
+
+    def __rows(self, condition):
+        """
+        Method that find the rows of the store of the images that satisfy a condition on an ordered tag
+        :param condition: tuple (field, operator, value)
+        :return: numpy array of the rows, sorted by the value of the tag
+        """
+        field, operator, value = condition
+        rows, count = self.__sorted(ORDERED_FIELDS[field])
+        start, end = self.__range(self.columns.column(ORDERED_FIELDS[field]), rows, count, field, operator, value)
+        return rows[start:end]
+
+    def __sorted(self, tag):
+        """
+        Method that return the order of the rows of an ordered tag, sorting its column if the store has changed since
+        it was built
+        :param tag: name of the tag
+        :return: tuple with the numpy array of the rows sorted by the value of the tag and the number of rows that
+                 have it, which come first
+        """
+        version, rows, count = self.sorted.get(tag, (None, None, 0))
+        if version != self.columns.version:
+            column = self.columns.column(tag)
+            # the missing values, NaN and NaT, sort after all the others
+            rows = np.argsort(column, kind='stable')
+            count = len(column) - np.count_nonzero(np.isnat(column) if column.dtype.kind == 'M' else np.isnan(column))
+            self.sorted[tag] = (self.columns.version, rows, count)
+        return rows, count
+
+    @staticmethod
+    def __range(column, rows, count, field, operator, value):
+        """
+        Method that find by binary search the slice of the sorted rows of an ordered tag selected by a condition
+        :param column: numpy array of the values of the tag, by row
+        :param rows: numpy array of the rows sorted by value
+        :param count: number of rows that have the tag
+        :param field: field of the condition
+        :param operator: operator of the condition
+        :param value: tuple with the bound, or the two bounds of a range
+        :return: tuple with the first position selected and the position after the last one
+        """
+        if field == DATE_FIELD:
+            # a date covers the whole period of its prefix
+            bounds = [date_period(value[0])[0], date_period(value[-1])[1]]
+            low_start, high_end = np.searchsorted(column, np.array(bounds), side='left', sorter=rows)
+        else:
+            low_start = np.searchsorted(column, value[0], side='left', sorter=rows)
+            high_end = np.searchsorted(column, value[-1], side='right', sorter=rows)
+        if operator in (':', '=', '..'):
+            return low_start, high_end
+        if operator == '<':
+            return 0, low_start
+        if operator == '<=':
+            return 0, high_end
+        if operator == '>':
+            return high_end, count
+        return low_start, count
+
+
+class SearchIndexer(QObject):
+    """
+    This class contains the indexer that keeps the search index, the column store and the geographic index in step
+    with the images of the model. Images added to the model wait to be indexed, removed images leave the index,
+    and the metadata loaded for any reason, for the selection, for prefetching or by the ingestion of dropped
+    files, are indexed as they arrive.
+    Once a search starts, the metadata of the images still waiting are extracted in background, with at most
+    MAX_IN_FLIGHT requests to the loader at a time; changes of the index are notified at most every REFRESH_INTERVAL.
+
+    Attributes:
+    controller      reference to an object of class ExifController
+    loader          reference to an object of class ImageLoader
+    index           reference to an object of class SearchIndex
+    columns         reference to an object of class ColumnStore, with the metadata of the indexed images
+    geo             reference to an object of class GeoIndex, with the coordinates of the indexed images
+    waiting         ordered dict whose keys are the images not indexed nor requested yet, in the order they were added
+    in_flight       set of the images whose metadata are being extracted for the index
+    failed          number of images whose metadata could not be extracted
+    active          True once a search has started, so that the waiting images are extracted
+    refresh_timer   timer that notifies the changes of the index
+    """
+    index_changed = pyqtSignal()
+
+    def __init__(self, controller, loader, parent=None):
+        super().__init__(parent)
+        self.controller = controller
+        self.loader = loader
+        self.columns = ColumnStore()
+        self.index = SearchIndex(self.columns)
+        self.geo = GeoIndex()
+        self.waiting = collections.OrderedDict()
+        self.in_flight = set()
+        self.failed = 0
+        self.active = False
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.index_changed)
+        self.controller.register('image_added', lambda index, image_name: self.images_added(index, [image_name]))
+        self.controller.register('images_added', self.images_added)
+        self.controller.register('image_removed', self.image_removed)
+        self.controller.register('list_cleared', self.clear)
+        self.controller.register('metadata_ready', self.current_metadata_ready)
+        self.loader.metadata_ready.connect(self.metadata_loaded)
+        self.loader.prepared.connect(self.prepared)
+        self.loader.load_failed.connect(self.load_failed)
+
+    def remaining(self):
+        """
+        Method that return the number of images not indexed yet
+        :return: number of images
+        """
+        return len(self.waiting) + len(self.in_flight)
+
+    def search(self, conditions):
+        """
+        Method that find the indexed images that satisfy a query, starting the extraction of the metadata of the
+        images not indexed yet. If the query has a sort field the images are ordered by the column store by the time
+        they were taken, and if it has a group field they are grouped by the column store, the groups in the order
+        of their values and the images of each group in the order of the model or of the sort field. If there are
+        more sort or group fields, the last one counts.
+        :param conditions: list of conditions returned by parse_query
+        :return: set of names of the images, list of names in the order to show them if the query has a sort or a
+                 group field
+        """
+        self.active = True
+        self.__pump()
+        result = self.index.search([condition for condition in conditions if condition[0] not in GEO_FIELDS
+                                    and condition[0] not in (SORT_FIELD, GROUP_FIELD)])
+        descending = group = None
+        for field, _, value in conditions:
+            if field == 'near' and isinstance(value[0], str):
+                result &= {image_name for image_name, _ in self.geo.near_image(*value)}
+            elif field == 'near':
+                result &= {image_name for image_name, _ in self.geo.within_radius(*value)}
+            elif field == 'box':
+                result &= set(self.geo.within_box(*value))
+            elif field == SORT_FIELD:
+                descending = value
+            elif field == GROUP_FIELD:
+                group = value
+        if descending is None and group is None:
+            return result
+        if descending is not None:
+            ordered = self.columns.sort_by_capture_time(descending)
+        else:
+            ordered = self.controller.get_images()
+        images = [image_name for image_name in ordered if image_name in result]
+        if group is None:
+            return images
+        groups = self.columns.group_by(*GROUP_COLUMNS[group], images=result)
+        ranks = {}
+        for rank, values in enumerate(sorted(groups, key=group_key)):
+            ranks.update(dict.fromkeys(groups[values], rank))
+        return sorted(images, key=ranks.__getitem__)
+
+    def count_groups(self, images, group):
+        """
+        Method that count the images of each group among some images
+        :param images: names of the images
+        :param group: key of GROUP_COLUMNS
+        :return: list of tuples with the values of each group, None for the missing ones, and its number of images,
+                 in the order of the values
+        """
+        counts = self.columns.count_by(*GROUP_COLUMNS[group], images=images)
+        return sorted(counts.items(), key=lambda item: group_key(item[0]))
+
+    def images_added(self, index, image_names):
+        """
+        Method that queue for indexing the images added to the model.
+        It is invoked every time images are added to the model.
+        :param index: position of the first image in the model
+        :param image_names: list of names of the images
+        :return:
+        """
+        self.waiting.update(dict.fromkeys(image_names))
+        self.__pump()
+
+    def image_removed(self, index, image_name):
+        """
+        Method that remove from the index an image removed from the model.
+        It is invoked every time an image is removed from the model.
+        :param index: position of the image in the model
+        :param image_name: name of the image
+        :return:
+        """
+        self.waiting.pop(image_name, None)
+        if image_name in self.in_flight:
+            self.in_flight.discard(image_name)
+            self.loader.cancel('index', image_name)
+        self.index.remove(image_name)
+        self.geo.remove(image_name)
+        self.__changed()
+
+    def clear(self):
+        """
+        Method that empty the index.
+        It is invoked every time the model is emptied.
+        :return:
+        """
+        self.loader.cancel_all('index')
+        self.waiting.clear()
+        self.in_flight.clear()
+        self.index.clear()
+        self.geo.clear()
+        self.failed = 0
+        self.active = False
+        self.__changed()
+
+    def current_metadata_ready(self, image_name):
+        """
+        Method that index the metadata of the selected image, which may have been read from the cache.
+        It is invoked every time the metadata of the current image are available.
+        :param image_name: name of the image
+        :return:
+        """
+        if image_name in self.waiting or image_name in self.in_flight:
+            metadata = self.controller.get_cached_metadata(image_name)
+            if metadata is not None:
+                self.metadata_loaded(image_name, metadata)
+
+    def metadata_loaded(self, image_name, metadata):
+        """
+        Method that index the metadata of an image of the model.
+        It is invoked every time the loader completes the metadata of an image.
+        :param image_name: name of the image
+        :param metadata: an object of class ImageMetadata
+        :return:
+        """
+        if image_name in self.waiting:
+            del self.waiting[image_name]
+        elif image_name in self.in_flight:
+            self.in_flight.discard(image_name)
+        elif image_name not in self.index:
+            return
+        self.__add(image_name, metadata)
+        self.__pump()
+
+    def prepared(self, image_name, stage, error):
+        """
+        Method that index the metadata stored in the cache by the ingestion of the dropped files.
+        It is invoked every time the loader completes a preparation job.
+        :param image_name: name of the image
+        :param stage: 'thumbnail' or 'metadata'
+        :param error: error message, None if the stage succeeded
+        :return:
+        """
+        if stage == 'metadata' and error is None and (image_name in self.waiting or image_name in self.in_flight):
+            metadata = self.controller.get_cached_metadata(image_name)
+            if metadata is not None:
+                self.metadata_loaded(image_name, metadata)
+
+    def load_failed(self, kind, image_name, message):
+        """
+        Method that give up indexing an image whose metadata could not be extracted.
+        It is invoked every time a job of the loader fails.
+        :param kind: kind of the job
+        :param image_name: name of the image
+        :param message: error message
+        :return:
+        """
+        if kind == 'index' and image_name in self.in_flight:
+            self.in_flight.discard(image_name)
+            self.failed += 1
+            self.__changed()
+            self.__pump()
+
+    def __pump(self):
+        """
+        Method that request the metadata of the waiting images until MAX_IN_FLIGHT are in progress, once a search
+        has started. Metadata already cached are indexed at once.
+        :return:
+        """
+        while self.active and self.waiting and len(self.in_flight) < MAX_IN_FLIGHT:
+            image_name, _ = self.waiting.popitem(last=False)
+            metadata = self.controller.get_cached_metadata(image_name, count_miss=False)
+            if metadata is not None:
+                self.__add(image_name, metadata)
+            else:
+                self.in_flight.add(image_name)
+                self.loader.request_index(image_name)
+
+    def __add(self, image_name, metadata):
+        """
+        Method that add the metadata of an image to the search index, which stores them in the column store, and to
+        the geographic index
+        :param image_name: name of the image
+        :param metadata: an object of class ImageMetadata
+        :return:
+        """
+        self.index.add(image_name, metadata)
+        self.geo.add(image_name, metadata.geo)
+        self.__changed()
+
+    def __changed(self):
+        """
+        Method that schedule the notification of a change of the index
+        :return:
+        """
+        if not self.refresh_timer.isActive():
+            self.refresh_timer.start()
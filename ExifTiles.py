@@ -0,0 +1,374 @@
+import math
+import threading
+
+from PIL import Image
+
+from ExifImaging import SWAPPED_ORIENTATIONS, exif_orientation, orient_image
+
+TILE_SIZE = 256
+MAX_LEVEL_PIXELS = 128 * 1024 * 1024
+MAX_DRAFT_SCALE = 8
+# pixels of the bands of rows read to build a reduced level of an image read by region
+REGION_BAND_PIXELS = 16 * 1024 * 1024
+_open_lock = threading.Lock()
+
+
+class ImageTooLargeError(Exception):
+    """
+    This class contains the error raised when even the coarsest level of an image can not be decoded within the
+    maximum number of pixels of a TiledImage
+    """
+
+
+def open_image(image_name):
+    """
+    Function that open an image without the decompression bomb check of Pillow, which refuses images above about
+    178 megapixels. A TiledImage never decodes more than its max_level_pixels, so the check is replaced by that
+    bound. The limit of Pillow is restored before returning; opening reads only the header of the file.
+    :param image_name: path of the image
+    :return: the image, not loaded
+    """
+    with _open_lock:
+        max_image_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(image_name)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+
+def region_blocks(image):
+    """
+    Function that check if an image can be decoded by region: only uncompressed TIFF data are stored in blocks,
+    tiles or strips, that Pillow decodes one by one, and whose rows can be located in the file
+    :param image: image returned by Image.open, not loaded
+    :return: number of bytes of a row of the image, None if the image can not be decoded by region
+    """
+    if image.format != 'TIFF' or not image.tile or image.tag_v2.get(284, 1) != 1:
+        return None
+    if any(tile[0] != 'raw' or tile[3][2] != 1 for tile in image.tile):
+        return None
+    return (image.width * sum(image.tag_v2.get(258, (1,))) + 7) // 8
+
+
+def moved_block(block, extents, offset):
+    """
+    Function that return a block of an image as listed by Pillow, moved to other extents and offset in the file
+    :param block: entry of the tile list of the image, a tuple (decoder, extents, offset, arguments)
+    :param extents: tuple (left, top, right, bottom) of the block in the image
+    :param offset: position of the data of the block in the file
+    :return: the entry, of the same type as the given one
+    """
+    if hasattr(block, '_replace'):
+        return block._replace(extents=extents, offset=offset)
+    return block[0], extents, offset, block[3]
+
+
+def read_region(image, box, row_bytes):
+    """
+    Function that decode only the part of an image that covers a box. The blocks of the image that cross the box are
+    kept, the blocks as wide as the image are cut to the rows of the box, and the image is resized to the union of
+    what is left before it is loaded.
+    :param image: image returned by Image.open, not loaded, for which region_blocks does not return None
+    :param box: tuple (left, top, right, bottom) in the image
+    :param row_bytes: number of bytes of a row of the image, returned by region_blocks
+    :return: the pixels of the box
+    """
+    left, top, right, bottom = box
+    blocks = []
+    for block in image.tile:
+        (x0, y0, x1, y1), offset = block[1], block[2]
+        if x0 >= right or x1 <= left or y0 >= bottom or y1 <= top:
+            continue
+        if x0 == 0 and x1 == image.width:
+            offset += (max(y0, top) - y0) * (block[3][1] or row_bytes)
+            y0, y1 = max(y0, top), min(y1, bottom)
+        blocks.append(moved_block(block, (x0, y0, x1, y1), offset))
+    x0, y0 = min(block[1][0] for block in blocks), min(block[1][1] for block in blocks)
+    x1, y1 = max(block[1][2] for block in blocks), max(block[1][3] for block in blocks)
+    image.tile = [moved_block(block, (block[1][0] - x0, block[1][1] - y0, block[1][2] - x0, block[1][3] - y0),
+                              block[2]) for block in blocks]
+    image._size = (x1 - x0, y1 - y0)
+    image.load()
+    return image.crop((left - x0, top - y0, right - x0, bottom - y0))
+
+
+def displayable(image):
+    """
+    Function that convert an image to a mode that can be reduced and shown
+    :param image: the image, loaded
+    :return: the image with RGB or RGBA mode
+    """
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    return image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+
+def stored_box(box, orientation, size):
+    """
+    Function that map a box of an image shown upright to the box of the same pixels in the image as it is stored,
+    before the EXIF orientation is applied
+    :param box: tuple (left, top, right, bottom) in the upright image
+    :param orientation: value of the EXIF Orientation tag
+    :param size: tuple (width, height) of the upright image
+    :return: tuple (left, top, right, bottom) in the stored image
+    """
+    left, top, right, bottom = box
+    width, height = size
+    if orientation == 2:
+        return width - right, top, width - left, bottom
+    if orientation == 3:
+        return width - right, height - bottom, width - left, height - top
+    if orientation == 4:
+        return left, height - bottom, right, height - top
+    if orientation == 5:
+        return top, left, bottom, right
+    if orientation == 6:
+        return top, width - right, bottom, width - left
+    if orientation == 7:
+        return height - bottom, width - right, height - top, width - left
+    if orientation == 8:
+        return height - bottom, left, height - top, right
+    return box
+
+
+class TiledImage:
+    """
+    This class contains an image split in square tiles at several resolutions, so that a view can decode only the
+    part of the image it shows at the resolution it shows it. Level 0 is the full resolution and every next level
+    halves the previous one, down to the level that fits a single tile.
+    Uncompressed TIFF images are read by region: a tile of level 0 decodes only the blocks of the file it crosses,
+    and a reduced level is built from bands of rows, so the whole image is never in memory. JPEG and PNG data, as
+    well as compressed TIFF, can not be read by region, so the tiles of a level are cut from the whole level. JPEG
+    levels are decoded directly at reduced resolution by the decoder, down to 1/MAX_DRAFT_SCALE; the other formats
+    are decoded at full size and then reduced.
+    The reduced levels are cached once built, together with the ones passed through when the whole image was
+    decoded at full size, and a level is reduced from the finest cached one, so changing the zoom does not decode
+    the image again. They take at most a third of the full size; the full size itself is kept only while
+    it is the level requested. Levels whose decode exceeds max_level_pixels are never decoded: zooming past them
+    magnifies the finest level allowed. Images whose coarsest level exceeds it, such as a PNG above
+    max_level_pixels, are refused with ImageTooLargeError, so the memory used is bounded whatever the size of the
+    image.
+    Tiles and levels are in upright coordinates, the EXIF orientation is applied to each tile.
+    All the methods are thread safe. The cache of the levels is locked only to look up and store the levels: tiles
+    read by region and tiles of cached levels are decoded in parallel, while the decodes of whole images wait for
+    each other, so that only one is in memory.
+
+    Attributes:
+    image_name      path of the image
+    tile_size       side in pixels of the tiles
+    format          format of the image, as reported by Pillow
+    orientation     value of the EXIF Orientation tag of the image
+    stored_size     tuple (width, height) of the image as it is stored
+    size            tuple (width, height) of the upright image
+    levels          list of the tuples (width, height) of the upright image at each level
+    row_bytes       number of bytes of a row of the image if it is read by region, None otherwise
+    block_size      tuple (width, height) of the largest block of the file decoded by a region read
+    min_level       finest level whose decode does not exceed max_level_pixels
+    """
+
+    def __init__(self, image_name, tile_size=TILE_SIZE, max_level_pixels=MAX_LEVEL_PIXELS):
+        self.image_name = image_name
+        self.tile_size = tile_size
+        with open_image(image_name) as image:
+            self.format = image.format
+            self.orientation = exif_orientation(image)
+            self.stored_size = image.size
+            self.row_bytes = region_blocks(image)
+            if self.row_bytes is not None:
+                # blocks as wide as the image are cut to single rows
+                self.block_size = (max(x1 - x0 for _, (x0, _, x1, _), _, _ in image.tile),
+                                   max(1 if x1 - x0 == image.width else y1 - y0
+                                       for _, (x0, y0, x1, y1), _, _ in image.tile))
+            else:
+                self.block_size = self.stored_size
+        width, height = self.stored_size
+        if self.orientation in SWAPPED_ORIENTATIONS:
+            width, height = height, width
+        self.size = (width, height)
+        self.levels = [self.size]
+        while max(self.levels[-1]) > tile_size:
+            factor = 2 ** len(self.levels)
+            self.levels.append((-(-width // factor), -(-height // factor)))
+        self.min_level = next((level for level in range(len(self.levels))
+                               if self.decode_pixels(level) <= max_level_pixels), None)
+        if self.min_level is None:
+            raise ImageTooLargeError("%dx%d %s image needs %d pixels at its coarsest level, the limit is %d" % (
+                *self.stored_size, self.format, self.decode_pixels(len(self.levels) - 1), max_level_pixels))
+        self._levels = {}
+        self._lock = threading.Lock()
+        self._decode_lock = threading.Lock()
+
+    def decode_pixels(self, level):
+        """
+        Method that return the number of pixels decoded to build a level, or to decode a tile of level 0 of an
+        image read by region
+        :param level: the level
+        :return: number of pixels
+        """
+        width, height = self.stored_size
+        if self.row_bytes is not None:
+            if not level:
+                return self.__region_pixels(self.tile_size, self.tile_size)
+            factor = 2 ** level
+            return -(-width // factor) * -(-height // factor) + self.__region_pixels(width, self.__band_rows(level))
+        scale = min(2 ** level, MAX_DRAFT_SCALE) if self.format == 'JPEG' else 1
+        return -(-width // scale) * -(-height // scale)
+
+    def level_for_scale(self, scale):
+        """
+        Method that return the coarsest level whose resolution is at least the one of the view
+        :param scale: ratio between the size of the image in the view and its full size
+        :return: the level
+        """
+        level = math.floor(-math.log2(scale)) if scale < 1 else 0
+        return max(self.min_level, min(level, len(self.levels) - 1))
+
+    def grid(self, level):
+        """
+        Method that return the number of tiles of a level
+        :param level: the level
+        :return: tuple with the number of columns and rows
+        """
+        width, height = self.levels[level]
+        return -(-width // self.tile_size), -(-height // self.tile_size)
+
+    def tile_box(self, level, column, row):
+        """
+        Method that return the pixels of a level covered by a tile
+        :param level: the level
+        :param column: column of the tile
+        :param row: row of the tile
+        :return: tuple (left, top, right, bottom) in the upright image at that level
+        """
+        width, height = self.levels[level]
+        left, top = column * self.tile_size, row * self.tile_size
+        return left, top, min(left + self.tile_size, width), min(top + self.tile_size, height)
+
+    def decode_tile(self, level, column, row):
+        """
+        Method that decode a tile, reading it by region if the image allows it or cutting it from its level
+        :param level: the level
+        :param column: column of the tile
+        :param row: row of the tile
+        :return: the tile, upright, with RGB or RGBA mode
+        """
+        box = stored_box(self.tile_box(level, column, row), self.orientation, self.levels[level])
+        if self.row_bytes is not None and not level:
+            tile = displayable(read_region(open_image(self.image_name), box, self.row_bytes))
+        else:
+            tile = self.__level_image(level).crop(box)
+        return orient_image(tile, self.orientation)
+
+    def release(self):
+        """
+        Method that release the decoded levels kept by the image
+        :return:
+        """
+        with self._lock:
+            self._levels.clear()
+
+    def __band_rows(self, level):
+        """
+        Method that return the number of rows of the bands read to build a reduced level of an image read by region,
+        a multiple of the reduction so that each band is reduced on its own
+        :param level: the level
+        :return: number of rows
+        """
+        factor = 2 ** level
+        return factor * max(1, REGION_BAND_PIXELS // (self.stored_size[0] * factor))
+
+    def __region_pixels(self, width, height):
+        """
+        Method that return the number of pixels decoded at most to read a region of an image read by region, the
+        blocks of the file crossed by the region included
+        :param width: width of the region
+        :param height: height of the region
+        :return: number of pixels
+        """
+        block_width, block_height = self.block_size
+        return min(self.stored_size[0], (-(-width // block_width) + 1) * block_width) * \
+            min(self.stored_size[1], (-(-height // block_height) + 1) * block_height)
+
+    def __level_image(self, level):
+        """
+        Method that return a level as it is stored, from the cache or reduced from a finer cached level if possible,
+        decoding it otherwise. The full size kept is released as soon as another level is requested.
+        :param level: the level
+        :return: the image of the level, with RGB or RGBA mode
+        """
+        if level:
+            with self._lock:
+                self._levels.pop(0, None)
+        image = self.__cached_level(level)
+        if image is None:
+            with self._decode_lock:
+                # another decode may have built the level, or a finer one, while waiting
+                image = self.__cached_level(level)
+                if image is None:
+                    image = self.__decode_level(level)
+        return image
+
+    def __cached_level(self, level):
+        """
+        Method that return a level from the cache, reducing and caching it if only a finer level is cached
+        :param level: the level
+        :return: the image of the level, None if neither the level nor a finer one is cached
+        """
+        with self._lock:
+            image = self._levels.get(level)
+            source = max((cached for cached in self._levels if cached < level), default=None)
+            if image is not None or source is None:
+                return image
+            image = self._levels[source]
+        image = image.reduce(2 ** (level - source))
+        self.__keep(level, image)
+        return image
+
+    def __decode_level(self, level):
+        """
+        Method that decode a level from the file and cache it. When the whole image is decoded at full size, the
+        levels between it and the requested one are cached as they are reduced.
+        :param level: the level
+        :return: the image of the level, with RGB or RGBA mode
+        """
+        factor = 2 ** level
+        if self.row_bytes is not None:
+            width, height = self.stored_size
+            rows = self.__band_rows(level)
+            reduced = None
+            for top in range(0, height, rows):
+                band = displayable(read_region(open_image(self.image_name), (0, top, width, min(top + rows, height)),
+                                               self.row_bytes)).reduce(factor)
+                if reduced is None:
+                    reduced = Image.new(band.mode, (-(-width // factor), -(-height // factor)))
+                reduced.paste(band, (0, top // factor))
+            return self.__keep(level, reduced)
+        image = open_image(self.image_name)
+        if image.format == 'JPEG':
+            scale = min(factor, MAX_DRAFT_SCALE)
+            image.draft('RGB', (-(-image.width // scale), -(-image.height // scale)))
+            image.load()
+            reduction = factor // max(1, round(self.stored_size[0] / image.width))
+            image = displayable(image)
+            if reduction >= 2:
+                image = image.reduce(reduction)
+        else:
+            image.load()
+            image = displayable(image)
+            for finer_level in range(1, level):
+                self.__keep(finer_level, image.reduce(2 ** finer_level))
+            if level:
+                image = image.reduce(factor)
+        return self.__keep(level, image)
+
+    def __keep(self, level, image):
+        """
+        Method that cache a level
+        :param level: the level
+        :param image: the image of the level
+        :return: the image
+        """
+        with self._lock:
+            self._levels[level] = image
+        return image
@@ -1,8 +1,18 @@
-from PyQt5.QtCore import QSize, Qt
-from PyQt5.QtGui import QIcon
+import html
+
+from PyQt5.QtCore import QSize, Qt, QTimer, QUrl
+from PyQt5.QtGui import QDesktopServices, QIcon, QKeySequence
 from PyQt5.QtWidgets import QWidget, QLabel, QPushButton, QListView, QHBoxLayout, QVBoxLayout, QFileDialog, \
-    QScrollArea, QDesktopWidget
-from ExifWidgets import ImageList, ImageBox, DataTab
+    QScrollArea, QDesktopWidget, QShortcut, QProgressBar, QStackedWidget, QLineEdit
+from ExifGeo import gps_coordinates
+from ExifIngest import IngestPipeline
+from ExifLoader import FolderImporter
+from ExifSearch import GEO_FIELDS, GROUP_FIELD, QueryError, SearchIndexer, parse_query
+from ExifWidgets import ImageList, ImageBox, DataTab, ZoomView
+
+SEARCH_DELAY = 150  # milliseconds
+NEAR_RADIUS = 10  # kilometers
+MAX_LISTED_GROUPS = 20
 
 
 class ExifView(QWidget):
@@ -12,15 +22,24 @@ class ExifView(QWidget):
     Attributes:
     controller   reference to an object of class ExifController
     image_box    reference to an object of class ImageBox
+    zoom_view    reference to an object of class ZoomView, shown instead of the image box when zoom is active
     image_list   reference to an object of class ImageList
     tab_data     reference to an object of class DataTab
+    display_cache_bytes     memory budget in bytes of the images decoded for the image box, prefetched ones included
+    folder_importer         reference to the object of class FolderImporter of the folder being imported, if any
+    ingest_pipeline         reference to an object of class IngestPipeline, that ingests the dropped files
+    search_indexer          reference to an object of class SearchIndexer, that indexes the metadata for the filter
 
     and other graphical elements
     """
 
-    def __init__(self, controller):
+    def __init__(self, controller, display_cache_bytes=96 * 1024 * 1024):
         super().__init__()
         self.controller = controller
+        self.display_cache_bytes = display_cache_bytes
+        self.folder_importer = None
+        self.ingest_pipeline = IngestPipeline(self.controller, self.controller.get_loader(), self)
+        self.search_indexer = SearchIndexer(self.controller, self.controller.get_loader(), self)
         self.init_UI()
         self.center_on_screen()
 
@@ -40,15 +59,22 @@ class ExifView(QWidget):
         self.scroll_bar.setVisible(False)
         self.scroll_bar.setStyleSheet("border: 0")
 
-        self.image_box = ImageBox(view=self, controller=self.controller)
+        self.image_box = ImageBox(view=self, controller=self.controller,
+                                  pixmap_cache_bytes=self.display_cache_bytes)
         self.image_box.resize(500, 400)
 
+        self.zoom_view = ZoomView(image_box=self.image_box, controller=self.controller)
+
+        self.image_stack = QStackedWidget()
+        self.image_stack.addWidget(self.image_box)
+        self.image_stack.addWidget(self.zoom_view)
+
         self.tab_data = DataTab(view=self, controller=self.controller)
         self.tab_data.resize(300, 400)
 
         self.geo_info = QLabel()
         self.geo_info.setText("")
-        self.geo_info.setOpenExternalLinks(True)
+        self.geo_info.linkActivated.connect(self.open_geo_link)
         self.geo_info.setMaximumHeight(50)
         self.geo_info.setAlignment(Qt.AlignCenter)
 
@@ -66,10 +92,21 @@ class ExifView(QWidget):
         self.right_rotate.setIconSize(QSize(24, 24))
         self.right_rotate.clicked.connect(self.image_box.rotate_to_right)
 
+        self.zoom_btn = QPushButton()
+        self.zoom_btn.setVisible(False)
+        self.zoom_btn.setText("Zoom")
+        self.zoom_btn.setCheckable(True)
+        self.zoom_btn.setMaximumHeight(30)
+        self.zoom_btn.toggled.connect(self.toggle_zoom)
+
         self.add_image_btn = QPushButton()
         self.add_image_btn.setText("Aggiungi immagine")
         self.add_image_btn.clicked.connect(self.insert_image)
 
+        self.import_folder_btn = QPushButton()
+        self.import_folder_btn.setText("Importa cartella")
+        self.import_folder_btn.clicked.connect(self.import_folder)
+
         self.delete_image_btn = QPushButton()
         self.delete_image_btn.setEnabled(False)
         self.delete_image_btn.setText("Rimuovi immagine")
@@ -82,15 +119,42 @@ class ExifView(QWidget):
         self.image_list.setFlow(QListView.LeftToRight)
         self.image_list.setMaximumHeight(120)
 
+        self.ingest_status = QLabel()
+        self.ingest_progress = QProgressBar()
+        self.ingest_progress.setMaximumHeight(20)
+        self.ingest_cancel_btn = QPushButton()
+        self.ingest_cancel_btn.setText("Annulla")
+        self.ingest_cancel_btn.clicked.connect(self.ingest_pipeline.cancel)
+        self.ingest_pipeline.registered_batch.connect(self.select_first_added)
+        self.ingest_pipeline.progress_changed.connect(self.update_ingest_progress)
+        self.ingest_pipeline.finished.connect(self.update_ingest_progress)
+
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Filtra, ad esempio: make:canon iso>3200 date:2021-03")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_status = QLabel()
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.apply_filter)
+        self.search_edit.textChanged.connect(lambda text: self.search_timer.start())
+        self.search_indexer.index_changed.connect(self.refresh_filter)
+
+        self.next_shortcut = QShortcut(QKeySequence(Qt.Key_Right), self)
+        self.next_shortcut.activated.connect(self.image_list.show_next)
+        self.previous_shortcut = QShortcut(QKeySequence(Qt.Key_Left), self)
+        self.previous_shortcut.activated.connect(self.image_list.show_previous)
+
         up_image_box = QHBoxLayout()
         up_image_box.addWidget(self.scroll_bar)
         up_image_box.addStretch()
+        up_image_box.addWidget(self.zoom_btn)
         up_image_box.addWidget(self.left_rotate)
         up_image_box.addWidget(self.right_rotate)
 
         image_layout = QVBoxLayout()
         image_layout.addLayout(up_image_box)
-        image_layout.addWidget(self.image_box)
+        image_layout.addWidget(self.image_stack)
         image_layout.addWidget(self.geo_info)
 
         up_box = QHBoxLayout()
@@ -99,35 +163,45 @@ class ExifView(QWidget):
 
         list_button_box = QVBoxLayout()
         list_button_box.addWidget(self.add_image_btn)
+        list_button_box.addWidget(self.import_folder_btn)
         list_button_box.addWidget(self.delete_image_btn)
         list_button_box.addWidget(self.empty_list_btn)
 
+        search_box = QHBoxLayout()
+        search_box.addWidget(self.search_edit)
+        search_box.addWidget(self.search_status)
+
         bottom_box = QHBoxLayout()
         bottom_box.addWidget(self.image_list)
         bottom_box.addLayout(list_button_box)
 
+        self.ingest_box = QWidget()
+        ingest_layout = QHBoxLayout()
+        ingest_layout.setContentsMargins(0, 0, 0, 0)
+        ingest_layout.addWidget(self.ingest_status)
+        ingest_layout.addWidget(self.ingest_progress)
+        ingest_layout.addWidget(self.ingest_cancel_btn)
+        self.ingest_box.setLayout(ingest_layout)
+        self.ingest_box.setVisible(False)
+
         layout = QVBoxLayout()
         layout.addLayout(up_box)
+        layout.addLayout(search_box)
         layout.addLayout(bottom_box)
+        layout.addWidget(self.ingest_box)
 
-        self.image_box.register(self.update_control)
-        self.image_box.register(self.update_current_path)
-        self.image_box.register(self.update_current_geo)
-        self.image_box.register(self.tab_data.update_tab_value)
+        self.controller.register('selection_changed', self.update_control)
+        self.controller.register('selection_changed', self.update_current_path)
+        self.controller.register('selection_changed', self.tab_data.show_loading)
+        self.controller.register('selection_changed', self.update_current_geo)
+        self.controller.register('metadata_ready', self.update_current_geo)
+        self.controller.register('metadata_ready', self.tab_data.update_tab_value)
 
         self.setLayout(layout)
 
         self.setMinimumSize(800, 600)
         self.show()
 
-    def resizeEvent(self, ev):
-        """
-        Method for window resize event
-        :return:
-        """
-        self.image_box.show_image()
-        super().resizeEvent(ev)
-
     def center_on_screen(self):
         """
         Method that center the window on the screen
@@ -149,44 +223,213 @@ class ExifView(QWidget):
                                                   "Images (*.jpg *.jpeg *.png *.JPG *.PNG)",
                                                   options=options)
         if filename:
+            if self.search_edit.text():
+                # the image added is shown and selected, so the list must show all the images
+                self.search_edit.clear()
+                self.apply_filter()
             result_op = self.controller.insert_image(filename)
             if result_op:
                 self.image_list.add_image()
 
-    def update_control(self):
+    def import_folder(self):
+        """
+        Method that handles importing all the images of a folder and of its subfolders.
+        The folder is walked in background and the images are added to the list in batches as they are found.
+        :return:
+        """
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        directory = QFileDialog.getExistingDirectory(self, "Importa cartella", "", options=options)
+        if directory:
+            if self.folder_importer is not None:
+                self.folder_importer.cancel()
+            self.folder_importer = FolderImporter(directory, parent=self)
+            self.folder_importer.batch_found.connect(self.folder_batch_found)
+            self.folder_importer.finished.connect(self.folder_imported)
+            self.folder_importer.start()
+
+    def folder_batch_found(self, images):
+        """
+        Method that adds to the list a batch of images found by the folder import. If no image is shown, the first
+        image added is selected, which is the only one whose metadata are extracted.
+        It is invoked every time the folder import finds a batch of images.
+        :param images: list of names of the images
+        :return:
+        """
+        importer = self.sender()
+        if importer is not self.folder_importer or importer.is_cancelled():
+            return
+        self.select_first_added(self.controller.insert_images(images))
+
+    def select_first_added(self, added):
+        """
+        Method that selects the first of the images just added to the list, if no image is shown
+        :param added: list of names of the images added
+        :return:
+        """
+        if added and self.controller.get_current_image() is None:
+            row = self.image_list.row_of(added[0])
+            if row is not None:
+                self.image_list.show_row(row)
+
+    def folder_imported(self, count):
+        """
+        Method that releases the folder import once the walk is over.
+        It is invoked every time a folder import finishes.
+        :param count: number of images found
+        :return:
+        """
+        importer = self.sender()
+        if importer is self.folder_importer:
+            self.folder_importer = None
+        importer.deleteLater()
+
+    def apply_filter(self):
+        """
+        Method that narrows the list to the images whose metadata satisfy the query written in the filter, or shows
+        all the images if the filter is empty. The images not indexed yet are indexed in background and the list is
+        refreshed as they are. If the query groups the images, the number of images of each group is listed in the
+        tooltip of the status.
+        It is invoked every time the text of the filter stops changing.
+        :return:
+        """
+        self.search_timer.stop()
+        text = self.search_edit.text().strip()
+        if not text:
+            self.image_list.set_filter(None)
+            self.search_status.setText("")
+            self.search_status.setToolTip("")
+            return
+        try:
+            conditions = parse_query(text)
+        except QueryError as e:
+            self.search_status.setText("Filtro non valido: " + str(e))
+            return
+        images = self.search_indexer.search(conditions)
+        self.image_list.set_filter(images)
+        status = "%d di %d immagini" % (len(images), len(self.controller.get_images()))
+        if self.search_indexer.remaining():
+            status += ", %d da indicizzare" % self.search_indexer.remaining()
+        if any(field in GEO_FIELDS for field, _, _ in conditions):
+            status += ", %d con posizione" % self.search_indexer.geo.located()
+        tooltip = self.search_indexer.columns.memory_report()
+        groups = [value for field, _, value in conditions if field == GROUP_FIELD]
+        if groups:
+            counts = self.search_indexer.count_groups(images, groups[-1])
+            status += ", %d gruppi" % len(counts)
+            lines = ["%s: %d" % (" ".join(value for value in values if value is not None) or "Sconosciuto", count)
+                     for values, count in counts[:MAX_LISTED_GROUPS]]
+            if len(counts) > MAX_LISTED_GROUPS:
+                lines.append("e altri %d gruppi" % (len(counts) - MAX_LISTED_GROUPS))
+            tooltip = "\n".join(lines) + "\n\n" + tooltip
+        self.search_status.setText(status)
+        self.search_status.setToolTip(tooltip)
+
+    def refresh_filter(self):
+        """
+        Method that applies again the filter, if any, once the search index has changed.
+        It is invoked periodically while the search index changes.
+        :return:
+        """
+        if self.search_edit.text().strip():
+            self.apply_filter()
+
+    def ingest(self, paths):
+        """
+        Method that hands dropped files and folders to the ingestion pipeline
+        :param paths: list of paths of files and folders
+        :return:
+        """
+        self.ingest_pipeline.add(paths)
+
+    def update_ingest_progress(self):
+        """
+        Method that updates the progress of the ingestion of the dropped files, hiding it once the ingestion is over.
+        It is invoked periodically while the ingestion pipeline is active.
+        :return:
+        """
+        pipeline = self.ingest_pipeline
+        if not pipeline.is_active():
+            self.ingest_box.setVisible(False)
+            return
+        self.ingest_box.setVisible(True)
+        self.ingest_status.setText("Valide: %d  Aggiunte: %d  Miniature: %d  Metadati: %d"
+                                   % (pipeline.validated, pipeline.registered, pipeline.thumbnails,
+                                      pipeline.metadata))
+        self.ingest_progress.setMaximum(max(pipeline.registered, 1))
+        self.ingest_progress.setValue(pipeline.metadata)
+
+    def cancel_import(self):
+        """
+        Method that stops the folder import and the ingestion of the dropped files in progress, if any
+        :return:
+        """
+        if self.folder_importer is not None:
+            self.folder_importer.cancel()
+            self.folder_importer = None
+        self.ingest_pipeline.cancel()
+
+    def toggle_zoom(self, checked):
+        """
+        Method that switches between the image box and the zoom view, in which the image can be zoomed up to its
+        full resolution and beyond
+        :param checked: True to show the zoom view, False to show the image box
+        :return:
+        """
+        self.image_stack.setCurrentWidget(self.zoom_view if checked else self.image_box)
+
+    def update_control(self, image_name=None):
         """
         Method that updates the visibility of controls based on whether or not an image is represented in the image box.
-        It is invoked every time the image is represented in the ImageBox changes.
+        It is invoked every time the selection changes.
+        :param image_name: name of the image selected
         :return:
         """
         visibility_control = True if self.controller.get_current_image() is not None else False
+        self.zoom_btn.setVisible(visibility_control)
         self.left_rotate.setVisible(visibility_control)
         self.right_rotate.setVisible(visibility_control)
         self.tab_data.setVisible(visibility_control)
         self.scroll_bar.setVisible(visibility_control)
 
-    def update_current_geo(self):
+    def update_current_geo(self, image_name=None):
         """
-        Method that updates the geo link of the current image.
-        It is invoked every time the image is represented in the ImageBox changes.
+        Method that updates the geo link of the current image, which is empty until its metadata are available.
+        It is invoked every time the selection changes and every time the metadata of the current image are available.
+        :param image_name: name of the image the metadata belong to
         :return:
         """
-        geo = self.controller.get_current_geo()
-        if geo == None:
+        coordinates = gps_coordinates(self.controller.get_current_geo())
+        if coordinates is None:
             self.geo_info.setText("")
         else:
-            latitude = geo['GPSLatitude']
-            longitude = geo['GPSLongitude']
-            latitude_coord = float(latitude[0] + latitude[1] / 60 +latitude[2] / 3600)
-            longitude_coord = float(longitude[0] + longitude[1] / 60 + longitude[2] / 3600)
-            url_geo = "https://www.google.it/maps?q="+str(latitude_coord)+","+ str(longitude_coord)
-            url_link = "<a href=\""+url_geo+"\">Apri posizione in Google Maps</a>"
+            latitude, longitude = coordinates
+            url_geo = "https://www.google.it/maps?q=%.6f,%.6f" % (latitude, longitude)
+            # the query names the current image, so that it is left out of the images near it
+            near_query = 'near:"%s",%g' % (self.controller.get_current_image(), NEAR_RADIUS)
+            url_link = "<a href=\"" + url_geo + "\">Apri posizione in Google Maps</a>"
+            url_link += " | <a href=\"" + html.escape(near_query) + "\">Altre immagini entro %g km</a>" % NEAR_RADIUS
             self.geo_info.setText(url_link)
 
-    def update_current_path(self):
+    def open_geo_link(self, link):
+        """
+        Method that opens a link of the geo info: the position in the browser, or the filter of the images taken
+        near the current one.
+        It is invoked every time a link of the geo info is clicked.
+        :param link: the link clicked
+        :return:
+        """
+        if link.startswith('near:'):
+            self.search_edit.setText(link)
+            self.apply_filter()
+        else:
+            QDesktopServices.openUrl(QUrl(link))
+
+    def update_current_path(self, image_name=None):
         """
         Method that updates the path label of the current image.
-        It is invoked every time the image is represented in the ImageBox changes.
+        It is invoked every time the selection changes.
+        :param image_name: name of the image selected
         :return:
         """
         path = self.controller.get_current_image()
@@ -1,10 +1,32 @@
-from PyQt5.QtCore import pyqtSignal, QSize, QFileInfo
-from PyQt5.QtGui import QPixmap, QTransform, QImage, QIcon
-from PyQt5.QtWidgets import QLabel, QSizePolicy, QListWidget, QListWidgetItem, QTabWidget, QVBoxLayout, QWidget, \
-    QTreeWidget, QTreeWidgetItem
+from PyQt5.QtCore import QPointF, QRectF, QSize, QTimer, QModelIndex
+from PyQt5.QtGui import QPainter, QPixmap, QTransform
+from PyQt5.QtWidgets import QLabel, QSizePolicy, QListView, QTabWidget, QVBoxLayout, QWidget, QTreeView
 from PyQt5.QtCore import Qt
 from PIL import Image
 
+from ExifCache import LRUCache
+from ExifImaging import DISPLAY_SIZE
+from ExifItemModels import ImageListModel, MetadataTreeModel
+from ExifLoader import PRIORITY_CURRENT, PRIORITY_PREFETCH, PRIORITY_VISIBLE
+from ExifTiles import ImageTooLargeError, TiledImage
+
+RESIZE_DELAY = 100  # milliseconds
+VISIBLE_DELAY = 50  # milliseconds
+LAYOUT_BATCH = 1000
+ZOOM_STEP = 1.25
+MAX_ZOOM = 8.0
+LOADING_TEXT = "Caricamento dei metadati..."
+
+
+def pixmap_size(pixmap):
+    """
+    Function that return the memory occupied by the pixels of a pixmap
+    :param pixmap: the pixmap
+    :return: size in bytes
+    """
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
 class ImageBox(QLabel):
     """
     This class contains the object for the representation of the current image
@@ -12,108 +34,477 @@ class ImageBox(QLabel):
     Attributes:
     view           reference to an object of class ExifView
     controller     reference to an object of class ExifController
+    loader         reference to an object of class ImageLoader, used to decode the images in background
+    image_shown    image whose pixmap is shown in the box, or is being decoded
+    pixmap_cache   cache of the pixmaps decoded at display resolution, keyed by image and decode size
+    scaled_cache   cache of the pixmaps scaled to the box, keyed by image, rotation and size of the box
+    resize_timer   timer that delays the update of the pixmap until the box stops being resized
 
 
     """
-    image_changed = pyqtSignal()
-
-    def __init__(self, view, controller):
+    def __init__(self, view, controller, pixmap_cache_bytes=96 * 1024 * 1024, scaled_cache_bytes=32 * 1024 * 1024):
         QLabel.__init__(self, view)
         self.view = view
         self.controller = controller
+        self.loader = controller.get_loader()
         self.setAlignment(Qt.AlignCenter)
         self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
         self.setAcceptDrops(True)
-        self.rotation = 0
+        self.image_shown = None
+        self.pixmap_cache = LRUCache(max_entries=256, max_bytes=pixmap_cache_bytes, sizeof=pixmap_size)
+        self.scaled_cache = LRUCache(max_entries=256, max_bytes=scaled_cache_bytes, sizeof=pixmap_size)
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(RESIZE_DELAY)
+        self.resize_timer.timeout.connect(self.update_pixmap)
+        self.loader.display_ready.connect(self.display_loaded)
+        self.controller.register('selection_changed', self.show_image)
+        self.controller.register('rotation_changed', self.rotate_image)
+
+    def show_image(self, image_name=None):
+        """
+        Method that show the current image. If no image is selected, clear the empty box.
+        A newly selected image that is not cached is decoded in background and shown by display_loaded.
+        It is invoked every time the selection changes.
+        :param image_name: name of the image selected
+        :return:
+        """
+        image_to_show = self.controller.get_current_image()
+        if image_to_show and image_to_show != self.image_shown:
+            self.image_shown = image_to_show
+            if (image_to_show, DISPLAY_SIZE) not in self.pixmap_cache:
+                self.controller.request_display(image_to_show, DISPLAY_SIZE)
+            if self.update_pixmap():
+                self.controller.pixmap_loaded(image_to_show)
+        elif image_to_show:
+            self.update_pixmap()
+        elif not image_to_show:
+            self.image_shown = None
+            self.setPixmap(QPixmap())
 
-    def register(self, slot):
+    def rotate_image(self, image_name, rotation):
         """
-        Method that attach a slot to call when signal is emitted.
-        :param slot: function that must be called when the signal on image_changed is emitted
+        Method that show the current image with its new rotation.
+        It is invoked every time the current image is rotated.
+        :param image_name: name of the image
+        :param rotation: rotation of the image in degrees
         :return:
         """
-        self.image_changed.connect(slot)
+        self.update_pixmap()
 
-    def show_image(self):
+    def display_loaded(self, image_name, size, image):
         """
-        Method that show the current image. If no image is selected, clear the empty box.
-        At the end it emits a signal on the image_changed object
+        Method that store an image decoded by the loader and show it, if it is still the one to show.
+        It is invoked every time the loader completes the decode of an image.
+        :param image_name: name of the decoded image
+        :param size: size of the box the image was decoded for
+        :param image: decoded QImage
         :return:
         """
-        image_to_show = self.controller.get_current_image()
-        if image_to_show and self.rotation == 0:
-            self.qpix = QPixmap(image_to_show)
-            self.setPixmap(self.qpix.scaled(QSize(min(self.size().width(), 512), min(self.size().height(), 512)),
-                                            Qt.KeepAspectRatio, Qt.FastTransformation))
-        elif image_to_show and self.rotation != 0:
-            self.setPixmap(self.qpix.scaled(QSize(min(self.size().width(), 512), min(self.size().height(), 512)),
-                                            Qt.KeepAspectRatio, Qt.FastTransformation))
-        elif not image_to_show:
-            self.qpix = QPixmap()
-            self.setPixmap(self.qpix)
-        self.rotation = 0
-        self.image_changed.emit()
+        self.pixmap_cache.put((image_name, size), QPixmap.fromImage(image))
+        if self.controller.display_accepted(image_name, size) and image_name == self.image_shown:
+            self.update_pixmap()
+            self.controller.pixmap_loaded(image_name)
+
+    def update_pixmap(self):
+        """
+        Method that show the pixmap of the image rotated and scaled to the size of the box, computing it from the
+        decoded pixmap only if it is not cached
+        :return: True if the pixmap is shown, False if the image is not decoded yet
+        """
+        rotation = self.controller.get_current_rotation()
+        target_size = QSize(min(self.size().width(), DISPLAY_SIZE[0]), min(self.size().height(), DISPLAY_SIZE[1]))
+        key = (self.image_shown, rotation, target_size.width(), target_size.height())
+        pixmap = self.scaled_cache.get(key)
+        if pixmap is None:
+            pixmap = self.pixmap_cache.get((self.image_shown, DISPLAY_SIZE))
+            if pixmap is None:
+                self.setPixmap(QPixmap())
+                return False
+            if rotation:
+                # a rotation by a multiple of 90 degrees only moves pixels: no filtering is needed
+                pixmap = pixmap.transformed(QTransform().rotate(rotation), Qt.FastTransformation)
+            pixmap = pixmap.scaled(target_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self.scaled_cache.put(key, pixmap)
+        self.setPixmap(pixmap)
+        return True
+
+    def prefetch(self, image_name):
+        """
+        Method that decode in background an image that is likely to be shown soon, if it is not cached.
+        The decoded pixmap is stored in pixmap_cache, whose size bounds the memory used by prefetching.
+        :param image_name: name of the image
+        :return:
+        """
+        if (image_name, DISPLAY_SIZE) not in self.pixmap_cache:
+            self.loader.request_display(image_name, DISPLAY_SIZE, PRIORITY_PREFETCH)
+
+    def cancel_prefetch(self, image_name):
+        """
+        Method that cancel the decode of an image requested by prefetch, unless it is the image to show
+        :param image_name: name of the image
+        :return:
+        """
+        if image_name != self.image_shown:
+            self.loader.cancel('display', image_name, DISPLAY_SIZE)
+
+    def resizeEvent(self, e):
+        """
+        Event for the resize of the widget, the pixmap is updated once the resize stops
+        :param e: event
+        :return:
+        """
+        self.resize_timer.start()
+        super().resizeEvent(e)
 
     def rotate_to_left(self):
         """
         Method that rotate the image represented in the box to the left 90 degrees and update the box view
         :return:
         """
-        self.rotation -= 90
-        transform = QTransform().rotate(self.rotation)
-        self.qpix = self.qpix.transformed(transform, Qt.SmoothTransformation)
-        self.show_image()
+        self.controller.rotate_image(-90)
 
     def rotate_to_right(self):
         """
         Method that rotate the image represented in the box to the right 90 degrees and update the box view
         :return:
         """
-        self.rotation += 90
-        transform = QTransform().rotate(self.rotation)
-        self.qpix = self.qpix.transformed(transform, Qt.SmoothTransformation)
-        self.show_image()
+        self.controller.rotate_image(90)
 
     def dragEnterEvent(self, e):
         """
-        Event fot the drag files directly onto the widget
+        Event fot the drag files directly onto the widget. Files and folders are accepted, the images among them
+        are found by the ingestion pipeline.
         :param e: event
         :return:
         """
-        if len(e.mimeData().urls()) > 0 and e.mimeData().urls()[0].isLocalFile():
-            qi = QFileInfo(e.mimeData().urls()[0].toLocalFile())
-            ext = qi.suffix()
-            if ext == 'png' or ext == 'JPG' or ext == 'PNG' or ext == 'jpg' or ext == 'jpeg':
-                e.accept()
-            else:
-                e.ignore()
+        if any(url.isLocalFile() for url in e.mimeData().urls()):
+            e.accept()
         else:
             e.ignore()
 
     def dropEvent(self, e):
         """
-        Event for the drop files directly onto the widget
+        Event for the drop files directly onto the widget, the files are handed to the ingestion pipeline of the
+        view so that the window stays responsive however many they are
         :param e: event
         :return:
         """
-        self.rotation = 0
-        if e.mimeData().hasUrls:
+        if e.mimeData().hasUrls():
             e.setDropAction(Qt.CopyAction)
             e.accept()
-            result_op = False
-            for url in e.mimeData().urls():
-                fname = str(url.toLocalFile())
-                current_result = self.controller.insert_image(fname)
-                if not result_op and current_result:
-                    result_op = True
-            if result_op:
-                self.view.image_list.add_image()
+            self.view.ingest([url.toLocalFile() for url in e.mimeData().urls() if url.isLocalFile()])
         else:
             e.ignore()
 
-class ImageList(QListWidget):
+
+class ZoomView(QWidget):
     """
-    This class contains the list for the representation of all the images inserted in the model
+    This class contains the tiled view of the current image, which can be zoomed up to MAX_ZOOM times its full
+    resolution with the mouse wheel and panned by dragging it. Only the tiles in view are requested, at the level
+    of the TiledImage that matches the zoom; the tiles scrolled away are cancelled if not decoded yet and evicted
+    from a bounded cache otherwise. Until its tiles arrive, a region is drawn from the cached tiles of the coarser
+    levels or from the pixmap of the image box.
+
+    Attributes:
+    controller      reference to an object of class ExifController
+    loader          reference to an object of class ImageLoader, used to decode the tiles in background
+    image_box       reference to an object of class ImageBox, whose pixmaps are drawn while the tiles are decoded
+    tiled_image     reference to the object of class TiledImage of the image shown, None if no image is shown
+    scale           ratio between the size of the image in the view and its full size
+    center          point of the full size image shown at the center of the view
+    tile_cache      cache of the pixmaps of the decoded tiles, keyed by image, level, column and row
+    requested       set of the keys of the tiles requested and not delivered yet
+    drag_position   position of the mouse while the image is dragged, None otherwise
+    error           message shown instead of the image if the current image can not be tiled, None otherwise
+    """
+
+    def __init__(self, image_box, controller, tile_cache_bytes=64 * 1024 * 1024):
+        QWidget.__init__(self, image_box.view)
+        self.controller = controller
+        self.loader = controller.get_loader()
+        self.image_box = image_box
+        self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.tiled_image = None
+        self.scale = 1.0
+        self.center = QPointF()
+        self.tile_cache = LRUCache(max_entries=4096, max_bytes=tile_cache_bytes, sizeof=pixmap_size)
+        self.requested = set()
+        self.drag_position = None
+        self.error = None
+        self.loader.tile_ready.connect(self.tile_loaded)
+        self.controller.register('selection_changed', self.show_image)
+        self.controller.register('rotation_changed', self.rotate_image)
+
+    def show_image(self, image_name=None):
+        """
+        Method that show the current image fitted in the view, releasing the image shown before.
+        Nothing is done while the view is hidden.
+        It is invoked every time the selection changes.
+        :param image_name: name of the image selected
+        :return:
+        """
+        if not self.isVisible():
+            return
+        image_to_show = self.controller.get_current_image()
+        if self.tiled_image is not None and self.tiled_image.image_name == image_to_show:
+            return
+        self.release()
+        self.error = None
+        if image_to_show is not None:
+            try:
+                self.tiled_image = TiledImage(image_to_show)
+            except ImageTooLargeError as e:
+                self.error = "Immagine troppo grande per lo zoom"
+                print("Error opening " + image_to_show + ": " + str(e))
+            except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+                self.error = "Impossibile ingrandire l'immagine"
+                print("Error opening " + image_to_show + ": " + str(e))
+        self.fit()
+        self.update()
+
+    def release(self):
+        """
+        Method that stop showing the current image, cancelling its tiles and releasing its decoded level
+        :return:
+        """
+        self.loader.cancel_all('tile')
+        self.requested.clear()
+        if self.tiled_image is not None:
+            self.tiled_image.release()
+            self.tiled_image = None
+
+    def rotate_image(self, image_name, rotation):
+        """
+        Method that show the current image with its new rotation, fitted in the view.
+        It is invoked every time the current image is rotated.
+        :param image_name: name of the image
+        :param rotation: rotation of the image in degrees
+        :return:
+        """
+        self.fit()
+
+    def fit(self):
+        """
+        Method that zoom the image so that it fits the view, and center it
+        :return:
+        """
+        if self.tiled_image is not None:
+            self.scale = self.fit_scale()
+            self.center = QPointF(self.tiled_image.size[0] / 2, self.tiled_image.size[1] / 2)
+        self.load_visible()
+
+    def fit_scale(self):
+        """
+        Method that return the zoom at which the rotated image fits the view, never above the full resolution
+        :return: ratio between the size of the image in the view and its full size
+        """
+        width, height = self.tiled_image.size
+        if self.controller.get_current_rotation() % 180:
+            width, height = height, width
+        return min(self.width() / width, self.height() / height, 1.0)
+
+    def zoom_actual_size(self):
+        """
+        Method that zoom the image to its full resolution, one pixel of the image for each pixel of the screen
+        :return:
+        """
+        self.scale = 1.0
+        self.load_visible()
+
+    def transform(self):
+        """
+        Method that return the transformation from the full size image to the view
+        :return: a QTransform
+        """
+        transform = QTransform()
+        transform.translate(self.width() / 2, self.height() / 2)
+        transform.rotate(self.controller.get_current_rotation())
+        transform.scale(self.scale, self.scale)
+        transform.translate(-self.center.x(), -self.center.y())
+        return transform
+
+    def visible_tiles(self, level):
+        """
+        Method that return the tiles of a level that intersect the view
+        :param level: the level
+        :return: list of tuples (column, row)
+        """
+        inverted, _ = self.transform().inverted()
+        visible = inverted.mapRect(QRectF(self.rect()))
+        visible = visible.intersected(QRectF(0, 0, *self.tiled_image.size))
+        if visible.isEmpty():
+            return []
+        span = self.tiled_image.tile_size * 2 ** level
+        columns, rows = self.tiled_image.grid(level)
+        first_column, first_row = int(visible.left() // span), int(visible.top() // span)
+        last_column = min(int(visible.right() // span), columns - 1)
+        last_row = min(int(visible.bottom() // span), rows - 1)
+        return [(column, row) for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)]
+
+    def load_visible(self):
+        """
+        Method that request the missing tiles in view at the level that matches the zoom, cancel the requested
+        tiles no longer in view, and repaint the view
+        :return:
+        """
+        wanted = set()
+        if self.tiled_image is not None:
+            image_name = self.tiled_image.image_name
+            level = self.tiled_image.level_for_scale(self.scale)
+            for column, row in self.visible_tiles(level):
+                key = (image_name, level, column, row)
+                if key not in self.tile_cache:
+                    wanted.add(key)
+                    if key not in self.requested:
+                        self.loader.request_tile(self.tiled_image, level, column, row, PRIORITY_CURRENT)
+        for key in self.requested - wanted:
+            self.loader.cancel('tile', *key)
+        self.requested = wanted
+        self.update()
+
+    def tile_loaded(self, image_name, level, column, row, image):
+        """
+        Method that store a tile decoded by the loader and repaint the view, if the tile is still wanted.
+        It is invoked every time the loader completes the decode of a tile.
+        :param image_name: name of the image
+        :param level: level of the tile
+        :param column: column of the tile
+        :param row: row of the tile
+        :param image: decoded QImage
+        :return:
+        """
+        key = (image_name, level, column, row)
+        if key in self.requested:
+            self.requested.discard(key)
+            self.tile_cache.put(key, QPixmap.fromImage(image))
+            self.update()
+
+    def paintEvent(self, e):
+        """
+        Event for the paint of the widget, the image box pixmap is drawn first and then the cached tiles, from the
+        coarser levels to the level that matches the zoom
+        :param e: event
+        :return:
+        """
+        if self.tiled_image is None:
+            if self.error is not None:
+                QPainter(self).drawText(self.rect(), Qt.AlignCenter, self.error)
+            return
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, self.scale < 1)
+        painter.setTransform(self.transform())
+        image_name = self.tiled_image.image_name
+        preview = self.image_box.pixmap_cache.get((image_name, DISPLAY_SIZE))
+        if preview is not None:
+            painter.drawPixmap(QRectF(0, 0, *self.tiled_image.size), preview, QRectF(preview.rect()))
+        level = self.tiled_image.level_for_scale(self.scale)
+        for drawn_level in range(min(level + 2, len(self.tiled_image.levels) - 1), level - 1, -1):
+            factor = 2 ** drawn_level
+            for column, row in self.visible_tiles(drawn_level):
+                pixmap = self.tile_cache.get((image_name, drawn_level, column, row))
+                if pixmap is not None:
+                    left, top, right, bottom = self.tiled_image.tile_box(drawn_level, column, row)
+                    target = QRectF(left * factor, top * factor, (right - left) * factor, (bottom - top) * factor)
+                    painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.end()
+
+    def wheelEvent(self, e):
+        """
+        Event for the mouse wheel, the image is zoomed keeping still the point under the cursor
+        :param e: event
+        :return:
+        """
+        if self.tiled_image is None:
+            return
+        inverted, _ = self.transform().inverted()
+        anchor = inverted.map(QPointF(e.pos()))
+        self.scale = max(self.fit_scale() / 2, min(self.scale * ZOOM_STEP ** (e.angleDelta().y() / 120), MAX_ZOOM))
+        offset = QTransform().rotate(-self.controller.get_current_rotation()).map(
+            QPointF(e.pos()) - QPointF(self.width() / 2, self.height() / 2))
+        self.center = anchor - offset / self.scale
+        self.load_visible()
+
+    def mousePressEvent(self, e):
+        """
+        Event for the press of a mouse button, the left button starts dragging the image
+        :param e: event
+        :return:
+        """
+        if e.button() == Qt.LeftButton:
+            self.drag_position = e.pos()
+
+    def mouseMoveEvent(self, e):
+        """
+        Event for the move of the mouse, the image is panned while it is dragged
+        :param e: event
+        :return:
+        """
+        if self.drag_position is None or self.tiled_image is None:
+            return
+        delta = QTransform().rotate(-self.controller.get_current_rotation()).map(QPointF(e.pos() - self.drag_position))
+        self.drag_position = e.pos()
+        center = self.center - delta / self.scale
+        self.center = QPointF(min(max(center.x(), 0), self.tiled_image.size[0]),
+                              min(max(center.y(), 0), self.tiled_image.size[1]))
+        self.load_visible()
+
+    def mouseReleaseEvent(self, e):
+        """
+        Event for the release of a mouse button, the drag of the image stops
+        :param e: event
+        :return:
+        """
+        if e.button() == Qt.LeftButton:
+            self.drag_position = None
+
+    def mouseDoubleClickEvent(self, e):
+        """
+        Event for the double click, the image switches between fitted in the view and its full resolution
+        :param e: event
+        :return:
+        """
+        if self.scale < 1.0:
+            self.zoom_actual_size()
+        else:
+            self.fit()
+
+    def resizeEvent(self, e):
+        """
+        Event for the resize of the widget, the tiles that enter the view are requested
+        :param e: event
+        :return:
+        """
+        self.load_visible()
+        super().resizeEvent(e)
+
+    def showEvent(self, e):
+        """
+        Event for the show of the widget, the current image is opened
+        :param e: event
+        :return:
+        """
+        super().showEvent(e)
+        self.show_image()
+
+    def hideEvent(self, e):
+        """
+        Event for the hide of the widget, the image is released so that its tiles are not decoded in background
+        :param e: event
+        :return:
+        """
+        self.release()
+        super().hideEvent(e)
+
+
+class ImageList(QListView):
+    """
+    This class contains the list for the representation of all the images inserted in the model.
+    The list is a view of an ImageListModel with uniform item sizes, laid out in batches so that inserting or
+    filtering many rows never blocks the window: only the visible rows are painted,
+    thumbnails are requested only for the visible rows and the rows close to them, and the thumbnails of the rows
+    scrolled away are evicted from a bounded cache, so that memory does not grow with the number of images.
 
     Attributes:
     view                        reference to an object of class ExifView
@@ -121,33 +512,176 @@ class ImageList(QListWidget):
     image_box                   reference to an object of class ImageBox
     current_image_selected      image currently selected on the image list
     current_image_shown         image currently displayed on the image box
+    loader                      reference to an object of class ImageLoader, used to create thumbnails in background
+    list_model                  reference to an object of class ImageListModel, the model of the list
+    thumbnails                  cache of the pixmaps of the thumbnails of the rows shown recently
+    requested                   set of the images whose thumbnail has been requested and not delivered yet
+    visible_timer               timer that delays the request of the visible thumbnails until scrolling stops
+    prefetch_radius             number of images before and after the one shown that are loaded in advance
+    prefetched                  set of the images currently loaded in advance
+    filter_rows                 dict that associates to each image shown its row while the list is filtered, None if
+                                the list shows all the images and its rows are the positions of the images in the model
 
     """
 
-    def __init__(self, image_box, view, controller):
-        QListWidget.__init__(self, view)
+    def __init__(self, image_box, view, controller, prefetch_radius=1, thumbnail_cache_bytes=16 * 1024 * 1024):
+        QListView.__init__(self, view)
         self.setIconSize(QSize(100, 100))
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(LAYOUT_BATCH)
         self.image_box = image_box
         self.view = view
         self.controller = controller
+        self.loader = controller.get_loader()
         self.current_image_selected = None
         self.current_image_shown = None
+        self.requested = set()
+        self.prefetch_radius = prefetch_radius
+        self.prefetched = set()
+        self.filter_rows = None
+        placeholder = QPixmap(72, 72)
+        placeholder.fill(Qt.darkGray)
+        self.thumbnails = LRUCache(max_entries=4096, max_bytes=thumbnail_cache_bytes, sizeof=pixmap_size)
+        self.list_model = ImageListModel(self.thumbnails, placeholder, self)
+        self.setModel(self.list_model)
+        self.visible_timer = QTimer(self)
+        self.visible_timer.setSingleShot(True)
+        self.visible_timer.setInterval(VISIBLE_DELAY)
+        self.visible_timer.timeout.connect(self.load_visible)
+        self.loader.thumbnail_ready.connect(self.thumbnail_loaded)
+        self.horizontalScrollBar().valueChanged.connect(lambda value: self.visible_timer.start())
+        self.verticalScrollBar().valueChanged.connect(lambda value: self.visible_timer.start())
+        # the rows are laid out in batches, the range of the scroll bar grows until the layout is complete
+        self.horizontalScrollBar().rangeChanged.connect(lambda minimum, maximum: self.visible_timer.start())
+        self.verticalScrollBar().rangeChanged.connect(lambda minimum, maximum: self.visible_timer.start())
         self.view.empty_list_btn.clicked.connect(self.empty_list)
         self.view.delete_image_btn.clicked.connect(self.delete_image)
-        self.itemDoubleClicked.connect(self.load_image)
-        self.itemClicked.connect(self.click_on_image)
+        self.doubleClicked.connect(self.load_image)
+        self.clicked.connect(self.click_on_image)
+        self.controller.register('image_added', self.insert_item)
+        self.controller.register('images_added', self.insert_items)
+        self.controller.register('image_removed', self.remove_item)
+        self.controller.register('list_cleared', self.clear_items)
+        self.controller.register('pixmap_ready', self.prefetch_neighbors)
 
     def load_image(self):
         """
         Method that select a new image to the list.
         :return:
         """
-        if self.current_image_shown != self.currentRow():
-            self.current_image_shown = self.currentRow()
-            if self.image_box.rotation > 0:
-                self.image_box.rotate = 0
-            self.controller.select_image(self.current_image_shown)
-            self.image_box.show_image()
+        if self.current_image_shown != self.currentIndex().row():
+            self.current_image_shown = self.currentIndex().row()
+            self.controller.select_image(self.model_index(self.current_image_shown))
+
+    def show_next(self):
+        """
+        Method that shows the image that follows the one shown in the list
+        :return:
+        """
+        self.show_row((self.current_image_shown if self.current_image_shown is not None else -1) + 1)
+
+    def show_previous(self):
+        """
+        Method that shows the image that precedes the one shown in the list
+        :return:
+        """
+        self.show_row((self.current_image_shown if self.current_image_shown is not None else self.count()) - 1)
+
+    def count(self):
+        """
+        Method that returns the number of images in the list
+        :return: number of rows of the list
+        """
+        return self.list_model.rowCount()
+
+    def set_current_row(self, row):
+        """
+        Method that makes current the row of the list, or no row
+        :param row: row to make current, None to clear the current row
+        :return:
+        """
+        self.setCurrentIndex(self.list_model.index(row) if row is not None else QModelIndex())
+
+    def model_index(self, row):
+        """
+        Method that returns the position in the model of the image at a row of the list
+        :param row: row of the image, or None
+        :return: position of the image in the model, None if row is None
+        """
+        if row is None or self.filter_rows is None:
+            return row
+        return self.controller.get_image_index(self.list_model.image(row))
+
+    def row_of(self, image):
+        """
+        Method that returns the row of the list that shows an image
+        :param image: name of the image
+        :return: row of the image, None if the image is not shown
+        """
+        if image is None:
+            return None
+        if self.filter_rows is not None:
+            return self.filter_rows.get(image)
+        try:
+            return self.controller.get_image_index(image)
+        except ValueError:
+            return None
+
+    def set_filter(self, images):
+        """
+        Method that shows only some of the images of the model, in the order of the model or in a given order, or all
+        of them. The rows are replaced only if they change, and the current image stays current if it is shown.
+        :param images: set of names of the images to show in the order of the model, list of names of the images in
+                       the order to show them, None to show all the images
+        :return:
+        """
+        all_images = self.controller.get_images()
+        if images is None:
+            shown = list(all_images)
+            self.filter_rows = None
+        else:
+            shown = list(images) if isinstance(images, list) else [image for image in all_images if image in images]
+            self.filter_rows = {image: row for row, image in enumerate(shown)}
+        if shown != self.list_model.images:
+            self.list_model.set_images(shown)
+            self.visible_timer.start()
+        row = self.row_of(self.controller.get_current_image())
+        self.current_image_shown = self.current_image_selected = row
+        self.set_current_row(row)
+
+    def show_row(self, row):
+        """
+        Method that selects and shows the image at a row of the list, if the row exists
+        :param row: row of the image
+        :return:
+        """
+        if 0 <= row < self.count():
+            self.set_current_row(row)
+            self.click_on_image()
+            self.load_image()
+
+    def prefetch_neighbors(self, image_name):
+        """
+        Method that loads in advance the images around the one shown, so that moving to them is instant,
+        and cancels the loads of the images that are no longer around it.
+        It is invoked every time the selected image is shown.
+        :param image_name: name of the image shown
+        :return:
+        """
+        images = self.list_model.images
+        current_row = self.row_of(image_name)
+        neighbors = set()
+        if current_row is not None:
+            for row in range(current_row - self.prefetch_radius, current_row + self.prefetch_radius + 1):
+                if 0 <= row < len(images) and row != current_row:
+                    neighbors.add(images[row])
+        for image in self.prefetched - neighbors:
+            self.image_box.cancel_prefetch(image)
+        for image in neighbors:
+            self.image_box.prefetch(image)
+            self.controller.prefetch_image(image)
+        self.prefetched = neighbors
 
     def empty_list(self):
         """
@@ -155,7 +689,7 @@ class ImageList(QListWidget):
         :return:
         """
         self.controller.empty_list()
-        self.populate()
+        self.update_controls()
         self.current_image_selected = 0
         self.current_image_shown = 0
 
@@ -165,50 +699,175 @@ class ImageList(QListWidget):
         :return:
         """
         self.view.delete_image_btn.setEnabled(True)
-        self.current_image_selected = self.currentRow()
+        self.current_image_selected = self.currentIndex().row()
 
     def delete_image(self):
         """
-        Method that removes an element from the list
+        Method that removes an element from the list, if one is selected
         :return:
         """
-        self.controller.remove_image(self.current_image_selected)
+        if self.current_image_selected is None or not 0 <= self.current_image_selected < self.count():
+            return
+        self.controller.remove_image(self.model_index(self.current_image_selected))
         if self.current_image_shown == self.current_image_selected:
             self.current_image_shown = None
-        if self.count() > 2:
+        if self.count() > 1:
             self.current_image_selected = self.current_image_selected-1
-        elif self.count() == 2:
+        elif self.count() == 1:
             self.current_image_selected = 0
         else:
             self.current_image_selected = None
-        self.populate()
-        self.setCurrentRow(self.current_image_selected)
+        self.update_controls()
+        self.set_current_row(self.current_image_selected)
 
     def add_image(self):
         """
         Method that adds an element to the list
         :return:
         """
-        self.populate()
-        self.image_box.rotation = 0
+        self.update_controls()
         self.current_image_shown = self.count() - 1
         self.current_image_selected = self.count() - 1
-        self.setCurrentRow(self.count() - 1)
+        self.set_current_row(self.count() - 1)
 
-    def populate(self):
+    def insert_item(self, index, image):
         """
-        Method that updates the list with the controller contents
+        Method that inserts into the list the row of an image added to the model.
+        It is invoked every time an image is added to the model.
+        :param index: position of the image in the model
+        :param image: name of the image
+        :return:
+        """
+        if self.filter_rows is not None:
+            return
+        self.list_model.insert_image(index, image)
+        self.visible_timer.start()
+
+    def insert_items(self, index, images):
+        """
+        Method that inserts into the list the rows of a batch of images added to the model.
+        It is invoked every time a batch of images is added to the model.
+        :param index: position of the first image in the model
+        :param images: list of names of the images
+        :return:
+        """
+        self.update_controls()
+        if self.filter_rows is not None:
+            return
+        self.list_model.insert_images(index, images)
+        self.visible_timer.start()
+
+    def remove_item(self, index, image):
+        """
+        Method that removes from the list the row of an image removed from the model.
+        It is invoked every time an image is removed from the model.
+        :param index: position of the image in the model
+        :param image: name of the image
+        :return:
+        """
+        if self.filter_rows is None:
+            self.list_model.remove_image(index)
+        elif image in self.filter_rows:
+            self.list_model.remove_image(self.filter_rows[image])
+            self.filter_rows = {shown: row for row, shown in enumerate(self.list_model.images)}
+        if image in self.requested:
+            self.requested.discard(image)
+            self.loader.cancel('thumbnail', image)
+        self.visible_timer.start()
+
+    def clear_items(self):
+        """
+        Method that removes all the rows from the list.
+        It is invoked every time the model is emptied.
+        :return:
+        """
+        self.loader.cancel_all('thumbnail')
+        self.requested.clear()
+        self.list_model.clear()
+        if self.filter_rows is not None:
+            self.filter_rows = {}
+
+    def thumbnail_loaded(self, image, thumbnail):
+        """
+        Method that stores the thumbnail of an image and refreshes its row, if the thumbnail is still wanted.
+        It is invoked every time the loader completes a thumbnail.
+        :param image: name of the image
+        :param thumbnail: QImage of the thumbnail
+        :return:
+        """
+        row = self.row_of(image)
+        if image in self.requested and row is not None:
+            self.requested.discard(image)
+            self.list_model.set_thumbnail(row, QPixmap.fromImage(thumbnail))
+
+    def visible_rows(self):
+        """
+        Method that finds the rows of the list that intersect the viewport. Since the items have uniform sizes and
+        are laid out in order along the flow of the list, the bounds are found by binary search.
+        :return: tuple with the first visible row and the row after the last visible one
+        """
+        viewport = self.viewport().rect()
+        horizontal = self.flow() == QListView.LeftToRight
+
+        def before(row):
+            rect = self.visualRect(self.list_model.index(row))
+            return rect.right() < viewport.left() if horizontal else rect.bottom() < viewport.top()
+
+        def after(row):
+            rect = self.visualRect(self.list_model.index(row))
+            return rect.left() > viewport.right() if horizontal else rect.top() > viewport.bottom()
+
+        first, last = 0, self.count()
+        while first < last:
+            middle = (first + last) // 2
+            if before(middle):
+                first = middle + 1
+            else:
+                last = middle
+        end = self.count()
+        while last < end:
+            middle = (last + end) // 2
+            if after(middle):
+                end = middle
+            else:
+                last = middle + 1
+        return first, last
+
+    def load_visible(self):
+        """
+        Method that requests the thumbnails of the visible rows and of a page of rows on each side of them,
+        and cancels the requests of the rows scrolled away.
+        It is invoked every time the list stops scrolling or its rows change.
+        :return:
+        """
+        first, end = self.visible_rows()
+        page = max(end - first, 1)
+        wanted = set()
+        for row in range(max(first - page, 0), min(end + page, self.count())):
+            image = self.list_model.image(row)
+            wanted.add(image)
+            if image not in self.thumbnails and image not in self.requested:
+                self.requested.add(image)
+                self.loader.request_thumbnail(image, PRIORITY_VISIBLE if first <= row < end else PRIORITY_PREFETCH)
+        for image in self.requested - wanted:
+            self.requested.discard(image)
+            self.loader.cancel('thumbnail', image)
+
+    def resizeEvent(self, e):
+        """
+        Event for the resize of the widget, the visible thumbnails are requested once the resize stops
+        :param e: event
+        :return:
+        """
+        self.visible_timer.start()
+        super().resizeEvent(e)
+
+    def update_controls(self):
+        """
+        Method that updates the buttons with the controller contents
         :return:
         """
-        self.clear()
         images = self.controller.get_images()
-        for image in images:
-            picture = Image.open(image)
-            picture.thumbnail((72, 72), Image.ANTIALIAS)
-            icon = QIcon(QPixmap.fromImage(QImage(picture.filename)))
-            item = QListWidgetItem(self)
-            item.setToolTip(image)
-            item.setIcon(icon)
         if len(images) and (not self.view.empty_list_btn.isEnabled() or not self.view.delete_image_btn.isEnabled()):
             self.view.empty_list_btn.setEnabled(True)
             self.view.delete_image_btn.setEnabled(True)
@@ -217,15 +876,18 @@ class ImageList(QListWidget):
             self.current_image_selected = 0
             self.view.delete_image_btn.setEnabled(False)
             self.view.empty_list_btn.setEnabled(False)
-        self.image_box.show_image()
 
 class DataTab(QTabWidget):
     """
-    This class contains the tab for displaying info and exif of an image selected in the ImageList
+    This class contains the tab for displaying info and exif of an image selected in the ImageList.
+    Each tab shows its data in a tree view backed by a MetadataTreeModel, so rows are created only when they are
+    expanded and values are formatted only when they are displayed.
 
     Attributes:
     view                        reference to an object of class ExifView
     controller                  reference to an object of class ExifController
+    info_model                  item model of the info of the current image
+    exif_model                  item model of the exif of the current image
 
     and other graphical elements
     """
@@ -235,6 +897,9 @@ class DataTab(QTabWidget):
         self.setMinimumSize(300, 400)
         self.view = view
         self.controller = controller
+        self.info_model = MetadataTreeModel("Data", self)
+        self.exif_model = MetadataTreeModel("Data", self)
+        self.init_data_tab()
 
     def init_data_tab(self):
         """
@@ -243,105 +908,85 @@ class DataTab(QTabWidget):
         """
         self.clear()
 
-        self.tab_info = QWidget()
-        self.tab_exif = QWidget()
+        self.tab_info, self.info_tree, self.info_label = self.__create_tab(self.info_model)
+        self.tab_exif, self.exif_tree, self.exif_label = self.__create_tab(self.exif_model)
 
         self.addTab(self.tab_info, "Info")
         self.addTab(self.tab_exif, "EXIF")
 
-    def update_tab_value(self):
+    def __create_tab(self, model):
+        """
+        Method that create a tab with a tree view of a model and the label shown when the model is empty
+        :param model: item model shown by the tree view
+        :return: tuple with the tab, the tree view and the label
+        """
+        tab = QWidget()
+        tree = QTreeView()
+        tree.setUniformRowHeights(True)
+        tree.setModel(model)
+        tree.hide()
+        model.rowsInserted.connect(lambda parent, first, last: self.expand_rows(tree, parent, first, last))
+        label = QLabel()
+        label.setAlignment(Qt.AlignCenter)
+        label.hide()
+        layout = QVBoxLayout()
+        layout.addWidget(tree)
+        layout.addWidget(label)
+        tab.setLayout(layout)
+        return tab, tree, label
+
+    def expand_rows(self, tree, parent, first, last):
+        """
+        Method that expand the keys fetched by a tree view, so that their values are shown as soon as they appear.
+        It is invoked every time rows are inserted in the model of the tree view.
+        :param tree: tree view whose model inserted the rows
+        :param parent: index of the parent of the rows
+        :param first: first inserted row
+        :param last: last inserted row
+        :return:
+        """
+        if parent.isValid():
+            return
+        model = tree.model()
+        for row in range(first, last + 1):
+            tree.expand(model.index(row, 0, parent))
+
+    def update_tab_value(self, image_name=None):
         """
-        Method that update the data tab with the selected image data
+        Method that update the data tab with the selected image data.
+        It is invoked every time the metadata of the current image are available.
+        :param image_name: name of the image the metadata belong to
         :return:
         """
-        self.init_data_tab()
         info, exif = self.controller.get_current_data()
-        self.__update_info(info)
-        self.__update_exif(exif)
+        self.__update_tree(self.info_model, self.info_tree, self.info_label, info,
+                           "Nessuna informazione disponibile per questo file" if info is not None else "")
+        self.__update_tree(self.exif_model, self.exif_tree, self.exif_label, exif,
+                           "Nessun EXIF disponibile per questo file" if exif is not None else "")
 
-    def __update_info(self, info):
+    def show_loading(self, image_name=None):
         """
-        Method that update the info tab
-        :param info: info of the image selected
+        Method that empty the data tab as soon as the selection changes, showing that the metadata of the new image
+        are being loaded, so that the data of the previous image are never shown with it.
+        It is invoked every time the selection changes.
+        :param image_name: name of the image selected, None if the selection is empty
         :return:
         """
-        if info is not None:
-            layout = QVBoxLayout()
-            if len(info):
-                info_tree = QTreeWidget()
-                self.fill_widget(info_tree, info)
-                info_tree.setHeaderLabel("Data")
-            else:
-                info_tree = QLabel()
-                info_tree.setAlignment(Qt.AlignCenter)
-                info_tree.setText("Nessuna informazione disponibile per questo file")
-
-            layout.addWidget(info_tree)
+        text = LOADING_TEXT if image_name is not None else ""
+        self.__update_tree(self.info_model, self.info_tree, self.info_label, None, text)
+        self.__update_tree(self.exif_model, self.exif_tree, self.exif_label, None, text)
 
-            self.setTabText(0, "Info")
-            self.tab_info.setLayout(layout)
-
-    def __update_exif(self, exif):
+    def __update_tree(self, model, tree, label, data, text):
         """
-        Method that update the exif tab
-        :exif info: exif of the image selected
+        Method that show data in a tab, or the label of the tab if data is empty or not available
+        :param model: item model of the tab
+        :param tree: tree view of the tab
+        :param label: label of the tab
+        :param data: dict of data of the image selected, None if no image is selected or its data are not loaded
+        :param text: text of the label, shown if data is empty or not available
         :return:
         """
-        if exif is not None:
-            layout = QVBoxLayout()
-            if len(exif):
-                exif_tree = QTreeWidget()
-                self.fill_widget(exif_tree, exif)
-                exif_tree.setHeaderLabel("Data")
-            else:
-                exif_tree = QLabel()
-                exif_tree.setAlignment(Qt.AlignCenter)
-                exif_tree.setText("Nessun EXIF disponibile per questo file")
-
-            layout.addWidget(exif_tree)
-
-            self.setTabText(1, "EXIF")
-            self.tab_exif.setLayout(layout)
-
-    def fill_widget(self, widget, value):
-        """
-        Method that populate the single widget that compose the data tab
-        :param widget: widget to update
-        :param value: value to set for the widget
-        :return:
-        """
-        self.widget = widget
-        self.widget.clear()
-        self.fill_item(self.widget.invisibleRootItem(), value)
-
-    def fill_item(self, item, value):
-        """
-        Method that populate the single item that compose the data tab
-        :param widget: item to update
-        :param value: value to set for the item
-        :return:
-        """
-        item.setExpanded(True)
-        if type(value) is dict:
-            for key, val in value.items():
-                child = QTreeWidgetItem()
-                child.setText(0, str(key))
-                item.addChild(child)
-                self.fill_item(child, val)
-        elif type(value) is list:
-            for val in value:
-                child = QTreeWidgetItem()
-                item.addChild(child)
-                if type(val) is dict:
-                    child.setText(0, '[dict]')
-                    self.fill_item(child, val)
-                elif type(val) is list:
-                    child.setText(0, '[list]')
-                    self.fill_item(child, val)
-                else:
-                    child.setText(0, str(val))
-                    child.setExpanded(True)
-        else:
-            child = QTreeWidgetItem()
-            child.setText(0, str(value))
-            item.addChild(child)
+        model.set_data(data)
+        tree.setVisible(bool(data))
+        label.setText(text)
+        label.setVisible(not data and bool(text))
@@ -0,0 +1,204 @@
+import argparse
+import collections
+import contextlib
+import csv
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL.TiffImagePlugin import IFDRational
+
+from ExifModel import extract_metadata
+from ExifScanner import batches, scan_images
+
+
+def plain_value(value):
+    """
+    Function that convert a metadata value into a plain JSON value: rationals become floats, bytes become
+    hexadecimal strings, tuples become lists and dict keys become strings
+    :param value: value to convert
+    :return: JSON serializable object
+    """
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, IFDRational):
+        return float(value) if value.denominator else None
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    if isinstance(value, (tuple, list)):
+        return [plain_value(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): plain_value(v) for k, v in value.items()}
+    return str(value)
+
+
+def export_metadata(image_name):
+    """
+    Function run in a worker process that extract the metadata of an image.
+    Messages printed by the extraction go to stderr, so they never mix with the exported records.
+    :param image_name: path of the image
+    :return: tuple with the path, the record of the image and the error message, one of the two is None
+    """
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            metadata = extract_metadata(image_name)
+    except Exception as e:
+        return image_name, None, "%s: %s" % (type(e).__name__, e)
+    record = {'path': image_name, 'info': plain_value(metadata.info), 'exif': plain_value(metadata.exif),
+              'geo': plain_value(metadata.geo)}
+    return image_name, record, None
+
+
+def export_chunk(image_names):
+    """
+    Function run in a worker process that extract the metadata of a chunk of images, so that the cost of sending
+    work to the process is shared by all of them
+    :param image_names: list of paths of images
+    :return: list of the results of export_metadata, in the same order
+    """
+    return [export_metadata(image_name) for image_name in image_names]
+
+
+def expand_paths(paths, recursive=True):
+    """
+    Generator that yield the files given on the command line in their order, replacing each directory with the
+    images it contains
+    :param paths: list of paths of files and directories
+    :param recursive: if False the subdirectories are not visited
+    :return: generator of paths of files
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            yield from scan_images(path, recursive)
+        else:
+            yield path
+
+
+def ordered_results(function, items, workers, window):
+    """
+    Generator that apply a function to items on a process pool and yield the results in the order of the items.
+    At most window items are in flight at any time, so memory stays bounded whatever the number of items.
+    :param function: function to apply, which must be picklable
+    :param items: iterable of arguments of the function
+    :param workers: number of worker processes, 1 to run in this process
+    :param window: maximum number of submitted items whose result has not been yielded yet
+    :return: generator of results
+    """
+    if workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = collections.deque()
+        for item in items:
+            if len(in_flight) >= window:
+                yield in_flight.popleft().result()
+            in_flight.append(executor.submit(function, item))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class JsonLinesWriter:
+    """
+    This class contains the writer of the records as JSON lines, one object per image
+
+    Attributes:
+    output      text stream the records are written to
+    """
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, record):
+        """
+        Method that write the record of an image
+        :param record: dict with path, info, exif and geo of the image
+        :return:
+        """
+        self.output.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+class CsvWriter:
+    """
+    This class contains the writer of the records as CSV rows in long format, one row per tag, so that the
+    columns are known before the first image is read
+
+    Attributes:
+    writer      csv writer of the output stream
+    """
+    COLUMNS = ('path', 'section', 'tag', 'value')
+
+    def __init__(self, output):
+        self.writer = csv.writer(output)
+        self.writer.writerow(self.COLUMNS)
+
+    def write(self, record):
+        """
+        Method that write the rows of the record of an image
+        :param record: dict with path, info, exif and geo of the image
+        :return:
+        """
+        for section in ('info', 'exif', 'geo'):
+            for tag, value in (record[section] or {}).items():
+                if not isinstance(value, str):
+                    value = json.dumps(value, ensure_ascii=False)
+                self.writer.writerow((record['path'], section, tag, value))
+
+
+def main(argv=None):
+    """
+    Function that export the metadata of the images given on the command line, extracting them on a process pool
+    and writing the records in the order of the images. Errors of extraction are reported on stderr with a summary
+    of the run.
+    :param argv: list of the arguments of the command line, those of the process if not given
+    :return: exit status, 1 if some image could not be exported or the output was closed, 0 otherwise
+    """
+    parser = argparse.ArgumentParser(description="Export info, EXIF and GPS metadata of images without a display")
+    parser.add_argument('paths', nargs='+', help="images, or folders whose images are exported")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl', help="format of the output")
+    parser.add_argument('-o', '--output', help="file the output is written to, standard output if not given")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes, 1 to extract in the main process")
+    parser.add_argument('--chunk-size', type=int, default=64, help="number of images sent to a worker at a time")
+    parser.add_argument('--window', type=int, default=None,
+                        help="maximum number of chunks in flight, 4 per worker if not given")
+    parser.add_argument('--no-recursive', dest='recursive', action='store_false',
+                        help="do not visit the subfolders of the given folders")
+    args = parser.parse_args(argv)
+    window = args.window or max(args.workers, 1) * 4
+
+    output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    writer = CsvWriter(output) if args.format == 'csv' else JsonLinesWriter(output)
+    exported = failed = 0
+    start = time.perf_counter()
+    try:
+        chunks = batches(expand_paths(args.paths, args.recursive), args.chunk_size, interval=float('inf'))
+        for results in ordered_results(export_chunk, chunks, args.workers, window):
+            for image_name, record, error in results:
+                if error is not None:
+                    failed += 1
+                    print("Error of extraction for %s: %s" % (image_name, error), file=sys.stderr)
+                else:
+                    exported += 1
+                    writer.write(record)
+        output.flush()
+    except BrokenPipeError:
+        # the reader of the output has gone away, as with "| head": silence the flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print("%d files exported, %d errors in %.2f s (%.1f files/s)"
+          % (exported, failed, elapsed, (exported + failed) / elapsed if elapsed else 0.0), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
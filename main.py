@@ -1,21 +1,52 @@
+import argparse
 import os
 import sys
 
 import qdarkstyle
 from PyQt5.QtWidgets import QApplication
 
+from ExifCache import ThumbnailCache
+from ExifIndex import MetadataIndex
+from ExifLoader import ImageLoader
 from ExifModel import ExifModel
 from ExifController import ExifController
 from ExifView import ExifView
 
 os.environ['QT_MAC_WANTS_LAYER'] = '1'
 
+
+def print_loader_stats(loader):
+    """
+    Function that print the throughput of the loader for each kind of job
+    :param loader: reference to an object of class ImageLoader
+    :return:
+    """
+    for kind, stats in sorted(loader.stats().items()):
+        print("%s backend, %s: %d jobs, %.1f ms per job" % (loader.backend.name, kind, stats['jobs'],
+                                                            stats['mean_ms']))
+
+
 if __name__ == '__main__':
 
-    model = ExifModel()
-    controller = ExifController(model)
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="EXIF Viewer")
+    parser.add_argument('--decoder', choices=['thread', 'process'], default='thread',
+                        help="decode images in worker threads or in worker processes")
+    parser.add_argument('--stats', action='store_true', help="print decode timings on exit")
+    parser.add_argument('--display-cache-mb', type=int, default=96,
+                        help="memory budget in MB of the decoded images, prefetched ones included")
+    args, qt_args = parser.parse_known_args()
+
+    model = ExifModel(index=MetadataIndex.open_default())
+    app = QApplication(sys.argv[:1] + qt_args)
+    loader = ImageLoader(model, thumbnail_cache=ThumbnailCache.open_default(),
+                         backend=ImageLoader.create_backend(args.decoder))
+    if args.stats:
+        app.aboutToQuit.connect(lambda: print_loader_stats(loader))
+    controller = ExifController(model, loader)
+    app.aboutToQuit.connect(loader.shutdown)
+    app.aboutToQuit.connect(model.close)
     app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
-    window = ExifView(controller)
+    window = ExifView(controller, display_cache_bytes=args.display_cache_mb * 1024 * 1024)
+    app.aboutToQuit.connect(window.cancel_import)
 
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,135 @@
+import unittest
+
+from ExifColumns import ColumnStore
+from ExifModel import ImageMetadata
+from ExifSearch import GROUP_FIELD, QueryError, SORT_FIELD, SearchIndex, parse_query
+
+
+class QueryTest(unittest.TestCase):
+    """
+    This class contains the tests of the parsing of the queries
+    """
+
+    def test_parses_fields(self):
+        self.assertEqual(parse_query('make:canon iso>3200 date:2021-03'),
+                         [('make', ':', 'canon'), ('iso', '>', (3200.0,)), ('date', ':', ('2021:03',))])
+        self.assertEqual(parse_query('iso> 3200 nikon'), [('iso', '>', (3200.0,)), (None, ':', 'nikon')])
+
+    def test_refuses_field_without_value(self):
+        for text in ('iso>', 'f<=', 'make:canon date:'):
+            with self.assertRaises(QueryError, msg=text):
+                parse_query(text)
+
+    def test_refuses_invalid_dates(self):
+        for text in ('date:2021-13', 'date:2021-00', 'date:2021-04-31', 'date:2021-02-29', 'date:2021-03..2021-04-0'):
+            with self.assertRaises(QueryError, msg=text):
+                parse_query(text)
+        self.assertEqual(parse_query('date:2020-02-29'), [('date', ':', ('2020:02:29',))])
+
+    def test_parses_near_an_image(self):
+        self.assertEqual(parse_query('near:"/foto/a b,c.jpg",10 canon'),
+                         [('near', '=', ('/foto/a b,c.jpg', 10.0)), (None, ':', 'canon')])
+        self.assertEqual(parse_query('near:43.5,11,2.5'), [('near', '=', (43.5, 11.0, 2.5))])
+        for text in ('near:"/foto/a.jpg"', 'near:"/foto/a.jpg",0', 'box:"/foto/a.jpg",10'):
+            with self.assertRaises(QueryError, msg=text):
+                parse_query(text)
+
+
+class SortTest(unittest.TestCase):
+    """
+    This class contains the tests of the ordering of the images by the time they were taken
+    """
+
+    def setUp(self):
+        self.store = ColumnStore(capacity=2)
+        self.store.add('/b.jpg', ImageMetadata(exif={'DateTimeOriginal': '2021:03:14 10:00:00'}))
+        self.store.add('/undated.jpg', ImageMetadata(exif={'Make': 'Canon'}))
+        self.store.add('/a.jpg', ImageMetadata(exif={'DateTime': '2020:01:01 08:00:00'}))
+        self.store.add('/c.jpg', ImageMetadata(exif={'DateTimeOriginal': '2022:07:01 18:30:00'}))
+
+    def test_parses_sort_field(self):
+        self.assertEqual(parse_query('make:canon sort:date'), [('make', ':', 'canon'), (SORT_FIELD, '=', False)])
+        self.assertEqual(parse_query('sort:-date'), [(SORT_FIELD, '=', True)])
+        with self.assertRaises(QueryError):
+            parse_query('sort:iso')
+
+    def test_sorts_by_capture_time_with_undated_images_last(self):
+        self.assertEqual(self.store.sort_by_capture_time(), ['/a.jpg', '/b.jpg', '/c.jpg', '/undated.jpg'])
+        self.assertEqual(self.store.sort_by_capture_time(descending=True),
+                         ['/c.jpg', '/b.jpg', '/a.jpg', '/undated.jpg'])
+
+    def test_sort_follows_removed_rows(self):
+        self.store.remove('/b.jpg')
+        self.assertEqual(sorted(self.store.image_names().tolist()), ['/a.jpg', '/c.jpg', '/undated.jpg'])
+        self.assertEqual(self.store.sort_by_capture_time(descending=True), ['/c.jpg', '/a.jpg', '/undated.jpg'])
+
+
+class IndexTest(unittest.TestCase):
+    """
+    This class contains the tests of the search index built on the column store
+    """
+
+    def setUp(self):
+        self.index = SearchIndex(ColumnStore(capacity=2))
+        for name, make, iso, date in (('/a.jpg', 'Canon', 100, '2021:03:01 10:00:00'),
+                                      ('/b.jpg', 'NIKON CORPORATION', 3200, '2021:03:31 23:59:59'),
+                                      ('/c.jpg', ' canon\x00', 6400, '2021:04:01 00:00:00'),
+                                      ('/d.jpg', None, None, None)):
+            exif = {tag: value for tag, value in (('Make', make), ('ISOSpeedRatings', iso),
+                                                  ('DateTimeOriginal', date)) if value is not None}
+            self.index.add(name, ImageMetadata(exif=exif))
+
+    def search(self, text):
+        return self.index.search(parse_query(text))
+
+    def test_answers_conditions_from_the_columns(self):
+        self.assertEqual(self.search('make=canon'), {'/a.jpg', '/c.jpg'})
+        self.assertEqual(self.search('iso>100'), {'/b.jpg', '/c.jpg'})
+        self.assertEqual(self.search('iso<=3200'), {'/a.jpg', '/b.jpg'})
+        self.assertEqual(self.search('date:2021-03'), {'/a.jpg', '/b.jpg'})
+        self.assertEqual(self.search('date>2021-03 canon'), {'/c.jpg'})
+        self.assertEqual(self.search('iso:100..6400 date<2021-04'), {'/a.jpg', '/b.jpg'})
+        self.assertEqual(self.search(''), {'/a.jpg', '/b.jpg', '/c.jpg', '/d.jpg'})
+
+    def test_follows_removed_and_replaced_images(self):
+        self.index.remove('/a.jpg')
+        self.index.add('/b.jpg', ImageMetadata(exif={'Make': 'Canon', 'ISOSpeedRatings': 50}))
+        self.assertEqual(self.search('canon'), {'/b.jpg', '/c.jpg'})
+        self.assertEqual(self.search('iso<100'), {'/b.jpg'})
+        self.assertEqual(self.search('date:2021'), {'/c.jpg'})
+        self.assertNotIn('nikon corporation', self.index.postings['Make'])
+
+
+class GroupTest(unittest.TestCase):
+    """
+    This class contains the tests of the grouping of the images by camera
+    """
+
+    def setUp(self):
+        self.store = ColumnStore(capacity=2)
+        for name, make, model in (('/1.jpg', 'Canon', 'EOS R5'), ('/2.jpg', 'NIKON', 'Z 6'),
+                                  ('/3.jpg', 'Canon', 'EOS R5'), ('/4.jpg', 'Canon', 'EOS 80D'),
+                                  ('/5.jpg', None, None), ('/6.jpg', 'NIKON', None)):
+            exif = {tag: value for tag, value in (('Make', make), ('Model', model)) if value is not None}
+            self.store.add(name, ImageMetadata(exif=exif))
+
+    def test_parses_group_field(self):
+        self.assertEqual(parse_query('group:camera iso>100'), [(GROUP_FIELD, '=', 'camera'), ('iso', '>', (100.0,))])
+        with self.assertRaises(QueryError):
+            parse_query('group:lens')
+
+    def test_groups_by_camera(self):
+        self.assertEqual(self.store.group_by_camera(),
+                         {('Canon', 'EOS R5'): ['/1.jpg', '/3.jpg'], ('Canon', 'EOS 80D'): ['/4.jpg'],
+                          ('NIKON', 'Z 6'): ['/2.jpg'], ('NIKON', None): ['/6.jpg'], (None, None): ['/5.jpg']})
+
+    def test_counts_some_images(self):
+        self.store.remove('/1.jpg')
+        self.assertEqual(self.store.count_by('Make', 'Model', images={'/1.jpg', '/2.jpg', '/3.jpg', '/4.jpg'}),
+                         {('Canon', 'EOS R5'): 1, ('Canon', 'EOS 80D'): 1, ('NIKON', 'Z 6'): 1})
+        self.assertEqual(self.store.count_by('Make'), {('Canon',): 2, ('NIKON',): 2, (None,): 1})
+        self.assertEqual(self.store.group_by_camera(images=set()), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
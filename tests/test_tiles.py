@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+import ExifTiles
+from ExifTiles import ImageTooLargeError, TiledImage
+
+
+class TiledImageTest(unittest.TestCase):
+    """
+    This class contains the tests of the opening and of the levels of the tiled images
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save(self, name, size, mode='L'):
+        path = os.path.join(self.directory, name)
+        Image.new(mode, size, 128).save(path)
+        return path
+
+    def test_opens_image_above_pillow_limit(self):
+        # 13500 x 13500 is above twice the default limit of Pillow, where Image.open raises instead of warning
+        path = self.save('scan.jpg', (13500, 13500))
+        with self.assertRaises(Image.DecompressionBombError):
+            Image.open(path)
+        tiled_image = TiledImage(path)
+        self.assertEqual(tiled_image.size, (13500, 13500))
+        level = len(tiled_image.levels) - 1
+        self.assertEqual(tiled_image.decode_tile(level, 0, 0).size, tiled_image.levels[level])
+        self.assertIsNotNone(Image.MAX_IMAGE_PIXELS)
+
+    def test_jpeg_levels_stay_under_the_cap(self):
+        path = self.save('photo.jpg', (4000, 3000))
+        tiled_image = TiledImage(path, max_level_pixels=1000000)
+        self.assertGreater(tiled_image.min_level, 0)
+        self.assertLessEqual(tiled_image.decode_pixels(tiled_image.min_level), 1000000)
+        self.assertEqual(tiled_image.level_for_scale(1.0), tiled_image.min_level)
+
+    def test_refuses_png_above_the_cap(self):
+        path = self.save('panorama.png', (4000, 3000))
+        with self.assertRaises(ImageTooLargeError):
+            TiledImage(path, max_level_pixels=1000000)
+        self.assertEqual(TiledImage(path, max_level_pixels=12000000).min_level, 0)
+
+    def test_reads_uncompressed_tiff_by_region(self):
+        path = os.path.join(self.directory, 'scan.tif')
+        pixels = (np.arange(3000 * 2000 * 3) % 251).astype(np.uint8).reshape(2000, 3000, 3)
+        Image.fromarray(pixels).save(path)
+        # the whole image is 6 megapixels, a tile of level 0 decodes only the rows it crosses
+        tiled_image = TiledImage(path, max_level_pixels=2000000)
+        self.assertIsNotNone(tiled_image.row_bytes)
+        self.assertEqual(tiled_image.min_level, 0)
+        left, top, right, bottom = tiled_image.tile_box(0, 5, 3)
+        self.assertTrue(np.array_equal(np.asarray(tiled_image.decode_tile(0, 5, 3)), pixels[top:bottom, left:right]))
+        left, top, right, bottom = tiled_image.tile_box(1, 2, 1)
+        reduced = np.asarray(Image.fromarray(pixels).reduce(2))
+        self.assertTrue(np.array_equal(np.asarray(tiled_image.decode_tile(1, 2, 1)), reduced[top:bottom, left:right]))
+
+    def test_caches_reduced_levels(self):
+        path = self.save('panorama.png', (3000, 2000))
+        tiled_image = TiledImage(path)
+        with mock.patch('ExifTiles.open_image', wraps=ExifTiles.open_image) as open_image:
+            tiled_image.decode_tile(3, 0, 0)
+            self.assertEqual(open_image.call_count, 1)
+            for level in (1, 2, 4, 3):
+                tiled_image.decode_tile(level, 0, 0)
+            self.assertEqual(open_image.call_count, 1)
+            tiled_image.release()
+            tiled_image.decode_tile(2, 0, 0)
+            self.assertEqual(open_image.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()